@@ -1,3 +1,5 @@
+import inspect
+import functools
 import tensorflow as tf
 import tensorflow.python.keras.backend as K
 from tensorflow.python.keras.layers import Input
@@ -18,6 +20,12 @@ from models.encoder_decoder import recurrent_image_encoder
 from models.encoder_decoder import load_recurrent_encoder
 from models.encoder_decoder import repeat_skips
 from models.encoder_decoder import slice_skips
+from models.light_encoder_decoder import image_encoder_light
+from models.light_encoder_decoder import load_encoder_light
+from models.light_encoder_decoder import recurrent_image_encoder_light
+from models.light_encoder_decoder import load_recurrent_encoder_light
+from models.light_encoder_decoder import image_decoder_light
+from models.light_encoder_decoder import load_decoder_light
 from models.action_net import action_net
 from models.action_net import load_action_net
 from models.action_net import load_recurrent_action_net
@@ -25,8 +33,27 @@ from models.action_net import recurrent_action_net
 from models.lstm import lstm_gaussian
 from models.lstm import load_lstm
 from models.lstm import lstm_initial_state_zeros
+from models.roi_encoder import RoiObjectEncoder
+from models.roi_encoder import roi_crop_encoder
+from models.roi_encoder import load_roi_encoder
+from models.precision import build_with_precision
+from models.precision import with_precision
 
 
+def xla_compiled(builder):
+    """
+    Adds an 'xla' argument to a graph builder. When True, every op created by the builder is placed in an XLA jit
+    scope. Gradients of ops in a jit scope are compiled in the same scope, so both the predict step and the forward
+    and backward passes of the training step are fused by XLA (on CPU as well as GPU).
+    """
+    @functools.wraps(builder)
+    def wrapper(*args, xla=False, **kwargs):
+        if not xla:
+            return builder(*args, **kwargs)
+        with tf.xla.experimental.jit_scope():
+            return builder(*args, **kwargs)
+    return wrapper
+
 
 def get_ins(frames, actions, states, use_seq_len=12, gaussian=True, a_units=0, a_layers=0, units=0, layers=0,
             random_window=False, lstm=False):
@@ -67,25 +94,65 @@ def get_ins(frames, actions, states, use_seq_len=12, gaussian=True, a_units=0, a
 
 
 def get_sub_model(name, batch_shape, h_dim, ckpt_dir, filename, trainable, load_model_state, load_flag,
-                  model_name=None, **kwargs):
+                  model_name=None, precision='float32', **kwargs):
+    """
+    - precision: compute precision of the sub model, see models.precision.precision_scope. Its outputs are float32
+                 whatever the precision. Full saved models keep the precision of their layer configs, load the
+                 weights only (load_model_state=False) to change it.
+    """
 
     if model_name is None:
         model_name = name
 
     f_inst = {'Ec': recurrent_image_encoder, 'A': action_net, 'rA': recurrent_action_net,
-              'La': lstm_gaussian, 'Da': image_decoder, 'Da2': image_decoder}
+              'La': lstm_gaussian, 'Da': image_decoder, 'Da2': image_decoder, 'Do': image_decoder,
+              'Ec_light': recurrent_image_encoder_light, 'Eo_light': image_encoder_light,
+              'Da_light': image_decoder_light, 'Do_light': image_decoder_light, 'Eo_roi': roi_crop_encoder}
 
     f_load = {'Ec': load_recurrent_encoder, 'A': load_action_net, 'rA': load_recurrent_action_net,
-              'La': load_lstm, 'Da': load_decoder, 'Da2': load_decoder}
+              'La': load_lstm, 'Da': load_decoder, 'Da2': load_decoder, 'Do': load_decoder,
+              'Ec_light': load_recurrent_encoder_light, 'Eo_light': load_encoder_light,
+              'Da_light': load_decoder_light, 'Do_light': load_decoder_light, 'Eo_roi': load_roi_encoder}
 
     f = f_load.get(name) if load_flag else f_inst.get(name)
+    kwargs.update(name=model_name, batch_shape=batch_shape, h_dim=h_dim, ckpt_dir=ckpt_dir, filename=filename,
+                  trainable=trainable, load_model_state=load_model_state)
+
+    if load_flag:
+        # the load_* functions name some arguments differently and take none of the regularization ones
+        params = inspect.signature(f).parameters
+        if 'model_name' in params:
+            kwargs['model_name'] = kwargs.pop('name')
+        if 'lstm_units' in params and 'units' in kwargs:
+            kwargs['lstm_units'] = kwargs.pop('units')
+        kwargs = {k: v for k, v in kwargs.items() if k in params}
 
-    model = f(name=model_name, batch_shape=batch_shape, h_dim=h_dim, ckpt_dir=ckpt_dir, filename=filename,
-              trainable=trainable, load_model_state=load_model_state, **kwargs)
+    model = build_with_precision(f, precision=precision, **kwargs)
 
     return model
 
 
+def encode_objects(Eo, xo, input_mode='pair'):
+    """
+    Object latent ho of xo, Eo being an image_encoder or a RoiObjectEncoder.
+    - input_mode: 'pair' if the channels of xo are the frame and the agent only prediction, 'error' if they are the
+                  positive and negative error images. Only the RoiObjectEncoder needs it, to find the active regions
+    """
+    if isinstance(Eo, RoiObjectEncoder):
+        ho, _ = Eo(xo, input_mode=input_mode)
+    else:
+        ho, _ = Eo(xo)
+    return ho
+
+
+def add_roi_metrics(model, Eo):
+    """Fraction of the frames Eo encoded and mean area of their crops, when Eo is a RoiObjectEncoder"""
+    if isinstance(Eo, RoiObjectEncoder):
+        active_fraction, roi_area = Eo.pop_statistics()
+        model.add_metric(active_fraction, name='active_fraction', aggregation='mean')
+        model.add_metric(roi_area, name='roi_area', aggregation='mean')
+
+
 def freezeLayer(layer, unfreeze=False):
     """
     e.g.: freezeLayer(E.get_layer(name='Da'))
@@ -111,12 +178,14 @@ def base_layer(x, filters, kernel_size=5, strides=2, activation='relu', kernel_i
         x = ConvLSTM2D(filters=filters, kernel_size=kernel_size, return_sequences=True, padding='same',
                        activation=None, kernel_regularizer=l2(reg_lambda), kernel_initializer=kernel_initializer)(x)
 
-    bn = BatchNormalization()(x)
+    bn = BatchNormalization(dtype='float32')(x)
     layer_output = Activation(activation)(bn)
 
     return layer_output
 
 
+@xla_compiled
+@with_precision
 def adr_ao(frames, actions, states, context_frames, Ec, A, D, learning_rate=0.01, gaussian=False, kl_weight=None,
            L=None, use_seq_len=12, lstm_units=None, lstm_layers=None, training=True, reconstruct_random_frame=False,
            random_window=True):
@@ -192,6 +261,73 @@ def adr_ao(frames, actions, states, context_frames, Ec, A, D, learning_rate=0.01
     return ED
 
 
+@xla_compiled
+@with_precision
+def adr_ao_best_of_n(frames, actions, states, context_frames, Ec, A, D, L, n_samples=10, use_seq_len=12,
+                     lstm_units=None, lstm_layers=None, random_window=False):
+    """
+    Evaluation graph of adr_ao with gaussian=True that reconstructs each sequence from n_samples draws of z in a
+    single pass. Ec, A and L run once per sequence; their outputs are tiled n_samples times before sampling z and
+    decoding, so the cost grows with n_samples only in the sampling and decoding. The per sequence MSE and PSNR are reduced over
+    the samples in the graph and logged as best/mean/worst metrics.
+
+    Outputs: [x_best, x_to_recover, mse] where x_best is the reconstruction of the best sample and mse is
+    [bs, n_samples]. Note D is run with a batch of bs * n_samples.
+    """
+    bs, seq_len, w, h, c = [int(s) for s in frames.shape]
+    assert seq_len >= use_seq_len
+    frame_inputs, action_state, _, _, ins = get_ins(frames, actions, states, use_seq_len=use_seq_len,
+                                                    random_window=random_window, gaussian=False)
+    initial_state = lstm_initial_state_zeros(units=lstm_units, n_layers=lstm_layers, batch_size=bs)
+    ins.append(initial_state)
+
+    xc_0 = tf.slice(frame_inputs, (0, 0, 0, 0, 0), (-1, context_frames, -1, -1, -1))
+    x_to_recover = frame_inputs
+
+    # ===== Encode once per sequence
+    hc_0, skips_0 = Ec(xc_0)
+    hc_0 = tf.slice(hc_0, (0, context_frames-1, 0), (-1, 1, -1))
+    skips = slice_skips(skips_0, start=context_frames-1, length=1)
+    ha = A(action_state)
+    hc_repeat = RepeatVector(use_seq_len)(tf.squeeze(hc_0, axis=1))
+    hc_ha = K.concatenate([hc_repeat, ha], axis=-1)
+    _, mu, logvar, _ = L([hc_ha, initial_state])
+
+    # ===== Tile n_samples times, the samples of sequence b are at b * n_samples + [0, n_samples)
+    hc_ha = K.repeat_elements(hc_ha, n_samples, axis=0)
+    mu = K.repeat_elements(mu, n_samples, axis=0)
+    logvar = K.repeat_elements(logvar, n_samples, axis=0)
+    skips = repeat_skips([K.repeat_elements(s, n_samples, axis=0) for s in skips], use_seq_len)
+
+    # sample explicitly, L may have been built without the reparameterization in its Sample layer
+    z = mu + K.exp(0.5 * logvar) * K.random_normal(shape=tf.shape(mu))
+
+    x_samples = D([K.concatenate([hc_ha, z], axis=-1), skips])
+
+    # ===== Reduce over the samples
+    x_samples = tf.reshape(x_samples, [bs, n_samples, use_seq_len, w, h, c])
+    mse = K.mean(K.square(x_samples - tf.expand_dims(x_to_recover, axis=1)), axis=[2, 3, 4, 5])
+    psnr = 10.0 * K.log(1.0 / K.maximum(mse, 1e-10)) / K.log(10.0)
+
+    best = tf.argmin(mse, axis=1, output_type='int32')
+    x_best = tf.gather_nd(x_samples, tf.stack([tf.range(bs), best], axis=1))
+
+    model = Model(inputs=ins, outputs=[x_best, x_to_recover, mse])
+    model.add_metric(K.min(mse, axis=1), name='best_mse', aggregation='mean')
+    model.add_metric(K.mean(mse, axis=1), name='mean_mse', aggregation='mean')
+    model.add_metric(K.max(mse, axis=1), name='worst_mse', aggregation='mean')
+    model.add_metric(K.max(psnr, axis=1), name='best_psnr', aggregation='mean')
+    model.add_metric(K.mean(psnr, axis=1), name='mean_psnr', aggregation='mean')
+    model.add_metric(K.min(psnr, axis=1), name='worst_psnr', aggregation='mean')
+    model.add_loss(K.mean(K.min(mse, axis=1)))
+
+    model.compile(optimizer=Adam(lr=0.0))
+
+    return model
+
+
+@xla_compiled
+@with_precision
 def adr(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, La=None, gaussian_a=False, use_seq_len=12,
         lstm_units=256, lstm_layers=1, learning_rate=0.001, random_window=True, reconstruct_random_frame=True):
 
@@ -242,7 +378,7 @@ def adr(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, La=None, gau
     # xo_rec_a = K.concatenate([x_rec_a_pos, x_rec_a_neg], axis=-1)
     xo_rec_a = K.concatenate([x_to_recover, x_rec_a], axis=-1)
 
-    ho, _ = Eo(xo_rec_a)
+    ho = encode_objects(Eo, xo_rec_a, input_mode='pair')
     # ho = Eo(xo_rec_a)
 
     h = K.concatenate([hc_repeat, ha, ho], axis=-1)  # multiple reconstruction
@@ -270,6 +406,7 @@ def adr(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, La=None, gau
 
     rec_action_only_loss = mean_squared_error(x_rec_a, x_to_recover)
     model.add_metric(rec_action_only_loss, name='rec_A', aggregation='mean')
+    add_roi_metrics(model, Eo)
 
     model.add_loss(K.mean(rec_loss) + (K.mean(rec_loss_pos) + K.mean(rec_loss_neg)))
 
@@ -278,6 +415,130 @@ def adr(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, La=None, gau
     return model
 
 
+@xla_compiled
+@with_precision
+def adr_ao_distill(frames, actions, states, context_frames, Ec, A, D, D_s, Ec_s=None, L=None, gaussian=False,
+                   use_seq_len=12, lstm_units=None, lstm_layers=None, learning_rate=0.001, alpha=0.5,
+                   latent_weight=1.0, random_window=True):
+    """
+    Distills the agent decoder D of a trained ADR-AO into a student D_s (e.g. a narrower image_decoder) and, if
+    Ec_s is given, the context encoder Ec into Ec_s. Ec, A, D and L are the frozen teacher, za is taken as the mean
+    of L for both. The loss is
+        alpha * MSE(x, x_student) + (1 - alpha) * MSE(x_teacher, x_student) + latent_weight * MSE(hc, hc_student)
+    where the last term is only used with a student encoder, which must then have the h_dim of the teacher. Without
+    a student encoder D_s gets the teacher skips, so its skips_size is the teacher's size.
+    Outputs: [x_student, x_to_recover, x_teacher]
+    """
+    frame_inputs, action_state, initial_state, _, ins = get_ins(frames, actions, states, use_seq_len=use_seq_len,
+                                                                random_window=random_window, gaussian=gaussian,
+                                                                a_units=lstm_units, a_layers=lstm_layers)
+    xc = tf.slice(frame_inputs, (0, 0, 0, 0, 0), (-1, context_frames, -1, -1, -1))
+    x_to_recover = frame_inputs
+    ha = A(action_state)
+
+    def encode(E):
+        hc, skips = E(xc)
+        hc = tf.slice(hc, (0, context_frames - 1, 0), (-1, 1, -1))
+        skips = repeat_skips(slice_skips(skips, start=context_frames - 1, length=1), use_seq_len)
+        hc_ha = K.concatenate([RepeatVector(use_seq_len)(tf.squeeze(hc, axis=1)), ha], axis=-1)
+        if gaussian:
+            _, mu, _, _ = L([hc_ha, initial_state])
+            hc_ha = K.concatenate([hc_ha, mu], axis=-1)
+        return hc, hc_ha, skips
+
+    # ===== Teacher
+    hc, hc_ha, skips = encode(Ec)
+    x_teacher = K.stop_gradient(D([hc_ha, skips]))
+
+    # ===== Student
+    latent_loss = None
+    if Ec_s is not None:
+        hc_s, hc_ha, skips = encode(Ec_s)
+        latent_loss = mean_squared_error(K.stop_gradient(hc), hc_s)
+    x_student = D_s([hc_ha, skips])
+
+    rec_loss = mean_squared_error(x_to_recover, x_student)
+    distill_loss = mean_squared_error(x_teacher, x_student)
+
+    model = Model(inputs=ins, outputs=[x_student, x_to_recover, x_teacher])
+    model.add_metric(rec_loss, name='rec_loss', aggregation='mean')
+    model.add_metric(distill_loss, name='distill_loss', aggregation='mean')
+    model.add_metric(mean_squared_error(x_to_recover, x_teacher), name='teacher_rec_loss', aggregation='mean')
+
+    loss = alpha * K.mean(rec_loss) + (1.0 - alpha) * K.mean(distill_loss)
+    if latent_loss is not None:
+        model.add_metric(latent_loss, name='latent_loss', aggregation='mean')
+        loss = loss + latent_weight * K.mean(latent_loss)
+    model.add_loss(loss)
+
+    model.compile(optimizer=Adam(lr=learning_rate))
+
+    return model
+
+
+@xla_compiled
+@with_precision
+def adr_distill(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, Do_s, La=None, gaussian_a=False,
+                use_seq_len=12, lstm_units=256, lstm_layers=1, learning_rate=0.001, alpha=0.5, random_window=True):
+    """
+    Distills the object decoder Do of a trained ADR into a student Do_s, with the structure of adr (whole sequence,
+    reconstruct_random_frame=False). Every other sub model is the frozen teacher, so Do_s gets the teacher skips.
+    The loss is alpha times the loss of adr on the error targets plus (1 - alpha) times the MSE to the teacher's
+    error prediction.
+    Outputs: [x_rec_a + student error, x_to_recover, x_rec_a + teacher error]
+    """
+    frame_inputs, action_state, initial_state, _, ins = get_ins(frames, actions, states, use_seq_len=use_seq_len,
+                                                                random_window=random_window, gaussian=gaussian_a,
+                                                                a_units=lstm_units, a_layers=lstm_layers)
+    xc_0 = tf.slice(frame_inputs, (0, 0, 0, 0, 0), (-1, context_frames, -1, -1, -1))
+    x_to_recover = frame_inputs
+
+    # ===== Teacher up to the object decoder, as in adr
+    hc_0, skips_0 = Ec(xc_0)
+    hc_0 = tf.slice(hc_0, (0, context_frames - 1, 0), (-1, 1, -1))
+    skips = repeat_skips(slice_skips(skips_0, start=context_frames - 1, length=1), use_seq_len)
+
+    ha = A(action_state)
+    hc_repeat = RepeatVector(use_seq_len)(tf.squeeze(hc_0, axis=1))
+    hc_ha = K.concatenate([hc_repeat, ha], axis=-1)
+    if gaussian_a:
+        _, za, _, _ = La([hc_ha, initial_state])
+        hc_ha = K.concatenate([hc_repeat, ha, za], axis=-1)
+
+    x_rec_a = Da([hc_ha, skips])
+    ho = encode_objects(Eo, K.concatenate([x_to_recover, x_rec_a], axis=-1), input_mode='pair')
+    h = K.concatenate([hc_repeat, ha, ho], axis=-1)
+
+    x_err_teacher = K.stop_gradient(Do([h, skips]))
+    x_err = Do_s([h, skips])
+
+    x_err_pos = x_err[:, :, :, :, :3]
+    x_err_neg = x_err[:, :, :, :, 3:]
+    x_recovered = x_err_pos - x_err_neg
+    x_recovered_teacher = x_err_teacher[:, :, :, :, :3] - x_err_teacher[:, :, :, :, 3:]
+
+    rec_loss = mean_squared_error(x_to_recover - x_rec_a, x_recovered)
+    rec_loss_pos = mean_squared_error(K.relu(x_to_recover - x_rec_a), x_err_pos)
+    rec_loss_neg = mean_squared_error(K.relu(x_rec_a - x_to_recover), x_err_neg)
+    distill_loss = mean_squared_error(x_err_teacher, x_err)
+
+    model = Model(inputs=ins, outputs=[x_rec_a + x_recovered, x_to_recover, x_rec_a + x_recovered_teacher])
+    model.add_metric(K.mean(rec_loss), name='rec_loss', aggregation='mean')
+    model.add_metric(distill_loss, name='distill_loss', aggregation='mean')
+    add_roi_metrics(model, Eo)
+    model.add_metric(mean_squared_error(x_to_recover - x_rec_a, x_recovered_teacher), name='teacher_rec_loss',
+                     aggregation='mean')
+
+    gt_loss = K.mean(rec_loss) + K.mean(rec_loss_pos) + K.mean(rec_loss_neg)
+    model.add_loss(alpha * gt_loss + (1.0 - alpha) * K.mean(distill_loss))
+
+    model.compile(optimizer=Adam(lr=learning_rate))
+
+    return model
+
+
+@xla_compiled
+@with_precision
 def adr_vp_teacher_forcing(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, L, La=None, gaussian_a=False,
                            use_seq_len=12, lstm_a_units=256, lstm_a_layers=1, lstm_units=256, lstm_layers=2,
                            learning_rate=0.001, random_window=False):
@@ -321,7 +582,7 @@ def adr_vp_teacher_forcing(frames, actions, states, context_frames, Ec, Eo, A, D
     remove_first_step = Lambda(lambda _x: tf.split(_x, [1, -1], axis=1))  # new operations
     remove_last_step = Lambda(lambda _x: tf.split(_x, [-1, 1], axis=1))
 
-    ho, _ = Eo(xo_rec_a)
+    ho = encode_objects(Eo, xo_rec_a, input_mode='error')
 
     hc = RepeatVector(n_frames-1)(K.squeeze(hc_0, axis=1))
     skips = repeat_skips(skips_0, ntimes=n_frames-1)
@@ -375,6 +636,7 @@ def adr_vp_teacher_forcing(frames, actions, states, context_frames, Ec, Eo, A, D
 
     rec_A = mean_squared_error(y_pred=x_rec_a, y_true=frame_inputs)
     model.add_metric(rec_A, name='rec_A', aggregation='mean')
+    add_roi_metrics(model, Eo)
 
     # why did I have rec_curr??
     # model.add_loss(0.5*K.mean(ho_mse) + 0.125*K.mean(rec_curr) + 0.125*K.mean(rec_pred)
@@ -388,6 +650,8 @@ def adr_vp_teacher_forcing(frames, actions, states, context_frames, Ec, Eo, A, D
     return model
 
 
+@xla_compiled
+@with_precision
 def adr_vp_feedback(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, L, La=None, gaussian_a=False,
                     use_seq_len=12, lstm_a_units=256, lstm_a_layers=1, lstm_units=256, lstm_layers=2,
                     learning_rate=0.0, random_window=False):
@@ -425,7 +689,7 @@ def adr_vp_feedback(frames, actions, states, context_frames, Ec, Eo, A, Do, Da,
     x_err_neg = K.relu(x_rec_a - frame_inputs)
     xo_rec_a = K.concatenate([x_err_pos, x_err_neg], axis=-1)  # ground truth error components
 
-    ho, _ = Eo(xo_rec_a)
+    ho = encode_objects(Eo, xo_rec_a, input_mode='error')
 
     h_pred = []
     prev_state = initial_state
@@ -470,6 +734,7 @@ def adr_vp_feedback(frames, actions, states, context_frames, Ec, Eo, A, Do, Da,
 
     rec_A = mean_squared_error(y_pred=x_rec_a, y_true=frame_inputs)
     model.add_metric(rec_A, name='rec_A', aggregation='mean')
+    add_roi_metrics(model, Eo)
 
     model.add_loss(K.mean(rec_pred))
 
@@ -478,44 +743,14 @@ def adr_vp_feedback(frames, actions, states, context_frames, Ec, Eo, A, Do, Da,
     return model
 
 
-def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, L, La=None, gaussian_a=False,
-                           use_seq_len=12, lstm_a_units=256, lstm_a_layers=1, lstm_units=256, lstm_layers=2,
-                           learning_rate=0.0, random_window=False):
-
-    bs, seq_len, w, h, c = [int(s) for s in frames.shape]
-    assert seq_len >= use_seq_len
-
-    frame_inputs, action_state, initial_state_a, initial_state, ins = get_ins(frames, actions, states,
-                                                                              use_seq_len=use_seq_len,
-                                                                              random_window=random_window,
-                                                                              gaussian=gaussian_a, a_units=lstm_a_units,
-                                                                              a_layers=lstm_a_layers, units=lstm_units,
-                                                                              layers=lstm_layers, lstm=True)
-    # context frames at the beginning
-    xc_0 = tf.slice(frame_inputs, (0, 0, 0, 0, 0), (-1, context_frames, -1, -1, -1))
-    n_frames = use_seq_len
-
-    # ===== Build the model
-    hc_0, skips_0 = Ec(xc_0)
-    hc_0 = tf.slice(hc_0, (0, context_frames - 1, 0), (-1, 1, -1))
-    skips_0 = slice_skips(skips_0, start=context_frames - 1, length=1)
-    skips = repeat_skips(skips_0, n_frames)
-
-    ha = A(action_state)
-    hc_repeat = RepeatVector(n_frames)(tf.squeeze(hc_0, axis=1))
-    hc_ha = K.concatenate([hc_repeat, ha], axis=-1)
-
-    if gaussian_a:
-        _, za, _, _ = La([hc_ha, initial_state_a])  # za taken as the mean
-        hc_ha = K.concatenate([hc_repeat, ha, za], axis=-1)
-
-    x_rec_a = Da([hc_ha, skips])  # agent only prediction
-
-    # x_err_pos = K.relu(frame_inputs - x_rec_a)
-    # x_err_neg = K.relu(x_rec_a - frame_inputs)
-    # xo_rec_a = K.concatenate([x_err_pos, x_err_neg], axis=-1)  # ground truth error components
-
-    # ho, _ = Eo(xo_rec_a)
+def feedback_frames_rollout(Eo, L, Do, frames, x_rec_a, hc_0, ha, skips_0, initial_state, context_frames):
+    """
+    Object rollout of adr_vp_feedback_frames: Eo reads each frame with the agent only prediction x_rec_a, from
+    context_frames on the frame is the previous prediction, and L and Do predict the next frame.
+    frames and x_rec_a [bs, n, w, h, c] (only the context frames of frames are read), hc_0 [bs, 1, hc_dim], ha
+    [bs, n, ha_dim], skips_0 the skips of one time step. Returns the n - 1 predicted frames [bs, n - 1, w, h, c]
+    """
+    n_frames = int(frames.shape[1])
 
     x_pred = []
     prev_state = initial_state
@@ -524,7 +759,7 @@ def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, D
     ha_t, _ = tf.split(ha, [-1, 1], axis=1)  # remove last step
     _, ha_tp1 = tf.split(ha, [1, -1], axis=1)  # remove first step
     _, xa_tp1 = tf.split(x_rec_a, [1, -1], axis=1)
-    x = frame_inputs
+    x = frames
     xa = x_rec_a
 
     for i in range(n_frames - 1):
@@ -537,7 +772,7 @@ def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, D
             x_t = x_pred_t
 
         x_xa_t = K.concatenate([x_t, xa_t], axis=-1)
-        ho_t, _ = Eo(x_xa_t)
+        ho_t = encode_objects(Eo, x_xa_t, input_mode='pair')
 
         _ha_t, ha_t = tf.split(ha_t, [1, -1], axis=1)
         _ha_tp1, ha_tp1 = tf.split(ha_tp1, [1, -1], axis=1)
@@ -557,7 +792,52 @@ def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, D
         prev_state = state
 
     # Obtain predicted frames
-    x_pred = tf.squeeze(tf.stack(x_pred, axis=1), axis=2)
+    return tf.squeeze(tf.stack(x_pred, axis=1), axis=2)
+
+
+@xla_compiled
+@with_precision
+def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, Do, Da, L, La=None, gaussian_a=False,
+                           use_seq_len=12, lstm_a_units=256, lstm_a_layers=1, lstm_units=256, lstm_layers=2,
+                           learning_rate=0.0, random_window=False):
+
+    bs, seq_len, w, h, c = [int(s) for s in frames.shape]
+    assert seq_len >= use_seq_len
+
+    frame_inputs, action_state, initial_state_a, initial_state, ins = get_ins(frames, actions, states,
+                                                                              use_seq_len=use_seq_len,
+                                                                              random_window=random_window,
+                                                                              gaussian=gaussian_a, a_units=lstm_a_units,
+                                                                              a_layers=lstm_a_layers, units=lstm_units,
+                                                                              layers=lstm_layers, lstm=True)
+    # context frames at the beginning
+    xc_0 = tf.slice(frame_inputs, (0, 0, 0, 0, 0), (-1, context_frames, -1, -1, -1))
+    n_frames = use_seq_len
+
+    # ===== Build the model
+    hc_0, skips_0 = Ec(xc_0)
+    hc_0 = tf.slice(hc_0, (0, context_frames - 1, 0), (-1, 1, -1))
+    skips_0 = slice_skips(skips_0, start=context_frames - 1, length=1)
+    skips = repeat_skips(skips_0, n_frames)
+
+    ha = A(action_state)
+    hc_repeat = RepeatVector(n_frames)(tf.squeeze(hc_0, axis=1))
+    hc_ha = K.concatenate([hc_repeat, ha], axis=-1)
+
+    if gaussian_a:
+        _, za, _, _ = La([hc_ha, initial_state_a])  # za taken as the mean
+        hc_ha = K.concatenate([hc_repeat, ha, za], axis=-1)
+
+    x_rec_a = Da([hc_ha, skips])  # agent only prediction
+
+    # x_err_pos = K.relu(frame_inputs - x_rec_a)
+    # x_err_neg = K.relu(x_rec_a - frame_inputs)
+    # xo_rec_a = K.concatenate([x_err_pos, x_err_neg], axis=-1)  # ground truth error components
+
+    # ho, _ = Eo(xo_rec_a)
+
+    x_pred = feedback_frames_rollout(Eo, L, Do, frame_inputs, x_rec_a, hc_0, ha, skips_0, initial_state,
+                                     context_frames)
     _, x_target = tf.split(frame_inputs, [1, -1], axis=1)
 
     outs = [x_pred, x_pred, x_pred, x_rec_a, x_target]  # repetitions to match teacher forcing version
@@ -569,6 +849,7 @@ def adr_vp_feedback_frames(frames, actions, states, context_frames, Ec, Eo, A, D
 
     rec_A = mean_squared_error(y_pred=x_rec_a, y_true=frame_inputs)
     model.add_metric(rec_A, name='rec_A', aggregation='mean')
+    add_roi_metrics(model, Eo)
 
     model.add_loss(K.mean(rec_pred))
 
@@ -22,7 +22,6 @@ import re
 import pickle
 import numpy as np
 import tensorflow as tf
-from scipy.misc import imread
 from .base_data_reader import BaseDataReader
 
 
@@ -203,6 +202,8 @@ class BairDataReader(BaseDataReader):
         else:
             self.d += 1
 
+        from scipy.misc import imread
+
         image_seq = []
         for i in range(self.sequence_length_to_use):
             fname = '%s/%d.png' % (sequence_dir, i)
@@ -19,7 +19,8 @@ class BaseDataReader(object):
                  test_dir_name='test',
                  batch_repeat=1,
                  block_length=1,
-                 initializable=False):
+                 initializable=False,
+                 private_threadpool_size=None):
         """
         Dataset class for the BAIR and Google Push datasets.
 
@@ -32,6 +33,8 @@ class BaseDataReader(object):
                         to FLAGS.shuffle.
         - dataset_repeat: (int) number of times the dataset can be iterated. If None indefinite iteration is
                                 allowed.
+        - private_threadpool_size: (int) if given, records are parsed in parallel on a thread pool of this size that
+                                   belongs to the pipeline, so it does not compete with the TF intra op threads
         """
         self.dataset_name = None
         self.COLOR_CHAN = None
@@ -61,6 +64,7 @@ class BaseDataReader(object):
         self.batch_repeat = batch_repeat
         self.block_length = block_length
         self.initializable = initializable
+        self.private_threadpool_size = private_threadpool_size
 
     def set_filenames(self):
 
@@ -129,7 +133,10 @@ class BaseDataReader(object):
         # ==== Trying to avoid corrupted record error
         dataset = dataset.apply(tf.data.experimental.ignore_errors())
 
-        dataset = dataset.map(lambda x: self._parse_sequences(x))
+        if self.private_threadpool_size:
+            dataset = dataset.map(lambda x: self._parse_sequences(x), num_parallel_calls=self.private_threadpool_size)
+        else:
+            dataset = dataset.map(lambda x: self._parse_sequences(x))
 
         # This is useful for training adversarial generator/discriminator as the iterator will output a batch for
         # the generator on a call and then the same batch for the discriminator on a second call
@@ -139,6 +146,11 @@ class BaseDataReader(object):
 
         dataset = dataset.batch(self.batch_size, drop_remainder=True)
 
+        if self.private_threadpool_size:
+            options = tf.data.Options()
+            options.experimental_threading.private_threadpool_size = self.private_threadpool_size
+            dataset = dataset.with_options(options).prefetch(1)
+
         if self.initializable:
             iterator = dataset.make_initializable_iterator()
         else:
@@ -24,13 +24,13 @@ def action_net(batch_shape, units, h_dim, name='A',  **kwargs):
 
     # == Layer 1
     ha = TimeDistributed(Dense(units=units, activation='linear', kernel_initializer='he_uniform', use_bias=False))(_in)
-    ha = BatchNormalization()(ha)
+    ha = BatchNormalization(dtype='float32')(ha)
     ha = LeakyReLU(alpha=0.2)(ha)
 
     # == Layer 2
     ha = TimeDistributed(Dense(units=units, activation='linear', kernel_initializer='glorot_uniform'))(ha)
 
-    ha = BatchNormalization()(ha)
+    ha = BatchNormalization(dtype='float32')(ha)
     ha = LeakyReLU(alpha=0.2)(ha)
     # ha = LSTM(units=256, kernel_initializer='he_normal')(ha)
     ha = Dense(units=h_dim, activation='tanh', kernel_initializer='glorot_uniform')(ha)
@@ -53,13 +53,13 @@ def recurrent_action_net(batch_shape, units, h_dim, name='A', initializer='he_un
     # == Layer 1
     ha = TimeDistributed(Dense(units=units, activation='linear', kernel_initializer=initializer, use_bias=False,
                                kernel_regularizer=l2(dense_lambda)))(_in)
-    ha = BatchNormalization()(ha)
+    ha = BatchNormalization(dtype='float32')(ha)
     ha = LeakyReLU(alpha=0.2)(ha)
 
     # == Layer 2
     ha = TimeDistributed(Dense(units=units, activation='linear', kernel_initializer=initializer, use_bias=False,
                                kernel_regularizer=l2(dense_lambda)))(ha)
-    ha = BatchNormalization()(ha)
+    ha = BatchNormalization(dtype='float32')(ha)
     ha = LeakyReLU(alpha=0.2)(ha)
 
     ha = LSTM(units=units, return_sequences=True, kernel_initializer='glorot_uniform',
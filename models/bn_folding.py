@@ -0,0 +1,140 @@
+import copy
+import numpy as np
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import Activation
+from tensorflow.python.keras.layers import LayerNormalization
+from models.lstm import Sample
+from models.conv_gru import ConvGRU2D
+
+# kernel axis of the output channels of each foldable layer
+FOLDABLE = {'Conv2D': -1, 'Dense': -1, 'Conv2DTranspose': -2}
+
+
+def _layer_norm_tanh(_x):
+    _out = LayerNormalization(dtype='float32')(_x)
+    return Activation('tanh')(_out)
+
+
+CUSTOM_OBJECTS = {'Sample': Sample, 'layer_norm_tanh': _layer_norm_tanh, 'ConvGRU2D': ConvGRU2D}
+
+
+def _inner_config(layer_config):
+    """Config of the layer itself, or of the layer wrapped by TimeDistributed"""
+    if layer_config['class_name'] == 'TimeDistributed':
+        return layer_config['config']['layer']
+    return layer_config
+
+
+def _references(config, name):
+    refs = sum(1 for layer in config['layers'] for node in layer['inbound_nodes'] for inbound in node
+               if inbound[0] == name)
+    return refs + sum(1 for out in config['output_layers'] if out[0] == name)
+
+
+def find_foldable(model):
+    """
+    Pairs (producer, batch norm) of layer names where the batch norm only normalizes the last axis of the output of
+    a Conv2D, Conv2DTranspose or Dense (possibly TimeDistributed) layer that is called once and feeds nothing else
+    """
+    config = model.get_config()
+    by_name = {layer['name']: layer for layer in config['layers']}
+    pairs = []
+    for layer in config['layers']:
+        if layer['class_name'] != 'BatchNormalization' or len(layer['inbound_nodes']) != 1:
+            continue
+        node = layer['inbound_nodes'][0]
+        if len(node) != 1:
+            continue
+        producer = by_name[node[0][0]]
+        if _inner_config(producer)['class_name'] not in FOLDABLE or len(producer['inbound_nodes']) != 1:
+            continue
+        if _references(config, producer['name']) != 1:
+            continue
+        axis = layer['config']['axis']
+        axis = axis[0] if isinstance(axis, (list, tuple)) else axis
+        if axis != -1 and axis != len(model.get_layer(producer['name']).output_shape) - 1:
+            continue
+        pairs.append((producer['name'], layer['name']))
+    return pairs
+
+
+def folded_weights(producer, bn):
+    """Kernel and bias of producer with the inference transform of bn applied to its outputs"""
+    inner = getattr(producer, 'layer', producer)
+    weights = inner.get_weights()
+    kernel = weights[0]
+    bias = weights[1] if inner.use_bias else np.zeros(kernel.shape[FOLDABLE[inner.__class__.__name__]],
+                                                      dtype=kernel.dtype)
+
+    bn_weights = bn.get_weights()
+    gamma = bn_weights.pop(0) if bn.scale else 1.0
+    beta = bn_weights.pop(0) if bn.center else 0.0
+    mean, variance = bn_weights
+
+    scale = gamma / np.sqrt(variance + bn.epsilon)
+    shape = [1] * kernel.ndim
+    shape[FOLDABLE[inner.__class__.__name__]] = -1
+    return [kernel * scale.reshape(shape), (bias - mean) * scale + beta]
+
+
+def fold_batchnorm(model, custom_objects=None, check=True, atol=1e-4, time_steps=12):
+    """
+    Inference copy of a sub model where every foldable BatchNormalization (see find_foldable) is removed and its
+    moving statistics, scale and offset are merged into the kernel and bias of the preceding layer:
+        W' = W * gamma / sqrt(var + eps),   b' = (b - mean) * gamma / sqrt(var + eps) + beta
+    The copy is only valid in inference, the folded layers no longer normalize with batch statistics.
+    If check is True the outputs of the copy are compared with the ones of model on random inputs (the learning phase
+    must be 0, otherwise model normalizes with the batch statistics).
+    Models without batch norm are returned as they are.
+    """
+    pairs = find_foldable(model)
+    if not pairs:
+        return model
+
+    config = copy.deepcopy(model.get_config())
+    bn_of = {bn: producer for producer, bn in pairs}
+    by_name = {layer['name']: layer for layer in config['layers']}
+
+    # the producer gets a bias, its consumers are rewired to it and the batch norm is dropped
+    for producer, bn in pairs:
+        _inner_config(by_name[producer])['config']['use_bias'] = True
+    for layer in config['layers']:
+        for node in layer['inbound_nodes']:
+            for inbound in node:
+                if inbound[0] in bn_of:
+                    inbound[:3] = by_name[inbound[0]]['inbound_nodes'][inbound[1]][0][:3]
+    for out in config['output_layers']:
+        if out[0] in bn_of:
+            out[:3] = by_name[out[0]]['inbound_nodes'][out[1]][0][:3]
+    config['layers'] = [layer for layer in config['layers'] if layer['name'] not in bn_of]
+
+    objects = dict(CUSTOM_OBJECTS, **(custom_objects or {}))
+    folded = Model.from_config(config, custom_objects=objects)
+
+    folded_producers = {producer: bn for producer, bn in pairs}
+    for layer in folded.layers:
+        original = model.get_layer(layer.name)
+        if layer.name in folded_producers:
+            layer.set_weights(folded_weights(original, model.get_layer(folded_producers[layer.name])))
+        else:
+            layer.set_weights(original.get_weights())
+    folded.trainable = model.trainable
+
+    if check:
+        error = check_folding(model, folded, time_steps=time_steps)
+        assert error < atol, '%s: folded model differs from the original by %g' % (model.name, error)
+    return folded
+
+
+def check_folding(model, folded, inputs=None, time_steps=12, seed=0):
+    """Largest absolute difference between the outputs of model and folded, on random inputs if none are given"""
+    if inputs is None:
+        rng = np.random.RandomState(seed)
+        inputs = [rng.uniform(size=[time_steps if d is None else d for d in x.shape.as_list()]).astype('float32')
+                  for x in model.inputs]
+    bs = inputs[0].shape[0]
+    expected = model.predict(inputs, batch_size=bs)
+    actual = folded.predict(inputs, batch_size=bs)
+    if not isinstance(expected, list):
+        expected, actual = [expected], [actual]
+    return max(float(np.max(np.abs(e - a))) for e, a in zip(expected, actual))
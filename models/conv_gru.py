@@ -0,0 +1,124 @@
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras import activations
+from tensorflow.python.keras import initializers
+from tensorflow.python.keras import regularizers
+from tensorflow.python.keras.engine.base_layer import Layer
+from tensorflow.python.keras.layers.convolutional_recurrent import ConvRNN2D
+from tensorflow.python.keras.utils import conv_utils
+
+
+class ConvGRU2DCell(Layer):
+    """
+    Convolutional GRU cell, the counterpart of ConvLSTM2DCell with one state and three gates instead of two states
+    and four gates, i.e. 3/4 of the kernels and of the convolutions per step. Only channels_last.
+    """
+
+    def __init__(self, filters, kernel_size, strides=(1, 1), padding='valid', dilation_rate=(1, 1), activation='tanh',
+                 recurrent_activation='hard_sigmoid', use_bias=True, kernel_initializer='glorot_uniform',
+                 recurrent_initializer='orthogonal', bias_initializer='zeros', kernel_regularizer=None,
+                 recurrent_regularizer=None, bias_regularizer=None, **kwargs):
+        super(ConvGRU2DCell, self).__init__(**kwargs)
+        self.filters = filters
+        self.kernel_size = conv_utils.normalize_tuple(kernel_size, 2, 'kernel_size')
+        self.strides = conv_utils.normalize_tuple(strides, 2, 'strides')
+        self.padding = conv_utils.normalize_padding(padding)
+        self.data_format = 'channels_last'
+        self.dilation_rate = conv_utils.normalize_tuple(dilation_rate, 2, 'dilation_rate')
+        self.activation = activations.get(activation)
+        self.recurrent_activation = activations.get(recurrent_activation)
+        self.use_bias = use_bias
+        self.kernel_initializer = initializers.get(kernel_initializer)
+        self.recurrent_initializer = initializers.get(recurrent_initializer)
+        self.bias_initializer = initializers.get(bias_initializer)
+        self.kernel_regularizer = regularizers.get(kernel_regularizer)
+        self.recurrent_regularizer = regularizers.get(recurrent_regularizer)
+        self.bias_regularizer = regularizers.get(bias_regularizer)
+        self.state_size = (self.filters,)
+
+    def build(self, input_shape):
+        input_dim = input_shape[-1]
+        self.kernel_shape = self.kernel_size + (input_dim, self.filters * 3)
+        self.kernel = self.add_weight(shape=self.kernel_shape, initializer=self.kernel_initializer, name='kernel',
+                                      regularizer=self.kernel_regularizer)
+        self.recurrent_kernel = self.add_weight(shape=self.kernel_size + (self.filters, self.filters * 3),
+                                                initializer=self.recurrent_initializer, name='recurrent_kernel',
+                                                regularizer=self.recurrent_regularizer)
+        self.bias = self.add_weight(shape=(self.filters * 3,), initializer=self.bias_initializer, name='bias',
+                                    regularizer=self.bias_regularizer) if self.use_bias else None
+        self.built = True
+
+    def call(self, inputs, states, training=None):
+        h_tm1 = states[0]
+
+        # update, reset and candidate input contributions in one convolution
+        x = self.input_conv(inputs, self.kernel, self.bias, padding=self.padding)
+        x_z, x_r, x_h = x[..., :self.filters], x[..., self.filters:2 * self.filters], x[..., 2 * self.filters:]
+
+        h_zr = self.recurrent_conv(h_tm1, self.recurrent_kernel[..., :2 * self.filters])
+        z = self.recurrent_activation(x_z + h_zr[..., :self.filters])
+        r = self.recurrent_activation(x_r + h_zr[..., self.filters:])
+
+        hh = self.activation(x_h + self.recurrent_conv(r * h_tm1, self.recurrent_kernel[..., 2 * self.filters:]))
+        h = z * h_tm1 + (1 - z) * hh
+        return h, [h]
+
+    def input_conv(self, x, w, b=None, padding='valid'):
+        conv_out = K.conv2d(x, w, strides=self.strides, padding=padding, data_format=self.data_format,
+                            dilation_rate=self.dilation_rate)
+        if b is not None:
+            conv_out = K.bias_add(conv_out, b, data_format=self.data_format)
+        return conv_out
+
+    def recurrent_conv(self, x, w):
+        return K.conv2d(x, w, strides=(1, 1), padding='same', data_format=self.data_format)
+
+    def get_config(self):
+        config = {'filters': self.filters,
+                  'kernel_size': self.kernel_size,
+                  'strides': self.strides,
+                  'padding': self.padding,
+                  'dilation_rate': self.dilation_rate,
+                  'activation': activations.serialize(self.activation),
+                  'recurrent_activation': activations.serialize(self.recurrent_activation),
+                  'use_bias': self.use_bias,
+                  'kernel_initializer': initializers.serialize(self.kernel_initializer),
+                  'recurrent_initializer': initializers.serialize(self.recurrent_initializer),
+                  'bias_initializer': initializers.serialize(self.bias_initializer),
+                  'kernel_regularizer': regularizers.serialize(self.kernel_regularizer),
+                  'recurrent_regularizer': regularizers.serialize(self.recurrent_regularizer),
+                  'bias_regularizer': regularizers.serialize(self.bias_regularizer)}
+        base_config = super(ConvGRU2DCell, self).get_config()
+        return dict(list(base_config.items()) + list(config.items()))
+
+
+class ConvGRU2D(ConvRNN2D):
+    """Convolutional GRU layer, with the same arguments as ConvLSTM2D except unit_forget_bias and dropout"""
+
+    def __init__(self, filters, kernel_size, strides=(1, 1), padding='valid', dilation_rate=(1, 1), activation='tanh',
+                 recurrent_activation='hard_sigmoid', use_bias=True, kernel_initializer='glorot_uniform',
+                 recurrent_initializer='orthogonal', bias_initializer='zeros', kernel_regularizer=None,
+                 recurrent_regularizer=None, bias_regularizer=None, return_sequences=False, go_backwards=False,
+                 stateful=False, **kwargs):
+        cell = ConvGRU2DCell(filters=filters, kernel_size=kernel_size, strides=strides, padding=padding,
+                             dilation_rate=dilation_rate, activation=activation,
+                             recurrent_activation=recurrent_activation, use_bias=use_bias,
+                             kernel_initializer=kernel_initializer, recurrent_initializer=recurrent_initializer,
+                             bias_initializer=bias_initializer, kernel_regularizer=kernel_regularizer,
+                             recurrent_regularizer=recurrent_regularizer, bias_regularizer=bias_regularizer)
+        super(ConvGRU2D, self).__init__(cell, return_sequences=return_sequences, go_backwards=go_backwards,
+                                        stateful=stateful, **kwargs)
+
+    def call(self, inputs, mask=None, training=None, initial_state=None):
+        return super(ConvGRU2D, self).call(inputs, mask=mask, training=training, initial_state=initial_state)
+
+    def get_config(self):
+        config = self.cell.get_config()
+        for key in ['name', 'trainable', 'dtype']:
+            config.pop(key, None)
+        base_config = super(ConvGRU2D, self).get_config()
+        del base_config['cell']
+        return dict(list(base_config.items()) + list(config.items()))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
@@ -25,7 +25,7 @@ def base_conv_layer(x, filters, time_distr, kernel_size=4, strides=2, activation
 
     x = TimeDistributed(conv_2d)(x) if time_distr is True else conv_2d(x)
 
-    bn = BatchNormalization()(x)
+    bn = BatchNormalization(dtype='float32')(x)
 
     layer_output = Activation(activation)(bn) if activation else LeakyReLU(alpha=0.2)(bn)
 
@@ -40,7 +40,7 @@ def base_conv_transpose_layer(x, filters, time_distr, kernel_size=4, strides=2,
                                         kernel_initializer=kernel_initializer)
 
     x = TimeDistributed(conv_2d_transpose)(x) if time_distr is True else conv_2d_transpose(x)
-    bn = BatchNormalization()(x)
+    bn = BatchNormalization(dtype='float32')(x)
     layer_output = Activation(activation)(bn) if activation else LeakyReLU(alpha=0.2)(bn)
 
     return layer_output
@@ -50,7 +50,7 @@ def base_convlstm_layer(x, filters, kernel_size=4, strides=2, padding='same', ke
                         reg_lambda=0.0, use_bias=False):
 
     def layer_norm_tanh(_x):
-        _out = LayerNormalization()(_x)
+        _out = LayerNormalization(dtype='float32')(_x)
         return Activation('tanh')(_out)
 
     conv = ConvLSTM2D(filters=filters, kernel_size=kernel_size, strides=strides, padding=padding, use_bias=use_bias,
@@ -252,7 +252,7 @@ def load_recurrent_encoder(batch_shape, h_dim, ckpt_dir, filename, size=64, conv
                            trainable=False, kernel_size=4, name='Ec', load_model_state=True):
 
     def layer_norm_tanh(_x):
-        _out = LayerNormalization()(_x)
+        _out = LayerNormalization(dtype='float32')(_x)
         return Activation('tanh')(_out)
 
     weight_path = os.path.join(ckpt_dir, filename)
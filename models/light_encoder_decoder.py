@@ -0,0 +1,205 @@
+"""
+Speed oriented counterparts of the builders in models.encoder_decoder, with the same inputs, outputs and spatial
+sizes of the skips: the convolutions are depthwise separable, the deconvolutions are nearest neighbour upsampling
+followed by a separable convolution and the default width is halved. Pass the same size to the encoder and
+skips_size to the decoder, as with the original builders.
+"""
+import os
+import tensorflow as tf
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import Input
+from tensorflow.python.keras.layers import BatchNormalization
+from tensorflow.python.keras.layers import SeparableConv2D
+from tensorflow.python.keras.layers import Conv2DTranspose
+from tensorflow.python.keras.layers import UpSampling2D
+from tensorflow.python.keras.layers import TimeDistributed
+from tensorflow.python.keras.layers import Activation
+from tensorflow.python.keras.layers import LeakyReLU
+from tensorflow.python.keras.layers import Lambda
+from tensorflow.python.keras.models import load_model
+from tensorflow.python.keras.regularizers import l2
+from models.conv_gru import ConvGRU2D
+from models.encoder_decoder import base_convlstm_layer
+from models.bn_folding import CUSTOM_OBJECTS
+
+
+def separable_conv_layer(x, filters, kernel_size=3, strides=2, activation=None, padding='same',
+                         kernel_initializer='he_uniform', reg_lambda=0.0, upsample=False):
+
+    conv = SeparableConv2D(filters=filters, kernel_size=kernel_size, strides=1 if upsample else strides,
+                           padding=padding, use_bias=False, depthwise_initializer=kernel_initializer,
+                           pointwise_initializer=kernel_initializer, depthwise_regularizer=l2(reg_lambda),
+                           pointwise_regularizer=l2(reg_lambda))
+
+    if upsample:
+        x = TimeDistributed(UpSampling2D(size=strides))(x)
+    x = TimeDistributed(conv)(x)
+    bn = BatchNormalization(dtype='float32')(x)
+
+    layer_output = Activation(activation)(bn) if activation else LeakyReLU(alpha=0.2)(bn)
+
+    return layer_output
+
+
+def conv_gru_layer(x, filters, kernel_size=3, strides=2, padding='same', kernel_initializer='glorot_uniform',
+                   reg_lambda=0.0, use_bias=True):
+
+    conv = ConvGRU2D(filters=filters, kernel_size=kernel_size, strides=strides, padding=padding, use_bias=use_bias,
+                     activation='tanh', recurrent_activation='hard_sigmoid', kernel_initializer=kernel_initializer,
+                     kernel_regularizer=l2(reg_lambda), recurrent_regularizer=l2(reg_lambda),
+                     recurrent_initializer='orthogonal', return_sequences=True)
+
+    return conv(x)
+
+
+def image_encoder_light(batch_shape, h_dim, name=None, kernel_size=3, size=32, reg_lambda=0.0, activation='tanh',
+                        **kwargs):
+    """Drop in for image_encoder, [h5, [h1, h2, h3, h4]] with h1 to h4 at 32, 16, 8 and 4 pixels"""
+
+    names = [name + '_input', name + '_L_0'] if name else [None] * 2
+    _in = Input(batch_shape=batch_shape, name=names[0])
+
+    h1 = separable_conv_layer(_in, size, kernel_size=kernel_size, reg_lambda=reg_lambda)
+    h2 = separable_conv_layer(h1, size*2, kernel_size=kernel_size, reg_lambda=reg_lambda)
+    h3 = separable_conv_layer(h2, size*4, kernel_size=kernel_size, reg_lambda=reg_lambda)
+    h4 = separable_conv_layer(h3, size*8, kernel_size=kernel_size, reg_lambda=reg_lambda)
+
+    h5 = separable_conv_layer(h4, h_dim, strides=1, kernel_size=4, padding='valid', activation=activation,
+                              reg_lambda=reg_lambda)
+    h5 = Lambda(lambda x: tf.squeeze(tf.squeeze(x, axis=2), axis=2), name=names[1])(h5)
+
+    encoder = Model(inputs=_in, outputs=[h5, [h1, h2, h3, h4]], name=name)
+    return encoder
+
+
+def recurrent_image_encoder_light(batch_shape, h_dim, name, kernel_size=3, size=32, cell='gru',
+                                  conv_initializer='he_uniform', rec_initializer='glorot_uniform', conv_lambda=0.0,
+                                  recurrent_lambda=0.0, **kwargs):
+    """
+    Drop in for recurrent_image_encoder with separable convolutions.
+    - cell: 'gru' for ConvGRU2D recurrent layers, 'lstm' for the ConvLSTM2D ones of recurrent_image_encoder
+    """
+    assert cell in ['gru', 'lstm'], "cell must be 'gru' or 'lstm'"
+    recurrent_layer = conv_gru_layer if cell == 'gru' else base_convlstm_layer
+
+    _in = Input(batch_shape=batch_shape)
+
+    h1 = separable_conv_layer(_in, size, kernel_size=kernel_size, reg_lambda=conv_lambda,
+                              kernel_initializer=conv_initializer)
+    h2 = separable_conv_layer(h1, size*2, kernel_size=kernel_size, reg_lambda=conv_lambda,
+                              kernel_initializer=conv_initializer)
+
+    # 16x16 -> 8x8
+    h3 = recurrent_layer(h2, size*4, strides=2, kernel_size=kernel_size, reg_lambda=recurrent_lambda, use_bias=True,
+                         kernel_initializer=rec_initializer)
+
+    # 8x8 -> 4x4
+    h4 = separable_conv_layer(h3, size*8, kernel_size=kernel_size, reg_lambda=conv_lambda,
+                              kernel_initializer=conv_initializer)
+
+    # 4x4 -> 1x1
+    h5 = recurrent_layer(h4, h_dim, strides=1, kernel_size=4, padding='valid', use_bias=True,
+                         kernel_initializer=rec_initializer, reg_lambda=recurrent_lambda)
+
+    h5 = Lambda(lambda x: tf.squeeze(tf.squeeze(x, axis=2), axis=2))(h5)
+
+    encoder = Model(inputs=_in, outputs=[h5, [h1, h2, h3, h4]], name=name)
+    return encoder
+
+
+def image_decoder_light(batch_shape, name=None, output_activation='sigmoid', output_channels=3, reg_lambda=0.0,
+                        kernel_size=3, size=32, initializer='he_uniform', output_initializer='glorot_uniform',
+                        output_regularizer=None, skips_size=32, **kwargs):
+    """Drop in for image_decoder, inputs [z, [skip_0, skip_1, skip_2, skip_3]]"""
+
+    bs, seq_len = int(batch_shape[0]), int(batch_shape[1])
+    z = Input(batch_shape=batch_shape)
+    skip_0 = Input(batch_shape=[bs, seq_len, 32, 32, skips_size])
+    skip_1 = Input(batch_shape=[bs, seq_len, 16, 16, skips_size*2])
+    skip_2 = Input(batch_shape=[bs, seq_len, 8, 8, skips_size*4])
+    skip_3 = Input(batch_shape=[bs, seq_len, 4, 4, skips_size*8])
+    concat = Lambda(lambda _x: tf.concat(_x, axis=-1))
+
+    # 1x1 -> 4x4, a dense layer in practice, there is nothing to separate
+    _in = Lambda(lambda x_: tf.expand_dims(tf.expand_dims(x_, axis=2), axis=2))(z)
+    h1 = TimeDistributed(Conv2DTranspose(filters=size*8, kernel_size=4, strides=1, padding='valid', use_bias=False,
+                                         kernel_initializer=initializer, kernel_regularizer=l2(reg_lambda)))(_in)
+    h1 = LeakyReLU(alpha=0.2)(BatchNormalization(dtype='float32')(h1))
+
+    _in = concat([h1, skip_3])
+    h2 = separable_conv_layer(_in, size*4, kernel_size=kernel_size, reg_lambda=reg_lambda, upsample=True,
+                              kernel_initializer=initializer)
+
+    _in = concat([h2, skip_2])
+    h3 = separable_conv_layer(_in, size*2, kernel_size=kernel_size, reg_lambda=reg_lambda, upsample=True,
+                              kernel_initializer=initializer)
+
+    _in = concat([h3, skip_1])
+    h4 = separable_conv_layer(_in, size, kernel_size=kernel_size, reg_lambda=reg_lambda, upsample=True,
+                              kernel_initializer=initializer)
+
+    out_conv = SeparableConv2D(filters=output_channels, kernel_size=kernel_size, padding='same',
+                               activation=output_activation, depthwise_initializer=output_initializer,
+                               pointwise_initializer=output_initializer, activity_regularizer=output_regularizer)
+
+    _in = concat([h4, skip_0])
+    _in = TimeDistributed(UpSampling2D(size=2))(_in)
+    x = TimeDistributed(out_conv)(_in)
+
+    decoder = Model(inputs=[z, [skip_0, skip_1, skip_2, skip_3]], outputs=x, name=name)
+    return decoder
+
+
+def load_encoder_light(batch_shape, h_dim, model_name, ckpt_dir, filename, kernel_size=3, size=32, trainable=False,
+                       reg_lambda=0.0, load_model_state=True):
+    weight_path = os.path.join(ckpt_dir, filename)
+
+    if load_model_state:
+        E = load_model(weight_path)
+        E._name = model_name
+    else:
+        E = image_encoder_light(batch_shape=batch_shape, h_dim=h_dim, kernel_size=kernel_size, size=size,
+                                reg_lambda=reg_lambda, name=model_name)
+        E.load_weights(weight_path)
+
+    if trainable is False:
+        E.trainable = False
+    return E
+
+
+def load_recurrent_encoder_light(batch_shape, h_dim, ckpt_dir, filename, size=32, cell='gru', conv_lambda=0.0,
+                                 recurrent_lambda=0.0, trainable=False, kernel_size=3, name='Ec',
+                                 load_model_state=True):
+    weight_path = os.path.join(ckpt_dir, filename)
+
+    if load_model_state:
+        E = load_model(weight_path, custom_objects=CUSTOM_OBJECTS)
+        E._name = name
+    else:
+        E = recurrent_image_encoder_light(batch_shape=batch_shape, h_dim=h_dim, size=size, cell=cell,
+                                          conv_lambda=conv_lambda, recurrent_lambda=recurrent_lambda,
+                                          kernel_size=kernel_size, name=name)
+        E.load_weights(weight_path)
+
+    if trainable is False:
+        E.trainable = False
+    return E
+
+
+def load_decoder_light(batch_shape, model_name, ckpt_dir, filename, output_activation='sigmoid', output_channels=3,
+                       output_initializer='glorot_uniform', kernel_size=3, size=32, skips_size=32, trainable=False,
+                       load_model_state=True):
+    weight_path = os.path.join(ckpt_dir, filename)
+
+    if load_model_state:
+        D = load_model(weight_path)
+        D._name = model_name
+    else:
+        D = image_decoder_light(batch_shape=batch_shape, name=model_name, output_activation=output_activation,
+                                size=size, skips_size=skips_size, kernel_size=kernel_size,
+                                output_initializer=output_initializer, output_channels=output_channels)
+        D.load_weights(weight_path)
+
+    if trainable is False:
+        D.trainable = False
+    return D
@@ -81,7 +81,8 @@ def lstm_gaussian(batch_shape, h_dim=10, n_layers=2, units=256, reparameterize=F
     lstm_cells = [make_cell(units) for _ in range(n_layers)]
     lstm = RNN(lstm_cells, return_sequences=True, return_state=True, name='lstm_model')
     embed_net = Dense(units=units, activation='linear')
-    sample = Sample(output_dim=h_dim, reparameterization_flag=reparameterize)
+    # the mean and log variance (and so the kl loss) are kept in float32 under a mixed precision policy
+    sample = Sample(output_dim=h_dim, reparameterization_flag=reparameterize, dtype='float32')
     _in = Input(batch_shape=[batch_shape[0], None, batch_shape[-1]])
     initial_state = initial_state_placeholder(units, n_layers, batch_size=batch_shape[0])
 
@@ -89,7 +90,7 @@ def lstm_gaussian(batch_shape, h_dim=10, n_layers=2, units=256, reparameterize=F
     out = lstm(embed, initial_state=initial_state)
     h, state = out[0], out[1:]
     # z, mu, logvar = sample(h)
-    z, mu, logvar = TimeDistributed(sample)(h)
+    z, mu, logvar = TimeDistributed(sample, dtype='float32')(h)
 
     model = Model(inputs=[_in, initial_state], outputs=[z, mu, logvar, state], name=name)
 
@@ -129,8 +130,8 @@ class Sample(layers.Layer):
         super(Sample, self).__init__(**kwargs)
         self.reparameterization_flag = reparameterization_flag
 
-        self.mu_net = Dense(units=self.output_dim, activation='linear')
-        self.logvar_net = Dense(units=self.output_dim, activation='linear')
+        self.mu_net = Dense(units=self.output_dim, activation='linear', dtype=self.dtype)
+        self.logvar_net = Dense(units=self.output_dim, activation='linear', dtype=self.dtype)
 
     def call(self, inputs, **kwargs):
         h = inputs
@@ -0,0 +1,294 @@
+"""
+NumPy implementation of the agent only ADR-AO path (Ec -> A -> La -> Da), for machines without TensorFlow.
+Weights are exported with utils.numpy_export.export_numpy. Only numpy is imported here.
+
+The layers follow the TF/Keras definitions used by the models in this package:
+- Conv2D / Conv2DTranspose with TF 'same' and 'valid' padding, kernels [kh, kw, in, out] / [kh, kw, out, in]
+- BatchNormalization in inference mode, folded into the preceding kernel when the weights are loaded
+- LeakyReLU (alpha 0.2)
+- ConvLSTM2D of base_convlstm_layer: hard sigmoid gates and a layer norm (no scale and offset, epsilon 1e-3)
+  followed by tanh as activation
+- Dense and stacked LSTMCell (hard sigmoid gates), and the mean of Sample
+All of them run on [batch_size, seq_len, ...] arrays, the time axis merged into the batch axis where possible.
+"""
+import json
+import numpy as np
+
+LAYER_NORM_EPSILON = 1e-3
+
+
+def hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+
+def leaky_relu(x, alpha=0.2):
+    return np.where(x > 0, x, alpha * x)
+
+
+def layer_norm_tanh(x, epsilon=LAYER_NORM_EPSILON):
+    mean = np.mean(x, axis=-1, keepdims=True)
+    variance = np.var(x, axis=-1, keepdims=True)
+    return np.tanh((x - mean) / np.sqrt(variance + epsilon))
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+ACTIVATIONS = {'linear': lambda x: x, 'tanh': np.tanh, 'sigmoid': sigmoid, 'hard_sigmoid': hard_sigmoid,
+               'layer_norm_tanh': layer_norm_tanh}
+
+
+def _same_padding(size, kernel_size, stride):
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel_size - size, 0)
+    return out, total // 2, total - total // 2
+
+
+def conv2d(x, kernel, bias=None, strides=1, padding='same'):
+    """x: [n, h, w, c], kernel: [kh, kw, c, filters]. One matmul over the patches of every output position."""
+    n, h, w, c = x.shape
+    kh, kw = kernel.shape[:2]
+    if padding == 'same':
+        ho, top, bottom = _same_padding(h, kh, strides)
+        wo, left, right = _same_padding(w, kw, strides)
+        x = np.pad(x, ((0, 0), (top, bottom), (left, right), (0, 0)), mode='constant')
+    else:
+        ho, wo = (h - kh) // strides + 1, (w - kw) // strides + 1
+
+    patches = [x[:, i:i + strides * (ho - 1) + 1:strides, j:j + strides * (wo - 1) + 1:strides]
+               for i in range(kh) for j in range(kw)]
+    patches = np.concatenate(patches, axis=-1) if len(patches) > 1 else patches[0]
+    y = np.dot(patches.reshape(-1, kh * kw * c), kernel.reshape(-1, kernel.shape[-1]))
+    y = y.reshape(n, ho, wo, -1)
+    return y + bias if bias is not None else y
+
+
+def conv2d_transpose(x, kernel, bias=None, strides=2, padding='same'):
+    """x: [n, h, w, c], kernel: [kh, kw, filters, c]. Gradient of conv2d: every input pixel adds its kernel window."""
+    n, h, w, c = x.shape
+    kh, kw, filters = kernel.shape[:3]
+    cols = np.dot(x.reshape(-1, c), kernel.transpose(3, 0, 1, 2).reshape(c, -1)).reshape(n, h, w, kh, kw, filters)
+
+    full = np.zeros([n, (h - 1) * strides + kh, (w - 1) * strides + kw, filters], dtype=x.dtype)
+    for i in range(kh):
+        for j in range(kw):
+            full[:, i:i + strides * (h - 1) + 1:strides, j:j + strides * (w - 1) + 1:strides] += cols[:, :, :, i, j]
+
+    if padding == 'same':
+        ho, wo = h * strides, w * strides
+        top = max((h - 1) * strides + kh - ho, 0) // 2
+        left = max((w - 1) * strides + kw - wo, 0) // 2
+        full = full[:, top:top + ho, left:left + wo]
+    return full + bias if bias is not None else full
+
+
+def fold_bn(kernel, bias, bn, axis=-1):
+    """Kernel and bias with a following batch norm {gamma, beta, mean, variance, epsilon} applied"""
+    scale = bn['gamma'] / np.sqrt(bn['variance'] + bn['epsilon'])
+    shape = [1] * kernel.ndim
+    shape[axis] = -1
+    bias = np.zeros(kernel.shape[axis], kernel.dtype) if bias is None else bias
+    return kernel * scale.reshape(shape), (bias - bn['mean']) * scale + bn['beta']
+
+
+def time_distributed(fn, x, *args, **kwargs):
+    b, t = x.shape[:2]
+    y = fn(x.reshape((b * t,) + x.shape[2:]), *args, **kwargs)
+    return y.reshape((b, t) + y.shape[1:])
+
+
+def conv_lstm2d(x, kernel, recurrent_kernel, bias, strides=1, padding='same', activation=layer_norm_tanh,
+                recurrent_activation=hard_sigmoid):
+    """x: [b, t, h, w, c]. Input convolutions of all the steps at once, then the recurrence. Returns all the steps."""
+    filters = recurrent_kernel.shape[-1] // 4
+    x = time_distributed(conv2d, x, kernel, bias, strides=strides, padding=padding)
+    b, t, h, w, _ = x.shape
+    h_t = np.zeros([b, h, w, filters], dtype=x.dtype)
+    c_t = np.zeros_like(h_t)
+    outputs = []
+    for step in range(t):
+        z = x[:, step] + conv2d(h_t, recurrent_kernel, strides=1, padding='same')
+        z_i, z_f, z_c, z_o = np.split(z, 4, axis=-1)
+        c_t = recurrent_activation(z_f) * c_t + recurrent_activation(z_i) * activation(z_c)
+        h_t = recurrent_activation(z_o) * activation(c_t)
+        outputs.append(h_t)
+    return np.stack(outputs, axis=1)
+
+
+def lstm(x, cells, initial_state=None, recurrent_activation=hard_sigmoid):
+    """x: [b, t, d], cells: list of (kernel, recurrent_kernel, bias) of stacked LSTMCells. Returns the outputs and
+    the final [h, c] of each cell."""
+    b, t = x.shape[:2]
+    if initial_state is None:
+        initial_state = [[np.zeros([b, rk.shape[0]], x.dtype)] * 2 for _, rk, _ in cells]
+    state = [list(s) for s in initial_state]
+
+    # input projection of the first cell for all steps at once
+    kernel_0, _, bias_0 = cells[0]
+    projected = np.dot(x, kernel_0) + bias_0
+
+    outputs = []
+    for step in range(t):
+        inputs = None
+        for i, (kernel, recurrent_kernel, bias) in enumerate(cells):
+            h_tm1, c_tm1 = state[i]
+            z = projected[:, step] if i == 0 else np.dot(inputs, kernel) + bias
+            z = z + np.dot(h_tm1, recurrent_kernel)
+            z_i, z_f, z_c, z_o = np.split(z, 4, axis=-1)
+            c = recurrent_activation(z_f) * c_tm1 + recurrent_activation(z_i) * np.tanh(z_c)
+            inputs = recurrent_activation(z_o) * np.tanh(c)
+            state[i] = [inputs, c]
+        outputs.append(inputs)
+    return np.stack(outputs, axis=1), state
+
+
+class _Layers(object):
+    """Exported layers of one sub model, consumed in order by kind"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.position = {}
+
+    def next(self, *kinds):
+        start = self.position.get(kinds, 0)
+        for i in range(start, len(self.entries)):
+            if self.entries[i]['class'] in kinds:
+                self.position[kinds] = i + 1
+                return self.entries[i]
+        raise ValueError('No more %s layers' % '/'.join(kinds))
+
+    def conv_bn(self, kinds, axis):
+        """Next conv (or dense) layer with the batch norm that follows it folded in"""
+        conv = self.next(*kinds)
+        kernel, bias = conv['weights'][0], conv['weights'][1] if len(conv['weights']) > 1 else None
+        w = self.next('BatchNormalization')['weights']
+        bn = {'gamma': w[0], 'beta': w[1], 'mean': w[2], 'variance': w[3], 'epsilon': w[4]}
+        kernel, bias = fold_bn(kernel, bias, bn, axis=axis)
+        return dict(conv, weights=[kernel, bias])
+
+
+def _conv_block(x, layer):
+    p = layer['params']
+    return leaky_relu(time_distributed(conv2d, x, *layer['weights'], strides=p['strides'][0], padding=p['padding']))
+
+
+def _conv_transpose_block(x, layer, activation=leaky_relu):
+    p = layer['params']
+    return activation(time_distributed(conv2d_transpose, x, *layer['weights'], strides=p['strides'][0],
+                                       padding=p['padding']))
+
+
+class RecurrentImageEncoder(object):
+
+    def __init__(self, entries):
+        layers = _Layers(entries)
+        self.conv = [layers.conv_bn(['Conv2D'], axis=-1) for _ in range(3)]
+        self.conv_lstm = [layers.next('ConvLSTM2D') for _ in range(2)]
+
+    def __call__(self, x):
+        """x: [b, t, h, w, c] in [0, 1]. Returns h5 [b, t, h_dim] and the skips [h1, h2, h3, h4]"""
+        h1 = _conv_block(x, self.conv[0])
+        h2 = _conv_block(h1, self.conv[1])
+        h3 = self._conv_lstm(h2, self.conv_lstm[0])
+        h4 = _conv_block(h3, self.conv[2])
+        h5 = self._conv_lstm(h4, self.conv_lstm[1])
+        return h5.reshape(h5.shape[:2] + (-1,)), [h1, h2, h3, h4]
+
+    @staticmethod
+    def _conv_lstm(x, layer):
+        p = layer['params']
+        return conv_lstm2d(x, *layer['weights'], strides=p['strides'][0], padding=p['padding'],
+                           activation=ACTIVATIONS[p['activation']],
+                           recurrent_activation=ACTIVATIONS[p['recurrent_activation']])
+
+
+class ImageDecoder(object):
+
+    def __init__(self, entries):
+        layers = _Layers(entries)
+        self.conv = [layers.conv_bn(['Conv2DTranspose'], axis=-2) for _ in range(4)]
+        self.output = layers.next('Conv2DTranspose')
+
+    def __call__(self, z, skips):
+        """z: [b, t, d], skips: [skip_0, ..., skip_3] as in image_decoder. Returns [b, t, h, w, output_channels]"""
+        x = z[:, :, None, None, :]
+        for layer, skip in zip(self.conv, [skips[3], skips[2], skips[1], skips[0]]):
+            x = np.concatenate([_conv_transpose_block(x, layer), skip], axis=-1)
+        return _conv_transpose_block(x, self.output, ACTIVATIONS[self.output['params']['activation']])
+
+
+class ActionNet(object):
+
+    def __init__(self, entries):
+        layers = _Layers(entries)
+        self.dense = [layers.conv_bn(['Dense'], axis=-1) for _ in range(2)]
+        self.output = layers.next('Dense')
+
+    def __call__(self, action_state):
+        ha = action_state
+        for layer in self.dense:
+            ha = leaky_relu(np.dot(ha, layer['weights'][0]) + layer['weights'][1])
+        kernel, bias = self.output['weights']
+        return ACTIVATIONS[self.output['params']['activation']](np.dot(ha, kernel) + bias)
+
+
+class LSTMGaussian(object):
+
+    def __init__(self, entries):
+        layers = _Layers(entries)
+        self.embed = layers.next('Dense')
+        rnn = layers.next('RNN')['weights']
+        self.cells = [tuple(rnn[i:i + 3]) for i in range(0, len(rnn), 3)]
+        self.sample = layers.next('Sample')['weights']
+
+    def __call__(self, x, initial_state=None):
+        """Returns mu, used as z in inference"""
+        embed = np.dot(x, self.embed['weights'][0]) + self.embed['weights'][1]
+        h, _ = lstm(embed, self.cells, initial_state)
+        return np.dot(h, self.sample[0]) + self.sample[1]
+
+
+class NumpyAgentPredictor(object):
+
+    def __init__(self, path):
+        """Loads the .npz written by export_numpy. Batch norms are folded into the kernels here."""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['__meta__']))
+            entries = {}
+            for name, layers in meta['models'].items():
+                entries[name] = [dict(l, weights=[data['%s/%03d/%d' % (name, i, j)] for j in range(l['n_weights'])])
+                                 for i, l in enumerate(layers)]
+        for name, layers in entries.items():
+            for l in layers:
+                if l['class'] == 'BatchNormalization':
+                    l['weights'].append(l['params'].get('epsilon', 1e-3))
+
+        self.meta = meta
+        self.context_frames = meta['context_frames']
+        self.Ec = RecurrentImageEncoder(entries['Ec'])
+        self.A = ActionNet(entries['A'])
+        self.La = LSTMGaussian(entries['La']) if meta['gaussian_a'] else None
+        self.Da = ImageDecoder(entries['Da'])
+
+    def encode_context(self, context_frames):
+        """context_frames: uint8 or float in [0, 1], [b, context_frames, h, w, c]. Returns hc and the skips of the
+        last context frame"""
+        if context_frames.dtype == np.uint8:
+            context_frames = context_frames.astype('float32') / 255.0
+        hc, skips = self.Ec(context_frames.astype('float32'))
+        last = self.context_frames - 1
+        return hc[:, last], [s[:, last:last + 1] for s in skips]
+
+    def predict_agent(self, context_frames, actions, states):
+        """Agent only prediction of every step of actions/states, as the predict_agent signature of export"""
+        hc, skips = self.encode_context(context_frames)
+        action_state = np.concatenate([actions, states], axis=-1).astype('float32')
+        seq_len = action_state.shape[1]
+
+        ha = self.A(action_state)
+        hc_ha = np.concatenate([np.repeat(hc[:, None], seq_len, axis=1), ha], axis=-1)
+        if self.La is not None:
+            hc_ha = np.concatenate([hc_ha, self.La(hc_ha)], axis=-1)
+        skips = [np.repeat(s, seq_len, axis=1) for s in skips]
+        return self.Da(hc_ha, skips)
@@ -0,0 +1,105 @@
+import contextlib
+import functools
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import Activation
+from tensorflow.python.keras.optimizers import Adam
+from tensorflow.python.util import nest
+
+PRECISIONS = ['float32', 'mixed_bfloat16', 'mixed_float16']
+# static loss scale of mixed_float16, the gradients of the small reconstruction losses underflow in float16 without it
+DEFAULT_LOSS_SCALE = 1024.0
+
+
+def _policy():
+    try:
+        from tensorflow.python.keras.mixed_precision.experimental import policy
+    except ImportError:
+        policy = None
+    return policy
+
+
+@contextlib.contextmanager
+def precision_scope(precision):
+    """
+    Layers created inside the scope compute in the dtype of precision and keep float32 variables:
+    - 'float32': everything in float32, the default
+    - 'mixed_bfloat16': bfloat16 compute, for CPUs with AVX512-BF16 and TPUs
+    - 'mixed_float16': float16 compute, for GPUs with tensor cores, needs a loss scale (see LossScaleAdam)
+    Layers given dtype='float32' explicitly (the batch norms, layer norms and Sample of the sub models) compute in
+    float32 inside the scope as well, their inputs are cast on the way in.
+    """
+    assert precision in PRECISIONS, 'precision must be one of ' + ', '.join(PRECISIONS)
+    policy = _policy()
+    if policy is None:
+        if precision != 'float32':
+            raise ValueError('%s needs the Keras mixed precision policies of TensorFlow 1.15 or later' % precision)
+        yield
+        return
+    with policy.policy_scope(policy.Policy(precision)):
+        yield
+
+
+def float32_outputs(model):
+    """
+    Same model with every output that is not float32 cast to float32 by a (weightless) float32 linear activation,
+    so that the graph builders combine, and the losses and kl_unit_normal see, float32 tensors. The weights are
+    shared with model and load_weights files are interchangeable. Returns model itself if all outputs are float32.
+    """
+    if all(o.dtype.base_dtype == tf.float32 for o in model.outputs):
+        return model
+
+    def cast(x):
+        return x if x.dtype.base_dtype == tf.float32 else Activation('linear', dtype='float32')(x)
+
+    outputs = nest.map_structure(cast, model._nested_outputs)
+    cast_model = Model(inputs=model._nested_inputs, outputs=outputs, name=model.name)
+    cast_model.trainable = model.trainable
+    return cast_model
+
+
+def build_with_precision(builder, precision='float32', **kwargs):
+    """Calls a sub model builder (or load_* function) inside precision_scope and casts its outputs to float32"""
+    with precision_scope(precision):
+        model = builder(**kwargs)
+    return float32_outputs(model)
+
+
+class LossScaleAdam(Adam):
+    """
+    Adam with a static loss scale: the loss is multiplied by loss_scale before the gradients are taken and the
+    gradients are divided by it before the update, so that small float16 gradients do not flush to zero.
+    """
+
+    def __init__(self, loss_scale=DEFAULT_LOSS_SCALE, **kwargs):
+        super(LossScaleAdam, self).__init__(**kwargs)
+        self.loss_scale = float(loss_scale)
+
+    def get_gradients(self, loss, params):
+        grads = super(LossScaleAdam, self).get_gradients(loss * self.loss_scale, params)
+        return [None if g is None else g / self.loss_scale for g in grads]
+
+    def get_config(self):
+        config = super(LossScaleAdam, self).get_config()
+        config['loss_scale'] = self.loss_scale
+        return config
+
+
+def with_precision(builder):
+    """
+    Adds 'precision' and 'loss_scale' arguments to a graph builder. The graph itself (slicing, concatenations,
+    losses, kl_unit_normal) is always built in float32, the sub models passed to it carry the precision they were
+    built with (see build_with_precision). With 'mixed_float16' the model is compiled again with LossScaleAdam at
+    the same learning rate, bfloat16 has the range of float32 and is trained without loss scaling.
+    """
+    @functools.wraps(builder)
+    def wrapper(*args, precision='float32', loss_scale=None, **kwargs):
+        assert precision in PRECISIONS, 'precision must be one of ' + ', '.join(PRECISIONS)
+        with precision_scope('float32'):
+            model = builder(*args, **kwargs)
+        if precision == 'mixed_float16' or loss_scale is not None:
+            lr = float(K.get_value(model.optimizer.lr))
+            model.compile(optimizer=LossScaleAdam(lr=lr, loss_scale=loss_scale or DEFAULT_LOSS_SCALE))
+        return model
+    return wrapper
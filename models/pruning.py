@@ -0,0 +1,194 @@
+import copy
+import numpy as np
+from tensorflow.python.keras.models import Model
+from models.bn_folding import CUSTOM_OBJECTS
+from models.bn_folding import find_foldable
+from models.bn_folding import _inner_config
+
+# kernel axis of the input channels of the layers that consume a pruned tensor (SeparableConv2D is handled apart, its
+# depthwise and pointwise kernels both lose input channels)
+INPUT_AXIS = {'Conv2D': -2, 'Dense': -2, 'ConvLSTM2D': -2, 'ConvGRU2D': -2, 'Conv2DTranspose': -1}
+OUTPUT_AXIS = {'Conv2D': -1, 'Dense': -1, 'Conv2DTranspose': -2}
+CHANNEL_WISE = ['BatchNormalization', 'LeakyReLU', 'Activation', 'Lambda', 'UpSampling2D']
+
+
+def _channels(config):
+    """Number of channels (last axis) of every tensor of a model config, {(layer, node, tensor): channels}"""
+    by_name = {layer['name']: layer for layer in config['layers']}
+    channels = {}
+    pending = [(layer['name'], k) for layer in config['layers'] for k in range(max(len(layer['inbound_nodes']), 1))]
+    while pending:
+        remaining = []
+        for name, k in pending:
+            layer = by_name[name]
+            inner = _inner_config(layer)
+            if layer['class_name'] == 'InputLayer':
+                channels[(name, k, 0)] = layer['config']['batch_input_shape'][-1]
+                continue
+            inbound = [tuple(i[:3]) for i in layer['inbound_nodes'][k]]
+            if any(i not in channels for i in inbound):
+                remaining.append((name, k))
+                continue
+            in_channels = [channels[i] for i in inbound]
+            if 'filters' in inner['config']:
+                channels[(name, k, 0)] = inner['config']['filters']
+            elif 'units' in inner['config']:
+                channels[(name, k, 0)] = inner['config']['units']
+            else:
+                # concatenation on the last axis if several inputs, otherwise a channel wise layer
+                channels[(name, k, 0)] = sum(in_channels)
+        assert len(remaining) < len(pending), 'Could not resolve the channels of %s' % remaining
+        pending = remaining
+    return channels
+
+
+def propagate(model, keep, input_selections=None):
+    """
+    Follows the channels removed from the outputs of the layers in keep ({layer name: kept channel indices}) through
+    the model config: channel wise layers (batch norm, activations, upsampling, single input Lambdas) pass the
+    selection on, concatenations (Lambdas with several inputs) offset it, and the layers consuming a selected tensor
+    (Conv2D, SeparableConv2D, Conv2DTranspose, Dense, ConvLSTM2D, ConvGRU2D) drop the matching input channels of
+    their kernels.
+    - input_selections: {model input index: kept channel indices}, for inputs fed by a pruned tensor of another model
+                        (e.g. the decoder skips fed by the encoder)
+    Returns ({tensor: kept indices} for every tensor whose channels change, [kept indices or None per model output])
+    """
+    config = model.get_config()
+    channels = _channels(config)
+    by_name = {layer['name']: layer for layer in config['layers']}
+    selection = {}
+
+    for i, (name, k, t) in enumerate(config['input_layers']):
+        if input_selections and i in input_selections:
+            selection[(name, k, t)] = np.asarray(input_selections[i])
+
+    pending = [(layer['name'], k) for layer in config['layers'] if layer['class_name'] != 'InputLayer'
+               for k in range(len(layer['inbound_nodes']))]
+    done = set((name, 0) for name in by_name if by_name[name]['class_name'] == 'InputLayer')
+    while pending:
+        remaining = []
+        for name, k in pending:
+            layer = by_name[name]
+            inbound = [tuple(i[:3]) for i in layer['inbound_nodes'][k]]
+            if any((i[0], i[1]) not in done for i in inbound):
+                remaining.append((name, k))
+                continue
+            done.add((name, k))
+            if name in keep:
+                selection[(name, k, 0)] = np.asarray(keep[name])
+                continue
+            cls = _inner_config(layer)['class_name']
+            if cls not in CHANNEL_WISE or not any(i in selection for i in inbound):
+                continue
+            if len(inbound) == 1:
+                selection[(name, k, 0)] = selection[inbound[0]]
+            else:
+                offset, kept = 0, []
+                for i in inbound:
+                    kept.append(offset + selection.get(i, np.arange(channels[i])))
+                    offset += channels[i]
+                selection[(name, k, 0)] = np.concatenate(kept)
+        assert len(remaining) < len(pending), 'Could not resolve the nodes %s' % remaining
+        pending = remaining
+
+    outputs = [selection.get(tuple(o[:3])) for o in config['output_layers']]
+    return selection, outputs
+
+
+def _slice(array, axis, indices):
+    return np.take(array, indices, axis=axis)
+
+
+def prune_model(model, keep, input_selections=None, custom_objects=None):
+    """
+    Copy of model where the layers in keep ({layer name: kept output channel indices}, each a Conv2D,
+    Conv2DTranspose or Dense, possibly TimeDistributed) only have the kept filters, with the input channels of the
+    layers after them (and the batch norm parameters in between) removed to match, see propagate.
+    Returns the pruned model and the output selections, to prune the models fed by its outputs.
+    """
+    selection, outputs = propagate(model, keep, input_selections)
+    config = copy.deepcopy(model.get_config())
+    new_weights = {}
+
+    for layer in config['layers']:
+        name = layer['name']
+        inner = _inner_config(layer)
+        cls = inner['class_name']
+        if cls == 'InputLayer':
+            for i, (input_name, k, t) in enumerate(config['input_layers']):
+                if input_name == name and (name, k, t) in selection:
+                    shape = list(layer['config']['batch_input_shape'])
+                    shape[-1] = len(selection[(name, k, t)])
+                    layer['config']['batch_input_shape'] = shape
+            continue
+
+        weights = model.get_layer(name).get_weights()
+        inbound = [tuple(i[:3]) for node in layer['inbound_nodes'][:1] for i in node]
+        in_selection = selection.get(inbound[0]) if len(inbound) == 1 else None
+
+        if cls in INPUT_AXIS and in_selection is not None:
+            weights[0] = _slice(weights[0], INPUT_AXIS[cls], in_selection)
+        if cls == 'SeparableConv2D' and in_selection is not None:
+            # depthwise [kh, kw, in, multiplier], pointwise [1, 1, in * multiplier, out] with in major
+            multiplier = weights[0].shape[-1]
+            weights[0] = _slice(weights[0], -2, in_selection)
+            weights[1] = _slice(weights[1], -2, (in_selection[:, None] * multiplier + np.arange(multiplier)).ravel())
+        if name in keep:
+            kept = np.asarray(keep[name])
+            weights[0] = _slice(weights[0], OUTPUT_AXIS[cls], kept)
+            if len(weights) > 1:
+                weights[1] = weights[1][kept]
+            inner['config']['filters' if 'filters' in inner['config'] else 'units'] = len(kept)
+        if cls == 'BatchNormalization' and in_selection is not None:
+            weights = [w[in_selection] for w in weights]
+        new_weights[name] = weights
+
+    objects = dict(CUSTOM_OBJECTS, **(custom_objects or {}))
+    pruned = Model.from_config(config, custom_objects=objects)
+    for layer in pruned.layers:
+        if layer.name in new_weights:
+            layer.set_weights(new_weights[layer.name])
+    pruned.trainable = model.trainable
+    return pruned, outputs
+
+
+def bn_gamma_plan(model, sparsity, protected_outputs=(0,), min_channels=1):
+    """
+    Channels to keep in each conv/dense layer followed by a batch norm: the (1 - sparsity) fraction with the largest
+    |gamma|. Layers whose channels reach one of protected_outputs (by default the first output, i.e. the latent of
+    the encoders and the frames of the decoders) are not pruned.
+    Returns {layer name: sorted kept channel indices}
+    """
+    plan = {}
+    for producer, bn in find_foldable(model):
+        _, outputs = propagate(model, {producer: np.arange(model.get_layer(bn).get_weights()[0].shape[0])})
+        if any(outputs[i] is not None for i in protected_outputs):
+            continue
+        gamma = np.abs(model.get_layer(bn).get_weights()[0]) if model.get_layer(bn).scale else None
+        if gamma is None:
+            continue
+        n_keep = max(int(round(len(gamma) * (1.0 - sparsity))), min_channels)
+        plan[producer] = np.sort(np.argsort(-gamma)[:n_keep])
+    return plan
+
+
+def prune_encoder_decoders(encoder, decoders, sparsity, prune_encoder=True, prune_decoders=True):
+    """
+    Prunes an encoder (image_encoder or recurrent_image_encoder) and the image_decoders fed by its skips with the
+    same sparsity. The skip outputs of the encoder (outputs 1 to 4) feed the skip inputs of the decoders (inputs 1 to
+    4), so the decoders drop the skip channels the encoder drops.
+    Returns the pruned encoder, the list of pruned decoders and the plans {model name: {layer: kept channels}}.
+    """
+    plans = {}
+    skip_selections = None
+    if prune_encoder:
+        plans[encoder.name] = bn_gamma_plan(encoder, sparsity)
+        encoder, outputs = prune_model(encoder, plans[encoder.name])
+        skip_selections = {i: s for i, s in enumerate(outputs) if i > 0 and s is not None}
+
+    pruned_decoders = []
+    for decoder in decoders:
+        plans[decoder.name] = bn_gamma_plan(decoder, sparsity) if prune_decoders else {}
+        decoder, _ = prune_model(decoder, plans[decoder.name], input_selections=skip_selections)
+        pruned_decoders.append(decoder)
+    return encoder, pruned_decoders, plans
@@ -0,0 +1,161 @@
+import os
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import Input
+from tensorflow.python.keras.layers import Dense
+from tensorflow.python.keras.layers import Lambda
+from tensorflow.python.keras.layers import TimeDistributed
+from tensorflow.python.keras.models import load_model
+from tensorflow.python.keras.regularizers import l2
+from models.encoder_decoder import base_conv_layer
+
+INPUT_MODES = ['error', 'pair']
+
+
+def roi_crop_encoder(batch_shape, h_dim, name=None, kernel_size=4, size=64, reg_lambda=0.0, activation='tanh'):
+    """
+    Encoder of the crops of RoiObjectEncoder. Inputs [crops, boxes]: crops [n, 1, crop_size, crop_size, channels]
+    (n is usually None, the number of active frames), boxes [n, 1, 4] the normalized [y1, x1, y2, x2] the crops were
+    taken from. The crop goes down to 4x4 with stride 2 convolutions as in image_encoder, one less per halving of
+    the crop size, and its code is merged with the box into the [n, 1, h_dim] output.
+    """
+    crop_size = int(batch_shape[2])
+    n_down = int(round(np.log2(crop_size / 4.0)))
+    assert crop_size >= 8 and crop_size == 4 * 2 ** n_down, 'crop_size must be a power of 2 of at least 8'
+
+    _in = Input(batch_shape=batch_shape)
+    boxes = Input(batch_shape=list(batch_shape[:2]) + [4])
+
+    x = _in
+    for i in range(n_down):
+        x = base_conv_layer(x, size * 2 ** i, strides=2, kernel_size=kernel_size, time_distr=True,
+                            reg_lambda=reg_lambda)
+    h = base_conv_layer(x, filters=h_dim, strides=1, padding='valid', activation=activation, kernel_size=4,
+                        time_distr=True, reg_lambda=reg_lambda)
+    h = Lambda(lambda _x: tf.squeeze(tf.squeeze(_x, axis=2), axis=2))(h)
+
+    h = Lambda(lambda _x: tf.concat(_x, axis=-1))([h, boxes])
+    h = TimeDistributed(Dense(units=h_dim, activation=activation, kernel_regularizer=l2(reg_lambda)))(h)
+
+    encoder = Model(inputs=[_in, boxes], outputs=h, name=name)
+    return encoder
+
+
+def load_roi_encoder(batch_shape, h_dim, model_name, ckpt_dir, filename, kernel_size=4, size=64, trainable=False,
+                     reg_lambda=0.0, load_model_state=True):
+    weight_path = os.path.join(ckpt_dir, filename)
+
+    if load_model_state:
+        E = load_model(weight_path)
+        E._name = model_name
+    else:
+        E = roi_crop_encoder(batch_shape=batch_shape, h_dim=h_dim, kernel_size=kernel_size, size=size,
+                             reg_lambda=reg_lambda, name=model_name)
+        E.load_weights(weight_path)
+
+    if trainable is False:
+        E.trainable = False
+    return E
+
+
+def active_regions(x, input_mode='error', pixel_threshold=0.1, min_pixels=4, margin=2):
+    """
+    Bounding box of the pixels whose error is above pixel_threshold, in each frame of x [n, h, w, c].
+    - input_mode: 'error' if the channels of x are the positive and negative errors (the error is their sum),
+                  'pair' if they are a frame and the agent only prediction (the error is their absolute difference)
+    - min_pixels: frames with fewer active pixels are inactive
+    - margin: pixels added around each box
+    Returns the boxes [n, 4] as normalized [y1, x1, y2, x2] for tf.image.crop_and_resize, the boolean active flag
+    [n] and the fraction of the frame covered by each box [n] (0 for inactive frames)
+    """
+    assert input_mode in INPUT_MODES, 'input_mode must be one of ' + ', '.join(INPUT_MODES)
+    h, w, c = [int(s) for s in x.shape[1:]]
+
+    if input_mode == 'error':
+        error = tf.reduce_sum(x, axis=-1)
+    else:
+        error = tf.reduce_sum(tf.abs(x[..., :c // 2] - x[..., c // 2:]), axis=-1)
+    mask = error > pixel_threshold
+    active = tf.reduce_sum(tf.cast(mask, 'int32'), axis=[1, 2]) >= min_pixels
+
+    def extent(any_along, size):
+        # first and last index where any_along is True, [n] each
+        first = tf.argmax(tf.cast(any_along, 'int32'), axis=1, output_type=tf.int32)
+        last = size - 1 - tf.argmax(tf.cast(tf.reverse(any_along, axis=[1]), 'int32'), axis=1, output_type=tf.int32)
+        first = tf.maximum(first - margin, 0)
+        last = tf.minimum(last + margin, size - 1)
+        return tf.cast(first, 'float32'), tf.cast(last, 'float32')
+
+    y1, y2 = extent(tf.reduce_any(mask, axis=2), h)
+    x1, x2 = extent(tf.reduce_any(mask, axis=1), w)
+    boxes = tf.stack([y1 / (h - 1), x1 / (w - 1), y2 / (h - 1), x2 / (w - 1)], axis=-1)
+    area = (y2 - y1 + 1) * (x2 - x1 + 1) / float(h * w) * tf.cast(active, 'float32')
+    return tf.stop_gradient(boxes), active, area
+
+
+class RoiObjectEncoder(object):
+    """
+    Drop in for the object encoder Eo of the adr_* graph builders that encodes a fixed size crop around the active
+    region of each frame (see active_regions) with its box, instead of the whole, mostly empty, error image. The
+    crops are only taken and encoded for the active frames (tf.boolean_mask), the latent of the inactive ones is
+    zero (tf.scatter_nd), so the encoder compute is proportional to the active fraction of the frames.
+    Called as Eo(x, input_mode) it returns the [bs, seq_len, h_dim] latent and the [bs, seq_len] active flags, like
+    the [h5, skips] of image_encoder. Its weights are the ones of encoder (see roi_crop_encoder).
+    """
+
+    def __init__(self, encoder, pixel_threshold=0.1, min_pixels=4, margin=2):
+        self.encoder = encoder
+        self.h_dim = int(encoder.outputs[0].shape[-1])
+        self.crop_size = int(encoder.inputs[0].shape[2])
+        self.pixel_threshold = pixel_threshold
+        self.min_pixels = min_pixels
+        self.margin = margin
+        self._active_fractions = []
+        self._areas = []
+
+    def __call__(self, x, input_mode='error'):
+        bs, seq_len = int(x.shape[0]), x.shape[1]
+        h, w, c = [int(s) for s in x.shape[2:]]
+        frames = tf.reshape(x, [-1, h, w, c])
+        boxes, active, area = active_regions(frames, input_mode=input_mode, pixel_threshold=self.pixel_threshold,
+                                             min_pixels=self.min_pixels, margin=self.margin)
+
+        # without any active frame the first one is encoded anyway, and its latent zeroed, so that the batch
+        # norms of the encoder never see an empty batch (whose moments are NaN)
+        n_frames = tf.shape(frames)[0]
+        first = tf.logical_and(tf.logical_not(tf.reduce_any(active)), tf.equal(tf.range(n_frames), 0))
+        encoded = tf.logical_or(active, first)
+
+        index = tf.cast(tf.where(encoded)[:, 0], 'int32')
+        encoded_boxes = tf.boolean_mask(boxes, encoded)
+        crops = tf.image.crop_and_resize(frames, encoded_boxes, box_ind=index,
+                                         crop_size=[self.crop_size, self.crop_size])
+        h_encoded = self.encoder([tf.expand_dims(crops, axis=1), tf.expand_dims(encoded_boxes, axis=1)])
+        h_frames = tf.scatter_nd(tf.expand_dims(index, axis=-1), tf.squeeze(h_encoded, axis=1),
+                                 shape=[n_frames, self.h_dim])
+        h_frames = h_frames * tf.expand_dims(tf.cast(active, h_frames.dtype), axis=-1)
+
+        ho = tf.reshape(h_frames, [bs, -1, self.h_dim])
+        ho.set_shape([bs, seq_len, self.h_dim])
+        active = tf.reshape(active, [bs, -1])
+
+        self._active_fractions.append(tf.reduce_mean(tf.cast(active, 'float32')))
+        self._areas.append(tf.reduce_mean(area))
+        return ho, active
+
+    def pop_statistics(self):
+        """Mean active fraction of the frames and mean covered area over the calls since the last pop, as tensors"""
+        fractions, areas = self._active_fractions, self._areas
+        self._active_fractions, self._areas = [], []
+        return tf.add_n(fractions) / len(fractions), tf.add_n(areas) / len(areas)
+
+
+def roi_compute(encoder, dense_encoder, active_fraction, flops_fn):
+    """
+    Encoder compute per frame of the ROI encoder, at a given active fraction, against the dense image_encoder, as
+    {'dense_flops', 'roi_flops', 'roi_active_flops', 'saved'} where roi_flops = active_fraction * roi_active_flops
+    """
+    dense, crop = flops_fn(dense_encoder), flops_fn(encoder)
+    roi = active_fraction * crop
+    return {'dense_flops': dense, 'roi_active_flops': crop, 'roi_flops': roi, 'saved': 1.0 - roi / dense}
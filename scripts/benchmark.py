@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import itertools
+import tensorflow as tf
+from utils.benchmark import VARIANTS
+from utils.benchmark import SUB_MODELS
+from utils.benchmark import FAMILIES
+from utils.benchmark import benchmark_graph
+from utils.benchmark import benchmark_sub_model
+from utils.benchmark import benchmark_reader
+from utils.benchmark import benchmark_family
+from utils.benchmark import run_isolated
+from utils.benchmark import machine_info
+from utils.benchmark import compare
+from utils.synthetic_dataset import write_dataset
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Time the forward and train steps of the ADR sub models and graphs '
+                                                 'on synthetic data over a grid of shapes, and optionally the '
+                                                 'records/sec of the input pipeline. Runs on CPU.')
+    parser.add_argument('--sub_models', nargs='*', default=SUB_MODELS, choices=SUB_MODELS)
+    parser.add_argument('--graphs', nargs='*', default=VARIANTS, choices=VARIANTS)
+    parser.add_argument('--bs', nargs='+', type=int, default=[8, 32])
+    parser.add_argument('--use_seq_len', nargs='+', type=int, default=[12])
+    parser.add_argument('--size', nargs='+', type=int, default=[64])
+    parser.add_argument('--h_dim', nargs='+', type=int, default=[128])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra op threads, defaults to the tuned setting or one per usable core')
+    parser.add_argument('--reader', type=str, default=None, choices=['bair', 'google'],
+                        help='also measure the records/sec of this data reader')
+    parser.add_argument('--dataset_dir', type=str, default=None,
+                        help='dataset read by --reader, a synthetic one is written to a temporary dir if not given')
+    parser.add_argument('--families', nargs='*', default=[], choices=list(FAMILIES),
+                        help='also train adr_ao with these encoder/decoder families and report the step time '
+                             'against the validation reconstruction loss, at each --size')
+    parser.add_argument('--family_steps', type=int, default=500, help='train steps of each family')
+    parser.add_argument('--family_dataset', type=str, default='bair', choices=['bair', 'google', 'robonet'])
+    parser.add_argument('--family_dataset_dir', type=str, default=None,
+                        help='dataset the families are trained on, a single synthetic batch if not given (then only '
+                             'the step times are meaningful)')
+    parser.add_argument('--output', type=str, default='benchmark.json')
+    parser.add_argument('--baseline', type=str, default=None, help='json written by a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown counted as a regression')
+    args = parser.parse_args()
+
+    if args.reader is not None and args.dataset_dir is None:
+        args.dataset_dir = tempfile.mkdtemp(prefix='synthetic_' + args.reader + '_')
+        write_dataset(args.dataset_dir, args.reader, n_train=max(args.bs) * 20, n_test=max(args.bs))
+
+    config = runtime_config(intra_op_threads=args.threads)
+    results = run_benchmarks(args.sub_models, args.graphs, args.bs, args.use_seq_len, args.size, args.h_dim,
+                             steps=args.steps, warmup=args.warmup, config=config, reader=args.reader,
+                             dataset_dir=args.dataset_dir)
+    if args.families:
+        results += run_family_benchmarks(args.families, args.size, args.bs[-1], max(args.use_seq_len),
+                                         steps=args.family_steps, warmup=args.warmup, dataset=args.family_dataset,
+                                         dataset_dir=args.family_dataset_dir, config=config)
+
+    with open(args.output, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+    print('Results saved to', os.path.abspath(args.output))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        n_regressions = print_comparison(compare(results, baseline, tolerance=args.tolerance))
+        if n_regressions > 0:
+            sys.exit(1)
+
+
+def run_benchmarks(sub_models, graphs, batch_sizes, use_seq_lens, sizes, h_dims, steps=20, warmup=3, config=None,
+                   reader=None, dataset_dir=None):
+
+    results = []
+    for bs, use_seq_len, size, h_dim in itertools.product(batch_sizes, use_seq_lens, sizes, h_dims):
+        # each measurement in its own process, so that peak RSS and TF state are not shared between them
+        for name in sub_models:
+            results.append(run_isolated(benchmark_sub_model, name, batch_size=bs, use_seq_len=use_seq_len,
+                                        size=size, h_dim=h_dim, steps=steps, warmup=warmup, config=config))
+            print_result(results[-1])
+        for variant in graphs:
+            # adr needs frames beyond the window (seq_len > use_seq_len), as in the datasets
+            results.append(run_isolated(benchmark_graph, variant, batch_size=bs, seq_len=max(30, use_seq_len + 1),
+                                        steps=steps, warmup=warmup, config=config, use_seq_len=use_seq_len,
+                                        size=size, hc_dim=h_dim))
+            print_result(results[-1])
+
+    if reader is not None:
+        for bs in batch_sizes:
+            results.append(run_isolated(benchmark_reader, reader, dataset_dir, batch_size=bs,
+                                        seq_len=max(use_seq_lens), config=config))
+            print_result(results[-1])
+
+    return results
+
+
+def run_family_benchmarks(families, sizes, bs, use_seq_len, steps=500, warmup=3, dataset='bair', dataset_dir=None,
+                          config=None):
+
+    results = []
+    for size, family in itertools.product(sizes, families):
+        results.append(run_isolated(benchmark_family, family, size=size, dataset=dataset, dataset_dir=dataset_dir,
+                                    batch_size=bs, use_seq_len=use_seq_len, steps=steps, warmup=warmup,
+                                    config=config))
+        print_result(results[-1])
+
+    print('%-12s %6s %12s %12s %12s %12s' % ('family', 'size', 'params', 'train ms', 'predict ms', 'val rec'))
+    for r in results:
+        print('%-12s %6d %12d %12.2f %12.2f %12.5f' % (r['name'], r['size'], r['params'], r['train']['median_ms'],
+                                                       r['predict']['median_ms'], r['val']['rec_loss']))
+    return results
+
+
+def print_result(r):
+    shape = 'bs=%d' % r['batch_size']
+    if r['kind'] == 'reader':
+        print('%-10s %-26s %-30s %10.1f records/s' % (r['kind'], r['name'], shape, r['records_per_sec']))
+        return
+    shape += ' T=%d size=%d h=%d' % (r.get('use_seq_len'), r.get('size'), r.get('h_dim', r.get('hc_dim')))
+    print('%-10s %-26s %-30s train %9.2f ms  predict %9.2f ms' % (r['kind'], r['name'], shape,
+                                                                  r['train']['median_ms'], r['predict']['median_ms']))
+
+
+def print_comparison(rows):
+    print('%-70s %-20s %12s %12s %9s' % ('benchmark', 'metric', 'baseline', 'current', 'change'))
+    for key, metric, old, new, change, regression in rows:
+        print('%-70s %-20s %12.2f %12.2f %+8.1f%% %s' % (' '.join(str(k) for k in key if k is not None), metric, old,
+                                                         new, change * 100, 'REGRESSION' if regression else ''))
+    n_regressions = sum(r[-1] for r in rows)
+    print('%d regressions out of %d comparisons' % (n_regressions, len(rows)))
+    return n_regressions
+
+
+if __name__ == '__main__':
+    main()
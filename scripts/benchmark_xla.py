@@ -0,0 +1,62 @@
+import os
+import json
+import argparse
+import tensorflow as tf
+from utils.benchmark import VARIANTS
+from utils.benchmark import benchmark_graph
+from utils.benchmark import run_isolated
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare step time and peak memory of the ADR graphs with and '
+                                                 'without XLA, on synthetic data')
+    parser.add_argument('--variants', nargs='+', default=VARIANTS, choices=VARIANTS)
+    parser.add_argument('--bs', type=int, default=32)
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--output', type=str, default='benchmark_xla.json')
+    args = parser.parse_args()
+
+    results = benchmark_xla(args.variants, batch_size=args.bs, seq_len=args.seq_len, use_seq_len=args.use_seq_len,
+                            steps=args.steps, warmup=args.warmup)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to', os.path.abspath(args.output))
+
+
+def benchmark_xla(variants, batch_size=32, seq_len=30, use_seq_len=12, steps=20, warmup=3):
+
+    results = []
+    for variant in variants:
+        row = {'variant': variant}
+        for xla in [False, True]:
+            # each measurement in its own process, otherwise peak RSS would carry over between runs
+            r = run_isolated(benchmark_graph, variant, batch_size=batch_size, seq_len=seq_len, steps=steps,
+                             warmup=warmup, train=True, predict=False, use_seq_len=use_seq_len, xla=xla)
+            r.update(run_isolated(benchmark_graph, variant, batch_size=batch_size, seq_len=seq_len, steps=steps,
+                                  warmup=warmup, train=False, predict=True, use_seq_len=use_seq_len, xla=xla))
+            row['xla' if xla else 'graph'] = r
+        results.append(row)
+
+    print('%-24s %-8s %12s %12s %14s %14s' % ('variant', 'mode', 'train ms', 'predict ms', 'train peak MB',
+                                               'predict peak MB'))
+    for row in results:
+        for mode in ['graph', 'xla']:
+            r = row[mode]
+            print('%-24s %-8s %12.2f %12.2f %14.1f %14.1f' % (row['variant'], mode, r['train']['median_ms'],
+                                                               r['predict']['median_ms'], r['train_peak_rss_mb'],
+                                                               r['predict_peak_rss_mb']))
+        speedup = row['graph']['train']['median_ms'] / row['xla']['train']['median_ms']
+        print('%-24s %-8s %11.2fx' % (row['variant'], 'speedup', speedup))
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ENTRY_POINTS = ['scripts.train_adr_ao', 'scripts.train_adr', 'scripts.train_adr_vp', 'scripts.evaluate_adr_ao',
+                'scripts.evaluate_adr_vp', 'scripts.evaluation_worker', 'scripts.benchmark', 'scripts.benchmark_xla',
+                'scripts.memory_report', 'scripts.make_synthetic_dataset', 'scripts.tune_runtime',
+                'scripts.export_saved_model', 'scripts.serve_predictor', 'scripts.quantize_adr_ao',
+                'scripts.export_numpy', 'scripts.distill', 'scripts.prune',
+                'scripts.compare_precision', 'scripts.roi_report']
+
+# optional backends that no entry point should pay for at import time, they are imported when used (scipy is not
+# listed because tf.keras imports it)
+FORBIDDEN = ['neptune', 'moviepy', 'robonet', 'matplotlib', 'keras']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure the import time of each entry point with python -X '
+                                                 'importtime and check it against a budget')
+    parser.add_argument('--entry_points', nargs='+', default=ENTRY_POINTS)
+    parser.add_argument('--budget_ms', type=float, default=None, help='budget for every entry point')
+    parser.add_argument('--budgets', type=str, default=None,
+                        help='json file of {entry point: budget in ms}, overrides --budget_ms per entry point')
+    parser.add_argument('--forbid', nargs='*', default=FORBIDDEN,
+                        help='top level packages that must not be imported by any entry point')
+    parser.add_argument('--repeat', type=int, default=3, help='the fastest of repeat runs is kept')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports listed per entry point')
+    args = parser.parse_args()
+
+    budgets = {}
+    if args.budgets:
+        with open(args.budgets, 'r') as f:
+            budgets = json.load(f)
+
+    failures = 0
+    for entry_point in args.entry_points:
+        runs = [import_time(entry_point) for _ in range(args.repeat)]
+        # the fastest successful run, or a failed one if none succeeded
+        succeeded = [r for r in runs if r[0] is not None]
+        total_ms, modules = min(succeeded, key=lambda r: r[0]) if succeeded else runs[0]
+        budget = budgets.get(entry_point, args.budget_ms)
+        forbidden = sorted(set(m.split('.')[0] for m in modules) & set(args.forbid))
+
+        status = 'ok'
+        if total_ms is None:
+            status = 'IMPORT FAILED'
+        elif budget is not None and total_ms > budget:
+            status = 'OVER BUDGET (%.0f ms)' % budget
+        if forbidden:
+            status += ', imports ' + ', '.join(forbidden)
+        failures += status != 'ok'
+
+        print('%-32s %10s  %s' % (entry_point, '-' if total_ms is None else '%.0f ms' % total_ms, status))
+        for name, ms in sorted(modules.items(), key=lambda m: -m[1])[:args.top]:
+            print('    %-40s %8.0f ms' % (name, ms))
+
+    sys.exit(1 if failures else 0)
+
+
+def import_time(module):
+    """
+    Imports module in a fresh interpreter with -X importtime. Returns the cumulative import time of module in ms
+    (None if the import failed) and {top level package: cumulative ms} of everything it imported.
+    """
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=ROOT,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    modules, total = {}, None
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [x.strip() for x in line[len('import time:'):].split('|')]
+        # a package is listed once per sub module, the largest cumulative time is the outermost import
+        top_level = name.split('.')[0]
+        modules[top_level] = max(modules.get(top_level, 0.0), int(cumulative) / 1000.0)
+        if name == module:
+            total = int(cumulative) / 1000.0
+    if p.returncode != 0:
+        total = None
+    return total, modules
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from models.precision import PRECISIONS
+from scripts.train_adr_ao import train_adr_ao
+from utils.utils import get_data
+from utils.benchmark import run_isolated
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Train ADR-AO from scratch in float32 and in mixed precision with '
+                                                 'the same seed and data, and compare the validation reconstruction '
+                                                 'curves and the epoch times')
+    parser.add_argument('--precisions', nargs='+', default=['float32', 'mixed_bfloat16'], choices=PRECISIONS)
+    parser.add_argument('--dataset', type=str, default='bair')
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--ckpt_dir', type=str, default=os.path.join(os.path.expanduser('~/'), 'adr/precision'),
+                        help='the models of each precision are saved to <ckpt_dir>/<precision>')
+    parser.add_argument('--bs', type=int, default=32)
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--steps', type=int, default=500, help='train steps per epoch')
+    parser.add_argument('--val_steps', type=int, default=None, help='default the whole validation split')
+    parser.add_argument('--learning_rate', type=float, default=4e-5)
+    parser.add_argument('--loss_scale', type=float, default=None, help='static loss scale, default 1024 for float16')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='largest relative difference of the final val_rec_loss with float32 counted as a match')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gpu_devices', type=str, default=None,
+                        help='visible GPU devices, e.g. 1. Default all, ignored on machines without a GPU')
+    parser.add_argument('--output', type=str, default='precision_report.json')
+    args = parser.parse_args()
+
+    report = {}
+    for precision in args.precisions:
+        report[precision] = run_isolated(train_precision, precision, **{k: v for k, v in vars(args).items()
+                                                                         if k not in ['precisions', 'tolerance',
+                                                                                      'output']})
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    reference = report.get('float32')
+    print('%-16s %14s %14s %12s %10s' % ('precision', 'val_rec_loss', 'best val_rec', 'epoch s', 'match'))
+    for precision, r in report.items():
+        final, best = r['history']['val_rec_loss'][-1], min(r['history']['val_rec_loss'])
+        match = ''
+        if reference is not None and precision != 'float32':
+            diff = abs(final - reference['history']['val_rec_loss'][-1]) / reference['history']['val_rec_loss'][-1]
+            match = '%.1f%% %s' % (diff * 100, 'ok' if diff <= args.tolerance else 'NO')
+        print('%-16s %14.6f %14.6f %12.1f %10s' % (precision, final, best, r['epoch_s'], match))
+    print('Report saved to', os.path.abspath(args.output))
+
+
+def train_precision(precision, dataset, dataset_dir, ckpt_dir, bs, seq_len, use_seq_len, epochs, steps, val_steps,
+                    learning_rate, loss_scale, seed, gpu_devices):
+    """Trains ADR-AO in precision from scratch, returns the per epoch history and the mean epoch time"""
+    tf.set_random_seed(seed)
+    np.random.seed(seed)
+    config = runtime_config(gpu_devices=gpu_devices)
+    frames, actions, states, _, train_iterator = get_data(dataset=dataset, mode='train', batch_size=bs,
+                                                          dataset_dir=dataset_dir, shuffle=True,
+                                                          sequence_length_train=seq_len,
+                                                          sequence_length_test=seq_len,
+                                                          private_threadpool_size=data_threads())
+    _, _, _, val_split_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=bs,
+                                                      dataset_dir=dataset_dir, shuffle=False,
+                                                      sequence_length_train=seq_len, sequence_length_test=seq_len,
+                                                      private_threadpool_size=data_threads())
+
+    start = time.perf_counter()
+    history = train_adr_ao(frames, actions, states, context_frames=2, hc_dim=128, ha_dim=16, epochs=epochs,
+                           steps=steps, learning_rate=learning_rate, gaussian=True, z_dim=10, kl_weight=5e-7,
+                           lstm_units=256, lstm_layers=1, config=config,
+                           val_steps=val_steps or val_split_steps, ckpt_dir=os.path.join(ckpt_dir, precision),
+                           train_iterator=train_iterator, val_iterator=val_iterator, use_seq_len=use_seq_len,
+                           eval_flag=False, neptune_log=False, precision=precision,
+                           loss_scale=loss_scale)
+    elapsed = time.perf_counter() - start
+
+    return {'precision': precision, 'epoch_s': elapsed / epochs,
+            'history': {k: [float(v) for v in values] for k, values in history.history.items()}}
+
+
+if __name__ == '__main__':
+    main()
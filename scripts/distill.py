@@ -0,0 +1,184 @@
+import os
+import json
+import functools
+import argparse
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from adr import adr_ao_distill
+from adr import adr_distill
+from adr import get_sub_model
+from models.lstm import load_lstm
+from models.encoder_decoder import load_encoder
+from models.encoder_decoder import load_decoder
+from models.encoder_decoder import load_recurrent_encoder
+from models.action_net import load_action_net
+from utils.utils import get_data
+from utils.evaluation import stream_evaluate
+from utils.evaluation import StreamingMetrics
+from utils.benchmark import benchmark_sub_model
+from utils.benchmark import run_isolated
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Distill the decoder (and optionally the context encoder) of a '
+                                                 'trained ADR into narrower students, one per width multiplier, and '
+                                                 'report speed against quality')
+    parser.add_argument('--part', type=str, default='ao', choices=['ao', 'vp'],
+                        help='ao: agent decoder Da (and Ec with --distill_ec), vp: object decoder Do')
+    parser.add_argument('--widths', type=float, nargs='+', default=[0.25, 0.5])
+    parser.add_argument('--distill_ec', action='store_true', help='also distill Ec (ao only)')
+    parser.add_argument('--ckpt_dir', type=str, required=True, help='teacher models, the students are saved here')
+    parser.add_argument('--dataset', type=str, default='bair')
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--bs', type=int, default=32, help='must be the batch size the teacher was saved with')
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--steps', type=int, default=None, help='steps per epoch, default the whole train split')
+    parser.add_argument('--learning_rate', type=float, default=1e-4)
+    parser.add_argument('--alpha', type=float, default=0.5, help='weight of the ground truth, 1 - alpha of the teacher')
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--ho_dim', type=int, default=32)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    parser.add_argument('--eo_load_name', type=str, default='Eo.h5')
+    parser.add_argument('--do_load_name', type=str, default='Do.h5')
+    parser.add_argument('--output', type=str, default='distillation_report.json')
+    args = parser.parse_args()
+
+    assert args.part == 'ao' or not args.distill_ec, 'Ec is only distilled with --part ao'
+    config = runtime_config(gpu_devices='1')
+    kwargs = {k: v for k, v in vars(args).items() if k not in ['widths', 'output']}
+
+    report = []
+    for width in args.widths:
+        r = distill(width, config=config, **kwargs)
+        r.update(speed(width, args.bs, args.use_seq_len, args.distill_ec))
+        report.append(r)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print('%-6s %-6s %12s %12s %10s %12s %12s %8s' % ('width', 'size', 'params', 'teacher', 'ms', 'teacher ms',
+                                                     'psnr', 'delta'))
+    for r in report:
+        print('%-6.2f %-6d %12d %12d %10.2f %12.2f %12.2f %8.2f' % (
+            r['width'], r['size'], r['params'], r['teacher_params'], r['predict_ms'], r['teacher_predict_ms'],
+            r['student']['psnr_mean'], r['student']['psnr_mean'] - r['teacher']['psnr_mean']))
+    print('Report saved to', os.path.abspath(args.output))
+
+
+def distill(width, part, ckpt_dir, dataset, dataset_dir, bs, seq_len, use_seq_len, context_frames, epochs, steps,
+            learning_rate, alpha, hc_dim, ha_dim, ho_dim, za_dim, lstm_a_units, lstm_a_layers, action_net_units,
+            ec_load_name, a_load_name, la_load_name, da_load_name, eo_load_name, do_load_name, distill_ec=False,
+            config=None):
+    """Trains the students of one width multiplier, saves them as full models next to the teacher and evaluates
+    them on the validation split. Returns the per horizon metrics of student and teacher."""
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    frames, actions, states, train_steps, train_iterator = get_data(dataset=dataset, mode='train', batch_size=bs,
+                                                                    dataset_dir=dataset_dir, shuffle=True,
+                                                                    sequence_length_train=seq_len,
+                                                                    sequence_length_test=seq_len)
+    _, _, _, val_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=bs, dataset_dir=dataset_dir,
+                                                shuffle=False, sequence_length_train=seq_len,
+                                                sequence_length_test=seq_len)
+    _, _, w, h, c = [int(s) for s in frames.shape]
+    a_dim, s_dim = int(actions.shape[-1]), int(states.shape[-1])
+    size = int(round(64 * width))
+    suffix = '_w%g.h5' % width
+
+    # ===== Frozen teacher
+    Ec = load_recurrent_encoder([bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
+                                filename=ec_load_name)
+    A = load_action_net(batch_shape=[bs, use_seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
+                        ckpt_dir=ckpt_dir, filename=a_load_name)
+    La = load_lstm(batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=za_dim, lstm_units=lstm_a_units,
+                   n_layers=lstm_a_layers, ckpt_dir=ckpt_dir, filename=la_load_name, lstm_type='gaussian', name='La')
+    Da = load_decoder(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + za_dim], model_name='Da', ckpt_dir=ckpt_dir,
+                      filename=da_load_name)
+
+    # ===== Students, instanced through get_sub_model like the train scripts do
+    students = {}
+    if part == 'ao':
+        if distill_ec:
+            students['Ec'] = get_sub_model(name='Ec', batch_shape=[bs, context_frames, w, h, c], h_dim=hc_dim,
+                                           ckpt_dir=ckpt_dir, filename=None, trainable=True, load_model_state=False,
+                                           load_flag=False, size=size)
+        skips_size = size if distill_ec else 64
+        students['Da'] = get_sub_model(name='Da', batch_shape=[bs, use_seq_len, hc_dim + ha_dim + za_dim],
+                                       h_dim=None, ckpt_dir=ckpt_dir, filename=None, trainable=True,
+                                       load_model_state=False, load_flag=False, size=size, skips_size=skips_size)
+        build = functools.partial(adr_ao_distill, frames, actions, states, context_frames, Ec=Ec, A=A, D=Da,
+                                  D_s=students['Da'], Ec_s=students.get('Ec'), L=La, gaussian=True,
+                                  use_seq_len=use_seq_len, lstm_units=lstm_a_units, lstm_layers=lstm_a_layers,
+                                  learning_rate=learning_rate, alpha=alpha)
+        teacher = [Da] + ([Ec] if distill_ec else [])
+        load_names = {'Ec': ec_load_name, 'Da': da_load_name}
+    else:
+        Eo = load_encoder(batch_shape=[bs, use_seq_len, w, h, c * 2], h_dim=ho_dim, model_name='Eo',
+                          ckpt_dir=ckpt_dir, filename=eo_load_name)
+        Do = load_decoder(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + ho_dim], model_name='Do',
+                          ckpt_dir=ckpt_dir, filename=do_load_name, output_channels=6)
+        students['Do'] = get_sub_model(name='Do', batch_shape=[bs, use_seq_len, hc_dim + ha_dim + ho_dim],
+                                       h_dim=None, ckpt_dir=ckpt_dir, filename=None, trainable=True,
+                                       load_model_state=False, load_flag=False, size=size, skips_size=64,
+                                       output_channels=6)
+        build = functools.partial(adr_distill, frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Do=Do,
+                                  Da=Da, Do_s=students['Do'], La=La, gaussian_a=True, use_seq_len=use_seq_len,
+                                  lstm_units=lstm_a_units, lstm_layers=lstm_a_layers, learning_rate=learning_rate,
+                                  alpha=alpha)
+        teacher = [Do]
+        load_names = {'Do': do_load_name}
+
+    model = build(random_window=True)
+    model.fit(x=train_iterator, epochs=epochs, steps_per_epoch=steps or train_steps, verbose=2)
+
+    filenames = {}
+    for name, student in students.items():
+        filenames[name] = os.path.splitext(load_names[name])[0] + suffix
+        tf.keras.models.save_model(student, os.path.join(ckpt_dir, filenames[name]))
+
+    result = {'width': width, 'size': size, 'part': part, 'files': filenames,
+              'params': int(sum(s.count_params() for s in students.values())),
+              'teacher_params': int(sum(t.count_params() for t in teacher))}
+
+    # student and teacher scored in the same pass, on the same windows (the first use_seq_len frames)
+    eval_model = build(random_window=False)
+    teacher_metrics = StreamingMetrics(['mse', 'psnr'])
+    result['student'] = stream_evaluate(eval_model, val_steps, pred_index=0, target_index=1, iterator=val_iterator,
+                                        metrics=['mse', 'psnr'],
+                                        batch_callback=lambda _, outs: teacher_metrics.update(outs[2], outs[1]))
+    result['teacher'] = teacher_metrics.result()
+    K.clear_session()
+    return result
+
+
+def speed(width, bs, use_seq_len, distill_ec):
+    """Predict time of the distilled sub models at the student and the teacher width, each in a fresh process"""
+    names = ['image_decoder'] + (['recurrent_image_encoder'] if distill_ec else [])
+    size = int(round(64 * width))
+    result = {'predict_ms': 0.0, 'teacher_predict_ms': 0.0}
+    for name in names:
+        for key, s in [('predict_ms', size), ('teacher_predict_ms', 64)]:
+            r = run_isolated(benchmark_sub_model, name, batch_size=bs, use_seq_len=use_seq_len, size=s, train=False)
+            result[key] += r['predict']['median_ms']
+    result['speedup'] = result['teacher_predict_ms'] / max(result['predict_ms'], 1e-9)
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,19 @@ import tensorflow as tf
 
 from utils.utils import get_data
 from adr import adr_ao
+from adr import adr_ao_best_of_n
 from models.lstm import load_lstm
 from models.encoder_decoder import load_decoder
 from models.encoder_decoder import load_recurrent_encoder
 from models.action_net import load_action_net
 from models.action_net import load_recurrent_action_net
 import tensorflow.python.keras.backend as K
-import matplotlib.pyplot as plt
 from tensorflow.python.keras.optimizers import Adam
 import numpy as np
 from utils.utils import save_gifs
+from utils.evaluation import stream_evaluate
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
 
 
 def main():
@@ -24,16 +27,16 @@ def main():
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
     ckpt_dir = os.path.join('/home/mandre/adr/trained_models/bair')
 
+    config = runtime_config(gpu_devices='1')
+
     frames, actions, states, steps, iterator = get_data(dataset='bair', mode=mode, batch_size=bs, shuffle=False,
                                                         dataset_dir=dataset_dir, sequence_length_train=seq_len,
-                                                        sequence_length_test=seq_len)
+                                                        sequence_length_test=seq_len,
+                                                        private_threadpool_size=data_threads())
 
     _, _, _, val_steps, val_iterator = get_data(dataset='bair', mode='val', batch_size=bs, shuffle=False,
                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len,
-                                                sequence_length_test=seq_len)
-
-    gpu_options = tf.GPUOptions(visible_device_list='1')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+                                                sequence_length_test=seq_len, private_threadpool_size=data_threads())
 
     evaluate_autoencoder_A(frames,
                            actions,
@@ -67,7 +70,20 @@ def evaluate_autoencoder_A(frames, actions, states=None, iterator=None, ckpt_dir
                            hc_dim=128, ha_dim=16, z_dim=10, units=256, config=None, steps=None, val_steps=None,
                            lstm_units=256, lstm_layers=1, ec_filename='Ec.h5', d_filename='Da.h5',
                            a_filename='A.h5', l_filename='L.h5', set_states=False, evaluate=False, predict=True,
-                           random_window=False, eval_kld=False, use_seq_len=12):
+                           random_window=False, eval_kld=False, use_seq_len=12, refit=True, spill_path=None,
+                           n_samples=1):
+    """
+    - n_samples: (int) with gaussian=True and n_samples > 1, each sequence is reconstructed from n_samples draws of z
+                 in one pass (see adr_ao_best_of_n), the metrics are the best/mean/worst over the samples and
+                 predict uses the best sample
+    - refit: (boolean) when evaluating, first run one epoch with learning rate 0 (updates the BatchNormalization
+             statistics) before calling evaluate
+    - predict: (boolean) run the model batch by batch, saving gifs of the first batch and accumulating per
+               horizon MSE, PSNR and SSIM of the reconstructions
+    - spill_path: (str) if given, the reconstructions of the whole split are also saved to this .npy memmap
+    Returns a dictionary with the evaluated metrics if evaluate is True, otherwise None, and a dictionary with the
+    per horizon curves if predict is True, otherwise None
+    """
 
     bs, seq_len, w, h, c = [int(s) for s in frames.shape]
     a_dim = int(actions.shape[-1]) if actions is not None else 0
@@ -104,35 +120,50 @@ def evaluate_autoencoder_A(frames, actions, states=None, iterator=None, ckpt_dir
                             [0.65, -0.3, 0.2],    [0.60833, -0.25833, 0.2], [0.5666, -0.21666, 0.2]]]*bs,
                             dtype='float32').initialized_value()
 
-    model = adr_ao(frames,
-                   actions,
-                   states,
-                   context_frames,
-                   Ec=Ec,
-                   A=A,
-                   D=D,
-                   L=L,
-                   use_seq_len=use_seq_len,
-                   learning_rate=0.0,
-                   gaussian=gaussian,
-                   kl_weight=0.0,
-                   lstm_units=lstm_units,
-                   lstm_layers=lstm_layers,
-                   training=False,
-                   random_window=random_window)
-
+    if n_samples > 1:
+        assert gaussian, 'Best of n_samples evaluation requires gaussian=True'
+        model = adr_ao_best_of_n(frames, actions, states, context_frames, Ec=Ec, A=A, D=D, L=L, n_samples=n_samples,
+                                 use_seq_len=use_seq_len, lstm_units=lstm_units, lstm_layers=lstm_layers,
+                                 random_window=random_window)
+    else:
+        model = adr_ao(frames,
+                       actions,
+                       states,
+                       context_frames,
+                       Ec=Ec,
+                       A=A,
+                       D=D,
+                       L=L,
+                       use_seq_len=use_seq_len,
+                       learning_rate=0.0,
+                       gaussian=gaussian,
+                       kl_weight=0.0,
+                       lstm_units=lstm_units,
+                       lstm_layers=lstm_layers,
+                       training=False,
+                       random_window=random_window)
+
+    metrics = None
     if evaluate:
-        model.compile(optimizer=Adam(lr=0.0))
-        model.fit(x=None, epochs=1, steps_per_epoch=steps, validation_data=iterator, validation_steps=val_steps)
-        model.evaluate(x=iterator, steps=steps)
+        if refit:
+            model.compile(optimizer=Adam(lr=0.0))
+            model.fit(x=None, epochs=1, steps_per_epoch=steps, validation_data=iterator, validation_steps=val_steps)
+        results = model.evaluate(x=iterator, steps=steps)
+        metrics = dict(zip(model.metrics_names, [float(r) for r in results]))
 
+    curves = None
     if predict:
-        x, imgs, mu, logvar = model.predict(x=None, steps=steps)
-        print(np.mean(np.square(x-imgs)))
-        save_gifs(sequence=np.clip(x, a_min=0.0, a_max=1.0), name='adr_ao',
-                  save_dir=os.path.join(os.path.expanduser('~/'), 'adr/gifs'))
-        # return x, imgs
-    return None, None
+        def save_first_batch(i, outs):
+            if i == 0:
+                save_gifs(sequence=np.clip(outs[0], a_min=0.0, a_max=1.0), name='adr_ao',
+                          save_dir=os.path.join(os.path.expanduser('~/'), 'adr/gifs'))
+
+        # outputs: x_rec (x_best with n_samples > 1), targets, ...
+        curves = stream_evaluate(model, steps, pred_index=0, target_index=1, spill_path=spill_path,
+                                 batch_callback=save_first_batch)
+        print('MSE: %.6f  PSNR: %.3f  SSIM: %.4f' % (curves['mse_mean'], curves['psnr_mean'], curves['ssim_mean']))
+
+    return metrics, curves
 
 
 if __name__ == '__main__':
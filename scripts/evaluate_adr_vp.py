@@ -11,6 +11,9 @@ from models.action_net import load_recurrent_action_net
 import tensorflow.python.keras.backend as K
 from adr import adr_vp_teacher_forcing, adr_vp_feedback, adr_vp_feedback_frames
 from utils.utils import save_gifs
+from utils.evaluation import stream_evaluate
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
 
 
 def main():
@@ -22,16 +25,17 @@ def main():
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
     ckpt_dir = os.path.join('/home/mandre/adr/trained_models/bair/random_window')
 
-    frames, actions, states, steps, _ = get_data(dataset='bair', mode=mode, batch_size=bs, shuffle=False,
-                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len,
-                                                 sequence_length_test=seq_len)
+    config = runtime_config(gpu_devices='0')
 
-    gpu_options = tf.GPUOptions(visible_device_list='0')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+    frames, actions, states, steps, iterator = get_data(dataset='bair', mode=mode, batch_size=bs, shuffle=False,
+                                                        dataset_dir=dataset_dir, sequence_length_train=seq_len,
+                                                        sequence_length_test=seq_len,
+                                                        private_threadpool_size=data_threads())
 
     evaluate_adr_vp(frames,
                     actions,
                     states,
+                    iterator=iterator,
                     ckpt_dir=ckpt_dir,
                     context_frames=2,
                     use_seq_len=use_seq_len,
@@ -60,11 +64,20 @@ def main():
                     random_window=True)
 
 
-def evaluate_adr_vp(frames, actions, states, context_frames, ckpt_dir=None, hc_dim=128, ha_dim=16, ho_dim=32, za_dim=10,
+def evaluate_adr_vp(frames, actions, states, context_frames, iterator=None, ckpt_dir=None, hc_dim=128, ha_dim=16, ho_dim=32, za_dim=10,
                     gaussian_a=True, use_seq_len=30, lstm_layers=2, lstm_units=256, lstm_a_layers=1, lstm_a_units=256,
                     action_net_units=256, ec_load_name='Ec.h5', a_load_name='A.h5', eo_load_name='Eo.h5',
                     da_load_name='Da.h5', do_load_name='Do.h5', la_load_name='La.h5', l_load_name='L.h5', config=None,
-                    evaluate=False, predict=True, steps=1, feedback_predictions=True, random_window=False):
+                    evaluate=False, predict=True, steps=1, feedback_predictions=True, random_window=False,
+                    gif_dir='/home/mandre/adr/gifs', spill_path=None):
+    """
+    - iterator: the tf.data iterator of the split to evaluate, or None if the model inputs are fed by the graph
+    - predict: (boolean) run the model batch by batch, saving gifs of the first batch and accumulating per
+               horizon MSE, PSNR and SSIM of the predicted frames
+    - spill_path: (str) if given, the predicted frames of the whole split are also saved to this .npy memmap
+    Returns a dictionary with the evaluated metrics if evaluate is True, otherwise None, and a dictionary with the
+    per horizon curves if predict is True, otherwise None
+    """
 
     bs, seq_len, w, h, c = [int(s) for s in frames.shape]
     a_dim = int(actions.shape[-1]) if actions is not None else 0
@@ -113,16 +126,26 @@ def evaluate_adr_vp(frames, actions, states, context_frames, ckpt_dir=None, hc_d
                                        La=La, gaussian_a=gaussian_a, use_seq_len=use_seq_len, lstm_a_units=lstm_a_units,
                                        lstm_a_layers=lstm_a_layers, lstm_units=lstm_units, lstm_layers=lstm_layers,
                                        learning_rate=0.0, random_window=random_window)
+    metrics = None
     if evaluate:
-        model.evaluate(x=None, steps=steps)
+        results = model.evaluate(x=iterator, steps=steps)
+        metrics = dict(zip(model.metrics_names, [float(r) for r in results]))
 
+    curves = None
     if predict:
-        ho_pred, x_curr, x, x_a, imgs = model.predict(x=None, steps=steps)
-        save_gifs(sequence=np.clip(x[:bs], a_min=0.0, a_max=1.0), name='pred', save_dir=os.path.join('/home/mandre/adr/gifs'))
-        save_gifs(sequence=np.clip(x_a[:bs], a_min=0.0, a_max=1.0), name='pred_a', save_dir=os.path.join('/home/mandre/adr/gifs'))
-        save_gifs(sequence=imgs[:bs], name='gt', save_dir=os.path.join('/home/mandre/adr/gifs'))
-
-    return None, None
+        def save_first_batch(i, outs):
+            if i == 0:
+                ho_pred, x_curr, x, x_a, imgs = outs
+                save_gifs(sequence=np.clip(x, a_min=0.0, a_max=1.0), name='pred', save_dir=gif_dir)
+                save_gifs(sequence=np.clip(x_a, a_min=0.0, a_max=1.0), name='pred_a', save_dir=gif_dir)
+                save_gifs(sequence=imgs, name='gt', save_dir=gif_dir)
+
+        # outputs: ho_pred, x_curr, x_pred, x_rec_a, targets
+        curves = stream_evaluate(model, steps, pred_index=2, target_index=4, iterator=iterator,
+                                 spill_path=spill_path, batch_callback=save_first_batch)
+        print('MSE: %.6f  PSNR: %.3f  SSIM: %.4f' % (curves['mse_mean'], curves['psnr_mean'], curves['ssim_mean']))
+
+    return metrics, curves
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+import os
+import re
+import glob
+import json
+import time
+import argparse
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from utils.utils import get_data
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
+from scripts.evaluate_adr_ao import evaluate_autoencoder_A
+from scripts.evaluate_adr_vp import evaluate_adr_vp
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+# Same hyperparameters as the main() of the corresponding train/evaluate scripts. 'watch' lists the files written
+# by ModelCheckpoint during training, 'static' the frozen sub models that are loaded but not retrained.
+CONFIGS = {
+    'adr_ao': {'watch': {'ec_filename': 'Ec_a_test.h5', 'a_filename': 'A_a_test.h5', 'd_filename': 'D_a_test.h5',
+                         'l_filename': 'L_a_test.h5'},
+               'static': {},
+               'kwargs': {'context_frames': 2, 'gaussian': True, 'hc_dim': 128, 'ha_dim': 16, 'z_dim': 10,
+                          'units': 256, 'lstm_units': 256, 'lstm_layers': 1, 'use_seq_len': 12,
+                          'random_window': False}},
+    'adr_vp': {'watch': {'l_load_name': 'L.h5', 'eo_load_name': 'Eo.h5', 'do_load_name': 'D_o.h5'},
+               'static': {'ec_load_name': 'Ec_a_t00295v00304.h5', 'a_load_name': 'A_a_t00295v00304.h5',
+                          'da_load_name': 'D_a_t00295v00304.h5', 'la_load_name': 'L_a_t00295v00304.h5'},
+               'kwargs': {'context_frames': 2, 'gaussian_a': True, 'hc_dim': 64, 'ha_dim': 16, 'ho_dim': 32,
+                          'za_dim': 10, 'lstm_units': 256, 'lstm_a_units': 256, 'lstm_layers': 2,
+                          'lstm_a_layers': 1, 'action_net_units': 256, 'use_seq_len': 12,
+                          'feedback_predictions': True, 'random_window': False}}
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Evaluate new checkpoints written to ckpt_dir on the val split, '
+                                                 'in a separate process from training')
+    parser.add_argument('--model', type=str, default='adr_ao', choices=list(CONFIGS.keys()))
+    parser.add_argument('--ckpt_dir', type=str, required=True)
+    parser.add_argument('--dataset_dir', type=str, default='/media/Data/datasets/bair/softmotion30_44k/')
+    parser.add_argument('--metrics_file', type=str, default=None,
+                        help='defaults to eval_metrics.jsonl inside ckpt_dir')
+    parser.add_argument('--bs', type=int, default=32)
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--poll_interval', type=float, default=30.0)
+    parser.add_argument('--threads', type=int, default=None,
+                        help='intra op threads, defaults to the tuned setting or one per usable core')
+    parser.add_argument('--slot', type=int, default=None, help='pin to the slot-th of n_slots groups of cores')
+    parser.add_argument('--n_slots', type=int, default=None)
+    parser.add_argument('--once', action='store_true', help='evaluate the latest checkpoint and exit')
+    args = parser.parse_args()
+
+    metrics_file = args.metrics_file or os.path.join(args.ckpt_dir, 'eval_metrics.jsonl')
+    config = runtime_config(intra_op_threads=args.threads, inter_op_threads=1, slot=args.slot, n_slots=args.n_slots)
+
+    watch(args.model, args.ckpt_dir, args.dataset_dir, metrics_file, bs=args.bs, seq_len=args.seq_len,
+          poll_interval=args.poll_interval, config=config, once=args.once)
+
+
+def find_checkpoints(ckpt_dir, filenames):
+    """
+    Returns {version: {argument: path}} for every checkpoint version for which all the files exist. The plain
+    filenames are version '', and the files written by ModelCheckpoint with keep_all=True are versioned by their
+    '_t<train loss>_v<val loss>' suffix.
+    """
+    versions = None
+    for arg, f in filenames.items():
+        base = f.replace('.h5', '')
+        found = {}
+        if os.path.isfile(os.path.join(ckpt_dir, f)):
+            found[''] = os.path.join(ckpt_dir, f)
+        for path in glob.glob(os.path.join(ckpt_dir, glob.escape(base) + '_t*_v*.h5')):
+            match = re.match(re.escape(base) + r'(_t.+_v.+)\.h5$', os.path.basename(path))
+            if match:
+                found[match.group(1)] = path
+        versions = {v: {} for v in found} if versions is None else {v: versions[v] for v in versions if v in found}
+        for v in versions:
+            versions[v][arg] = found[v]
+    return versions or {}
+
+
+def signature(paths):
+    return tuple(sorted((p, os.path.getmtime(p)) for p in paths.values()))
+
+
+def watch(model, ckpt_dir, dataset_dir, metrics_file, bs=32, seq_len=30, poll_interval=30.0, config=None,
+          once=False):
+
+    evaluated = set()
+    previous = {}
+
+    while True:
+        candidates = []
+        for version, paths in find_checkpoints(ckpt_dir, CONFIGS[model]['watch']).items():
+            try:
+                sig = signature(paths)
+            except OSError:
+                continue  # replaced while listing
+            # only evaluate once the files stopped changing for a poll, so that all sub models belong to the same
+            # checkpoint (ModelCheckpoint writes them one after the other)
+            if sig not in evaluated and (once or previous.get(version) == sig):
+                candidates.append((max(m for _, m in sig), version, paths, sig))
+            previous[version] = sig
+
+        if candidates:
+            _, version, paths, sig = max(candidates, key=lambda c: c[0])
+            metrics = evaluate_checkpoint(model, ckpt_dir, dataset_dir, paths, bs=bs, seq_len=seq_len,
+                                          config=config)
+            publish(metrics_file, {'time': time.time(), 'model': model, 'version': version,
+                                   'files': {k: os.path.basename(p) for k, p in paths.items()}, 'metrics': metrics})
+            evaluated.add(sig)
+
+        if once:
+            return
+        time.sleep(poll_interval)
+
+
+def evaluate_checkpoint(model, ckpt_dir, dataset_dir, paths, bs=32, seq_len=30, config=None):
+
+    tf.reset_default_graph()
+    K.clear_session()
+
+    frames, actions, states, steps, iterator = get_data(dataset='bair', mode='val', batch_size=bs, shuffle=False,
+                                                        dataset_dir=dataset_dir, sequence_length_train=seq_len,
+                                                        sequence_length_test=seq_len,
+                                                        private_threadpool_size=data_threads())
+    filenames = {k: os.path.basename(p) for k, p in paths.items()}
+    filenames.update(CONFIGS[model]['static'])
+
+    if model == 'adr_ao':
+        metrics, _ = evaluate_autoencoder_A(frames, actions, states, iterator=iterator, ckpt_dir=ckpt_dir,
+                                            config=config, steps=steps, val_steps=steps, evaluate=True,
+                                            predict=False, refit=False, **filenames, **CONFIGS[model]['kwargs'])
+    else:
+        metrics, _ = evaluate_adr_vp(frames, actions, states, iterator=iterator, ckpt_dir=ckpt_dir, config=config,
+                                     steps=steps, evaluate=True, predict=False, **filenames,
+                                     **CONFIGS[model]['kwargs'])
+    K.clear_session()
+    return metrics
+
+
+def publish(metrics_file, record):
+    with open(metrics_file, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(json.dumps(record))
+
+
+if __name__ == '__main__':
+    main()
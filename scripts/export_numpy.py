@@ -0,0 +1,76 @@
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from utils.export import load_predictor_models
+from utils.numpy_export import export_numpy
+from utils.numpy_export import check_numpy_parity
+from models.numpy_runtime import NumpyAgentPredictor
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Export the agent only path of ADR-AO (Ec, A, La, Da) to an .npz for '
+                                                 'the NumPy runtime and check it against the Keras models')
+    parser.add_argument('--ckpt_dir', type=str, required=True)
+    parser.add_argument('--output', type=str, default='adr_ao_agent.npz')
+    parser.add_argument('--bs', type=int, default=4, help='batch size of the parity check')
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--seq_len', type=int, default=12)
+    parser.add_argument('--tolerance', type=float, default=1e-4, help='largest accepted difference per sub model')
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--a_dim', type=int, default=4)
+    parser.add_argument('--s_dim', type=int, default=3)
+    parser.add_argument('--no_gaussian_a', action='store_true')
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    args = parser.parse_args()
+
+    gaussian_a = not args.no_gaussian_a
+    sess = tf.Session()
+    K.set_session(sess)
+    K.set_learning_phase(0)
+
+    models = load_predictor_models(args.ckpt_dir, args.bs, args.context_frames, args.seq_len, hc_dim=args.hc_dim,
+                                   ha_dim=args.ha_dim, za_dim=args.za_dim, a_dim=args.a_dim, s_dim=args.s_dim,
+                                   gaussian_a=gaussian_a, lstm_a_units=args.lstm_a_units,
+                                   lstm_a_layers=args.lstm_a_layers, action_net_units=args.action_net_units,
+                                   ec_load_name=args.ec_load_name, a_load_name=args.a_load_name,
+                                   la_load_name=args.la_load_name, da_load_name=args.da_load_name)
+    export_numpy(args.output, models, args.context_frames, gaussian_a=gaussian_a)
+    print('Weights written to %s (%.1f MB)' % (os.path.abspath(args.output), os.path.getsize(args.output) / 2.0 ** 20))
+
+    start = time.perf_counter()
+    predictor = NumpyAgentPredictor(args.output)
+    print('NumPy runtime loaded in %.1f ms' % ((time.perf_counter() - start) * 1000.0))
+
+    rng = np.random.RandomState(0)
+    frames = rng.uniform(size=[args.bs, args.seq_len, 64, 64, 3]).astype('float32')
+    actions = rng.uniform(-1, 1, size=[args.bs, args.seq_len, args.a_dim]).astype('float32')
+    states = rng.uniform(-1, 1, size=[args.bs, args.seq_len, args.s_dim]).astype('float32')
+    errors = check_numpy_parity(models, predictor, frames, actions, states, args.context_frames,
+                                lstm_a_units=args.lstm_a_units, lstm_a_layers=args.lstm_a_layers)
+
+    start = time.perf_counter()
+    predictor.predict_agent((frames[:, :args.context_frames] * 255).astype('uint8'), actions, states)
+    print('Agent prediction of %d sequences in %.1f ms' % (args.bs, (time.perf_counter() - start) * 1000.0))
+
+    for name, error in errors.items():
+        print('%-4s max abs difference %.2e %s' % (name, error, 'ok' if error < args.tolerance else 'FAILED'))
+    if any(e >= args.tolerance for e in errors.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import os
+import argparse
+import tensorflow as tf
+from utils.export import export_predictor
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compose trained ADR sub models into one inference graph and write '
+                                                 'it as a SavedModel with encode_context, predict_agent and rollout '
+                                                 'signatures')
+    parser.add_argument('--ckpt_dir', type=str, required=True, help='directory with the sub model h5 files')
+    parser.add_argument('--export_dir', type=str, required=True, help='must not exist')
+    parser.add_argument('--bs', type=int, default=1, help='batch size of the exported graph')
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--seq_len', type=int, default=12)
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--ho_dim', type=int, default=32)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--no_gaussian_a', action='store_true', help='the agent path has no La')
+    parser.add_argument('--lstm_units', type=int, default=256)
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_layers', type=int, default=2)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    parser.add_argument('--eo_load_name', type=str, default=None,
+                        help='Eo, L and Do are needed for the rollout signature, leave them out to export ADR-AO only')
+    parser.add_argument('--l_load_name', type=str, default=None)
+    parser.add_argument('--do_load_name', type=str, default=None)
+    parser.add_argument('--no_fold_bn', action='store_true',
+                        help='keep the batch norm layers instead of folding them into the conv/dense kernels')
+    args = parser.parse_args()
+
+    vp = [args.eo_load_name, args.l_load_name, args.do_load_name]
+    assert all(vp) or not any(vp), 'Eo, L and Do must be given together'
+
+    export_predictor(args.export_dir, args.ckpt_dir, batch_size=args.bs, context_frames=args.context_frames,
+                     seq_len=args.seq_len, config=runtime_config(), fold_bn=not args.no_fold_bn,
+                     hc_dim=args.hc_dim, ha_dim=args.ha_dim, ho_dim=args.ho_dim, za_dim=args.za_dim,
+                     gaussian_a=not args.no_gaussian_a, lstm_units=args.lstm_units, lstm_a_units=args.lstm_a_units,
+                     lstm_layers=args.lstm_layers, lstm_a_layers=args.lstm_a_layers,
+                     action_net_units=args.action_net_units, ec_load_name=args.ec_load_name,
+                     a_load_name=args.a_load_name, la_load_name=args.la_load_name, da_load_name=args.da_load_name,
+                     eo_load_name=args.eo_load_name, l_load_name=args.l_load_name, do_load_name=args.do_load_name)
+    print('SavedModel written to', os.path.abspath(args.export_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+import argparse
+from utils.synthetic_dataset import DATASETS
+from utils.synthetic_dataset import write_dataset
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Write a small synthetic dataset of moving objects with the '
+                                                 'tfrecord format and directory layout of BAIR or Google Push, '
+                                                 'readable by get_data')
+    parser.add_argument('--dataset', type=str, default='bair', choices=list(DATASETS.keys()))
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--n_train', type=int, default=512, help='sequences in the train dir (split into train/val)')
+    parser.add_argument('--n_test', type=int, default=128)
+    parser.add_argument('--per_file', type=int, default=64, help='sequences per tfrecord file')
+    parser.add_argument('--seq_len', type=int, default=None, help='defaults to 30 for bair and 20 for google')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    train, test = write_dataset(args.dataset_dir, args.dataset, n_train=args.n_train, n_test=args.n_test,
+                                per_file=args.per_file, seq_len=args.seq_len, seed=args.seed)
+    print('Wrote %d train and %d test files to %s' % (len(train), len(test), os.path.abspath(args.dataset_dir)))
+
+
+if __name__ == '__main__':
+    main()
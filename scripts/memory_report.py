@@ -0,0 +1,88 @@
+import os
+import json
+import argparse
+import tensorflow as tf
+from utils.benchmark import VARIANTS
+from utils.memory_report import static_report
+from utils.memory_report import measure_step_memory
+from utils.memory_report import find_max_batch_size
+from utils.memory_report import run_probe
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Report parameter memory, activation memory, FLOPs and measured '
+                                                 'peak memory of one step of an ADR graph, or find the largest batch '
+                                                 'size that fits a memory budget')
+    parser.add_argument('--variant', type=str, default='adr_ao', choices=VARIANTS)
+    parser.add_argument('--bs', type=int, default=32)
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--size', type=int, default=64)
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ho_dim', type=int, default=32)
+    parser.add_argument('--lstm_units', type=int, default=256)
+    parser.add_argument('--budget_mb', type=float, default=None,
+                        help='find the largest batch size whose peak memory fits this budget')
+    parser.add_argument('--mode', type=str, default='train', choices=['train', 'predict'],
+                        help='step measured by the batch size finder')
+    parser.add_argument('--top', type=int, default=15, help='number of layers listed by activation size')
+    parser.add_argument('--output', type=str, default='memory_report.json')
+    args = parser.parse_args()
+
+    kwargs = {'use_seq_len': args.use_seq_len, 'size': args.size, 'hc_dim': args.hc_dim, 'ho_dim': args.ho_dim,
+              'lstm_units': args.lstm_units}
+
+    if args.budget_mb is not None:
+        bs, probes = find_max_batch_size(args.variant, args.budget_mb, mode=args.mode, seq_len=args.seq_len,
+                                         **kwargs)
+        print('Largest %s batch size within %.0f MB: %s' % (args.mode, args.budget_mb, bs))
+        result = {'variant': args.variant, 'mode': args.mode, 'budget_mb': args.budget_mb, 'batch_size': bs,
+                  'probes': probes, 'kwargs': kwargs}
+    else:
+        result = memory_report(args.variant, args.bs, args.seq_len, top=args.top, **kwargs)
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print('Report saved to', os.path.abspath(args.output))
+
+
+def memory_report(variant, batch_size, seq_len, top=15, **kwargs):
+
+    # each part in its own process, so that the measured peaks only include one step of one graph
+    report = run_probe(static_report, variant, batch_size=batch_size, seq_len=seq_len, **kwargs)
+    if report is None:
+        # building the graph alone did not fit, the steps cannot fit either
+        print('%s, batch size %d: out of memory' % (variant, batch_size))
+        return {'variant': variant, 'batch_size': batch_size, 'out_of_memory': True}
+    for mode in ['train', 'predict']:
+        report[mode] = run_probe(measure_step_memory, variant, mode=mode, batch_size=batch_size, seq_len=seq_len,
+                                 **kwargs)
+
+    print('%s, batch size %d' % (variant, batch_size))
+    print('%-10s %12s %12s %14s' % ('sub model', 'params', 'params MB', 'optimizer MB'))
+    for name, p in report['params'].items():
+        print('%-10s %12d %12.2f %14.2f' % (name, p['params'], p['params_mb'], p['optimizer_mb']))
+    print('%-10s %12s %12.2f %14.2f' % ('total', '', report['params_mb'], report['optimizer_mb']))
+
+    print('\nActivation memory (static estimate): %.1f MB. Largest layers:' % report['activation_mb'])
+    for a in report['activations'][:top]:
+        print('  %-60s %-24s x%d %10.2f MB' % (a['layer'], a['type'], a['calls'], a['activation_mb']))
+
+    print('\nFLOPs per step: predict %.3f GFLOPs, train %.3f GFLOPs' % (report['predict_flops'] / 1e9,
+                                                                         report['train_flops'] / 1e9))
+    for mode in ['train', 'predict']:
+        r = report[mode]
+        if r is None:
+            print('%s step: out of memory' % mode)
+        else:
+            print('%s step: peak RSS %.1f MB (%.1f MB after building the graph)%s' %
+                  (mode, r['peak_rss_mb'], r['rss_build_mb'],
+                   ', peak GPU %.1f MB' % r['peak_gpu_mb'] if 'peak_gpu_mb' in r else ''))
+    return report
+
+
+if __name__ == '__main__':
+    main()
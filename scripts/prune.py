@@ -0,0 +1,214 @@
+import os
+import json
+import shutil
+import argparse
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from adr import adr_ao
+from adr import adr
+from models.lstm import load_lstm
+from models.encoder_decoder import load_encoder
+from models.encoder_decoder import load_decoder
+from models.encoder_decoder import load_recurrent_encoder
+from models.action_net import load_action_net
+from models.pruning import bn_gamma_plan
+from models.pruning import prune_model
+from models.pruning import prune_encoder_decoders
+from scripts.train_adr_ao import train_adr_ao
+from scripts.train_adr import train_adr
+from utils.utils import get_data
+from utils.evaluation import stream_evaluate
+from utils.benchmark import benchmark_model_file
+from utils.benchmark import run_isolated
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Remove the filters with the smallest batch norm scale from the '
+                                                 'encoder and decoder of a trained ADR, fine-tune the smaller models '
+                                                 'and report latency against quality at each sparsity')
+    parser.add_argument('--part', type=str, default='ao', choices=['ao', 'vp'],
+                        help='ao: Ec and Da, whose skips are pruned together (an object part trained on the original '
+                             'Ec no longer fits the pruned one), vp: Eo and Do')
+    parser.add_argument('--sparsities', type=float, nargs='+', default=[0.25, 0.5, 0.75],
+                        help='fraction of the filters removed from each prunable layer')
+    parser.add_argument('--ckpt_dir', type=str, required=True,
+                        help='trained full models, the pruned ones are saved to <ckpt_dir>/pruned_s<sparsity>')
+    parser.add_argument('--dataset', type=str, default='bair')
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--bs', type=int, default=32, help='must be the batch size the models were saved with')
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=2, help='fine-tune epochs after pruning, 0 to skip')
+    parser.add_argument('--steps', type=int, default=500, help='fine-tune steps per epoch')
+    parser.add_argument('--learning_rate', type=float, default=1e-4)
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--ho_dim', type=int, default=32)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    parser.add_argument('--eo_load_name', type=str, default='Eo.h5')
+    parser.add_argument('--do_load_name', type=str, default='Do.h5')
+    parser.add_argument('--output', type=str, default='pruning_report.json')
+    args = parser.parse_args()
+
+    config = runtime_config(gpu_devices='1')
+    kwargs = {k: v for k, v in vars(args).items() if k not in ['sparsities', 'output']}
+    pruned_names = [args.ec_load_name, args.da_load_name] if args.part == 'ao' else [args.eo_load_name,
+                                                                                      args.do_load_name]
+
+    report = [dict(sparsity=0.0, ckpt_dir=args.ckpt_dir, quality=evaluate(args.ckpt_dir, config=config, **kwargs),
+                   **speed(args.ckpt_dir, pruned_names, args.use_seq_len))]
+    for sparsity in args.sparsities:
+        out_dir = os.path.join(args.ckpt_dir, 'pruned_s%g' % sparsity)
+        r = {'sparsity': sparsity, 'ckpt_dir': out_dir, 'plans': prune(sparsity, out_dir, **kwargs)}
+        if args.epochs > 0:
+            fine_tune(out_dir, config=config, **kwargs)
+        r['quality'] = evaluate(out_dir, config=config, **kwargs)
+        r.update(speed(out_dir, pruned_names, args.use_seq_len))
+        report.append(r)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    key = 'psnr_mean' if args.part == 'ao' else 'rec_loss'
+    print('%-9s %12s %10s %10s %12s' % ('sparsity', 'params', 'ms', 'speedup', key))
+    for r in report:
+        print('%-9.2f %12d %10.2f %10.2f %12.4f' % (r['sparsity'], r['params'], r['predict_ms'],
+                                                    report[0]['predict_ms'] / max(r['predict_ms'], 1e-9),
+                                                    r['quality'][key]))
+    print('Report saved to', os.path.abspath(args.output))
+
+
+def prune(sparsity, out_dir, part, ckpt_dir, ec_load_name, a_load_name, la_load_name, da_load_name, eo_load_name,
+          do_load_name, **kwargs):
+    """Prunes the sub models of part and saves them as full models to out_dir, with copies of the sub models the
+    fine-tuning loads unchanged. Returns the number of filters kept in each pruned layer."""
+    tf.reset_default_graph()
+    K.set_session(tf.Session())
+    os.makedirs(out_dir, exist_ok=True)
+
+    if part == 'ao':
+        Ec = load_recurrent_encoder(None, h_dim=None, ckpt_dir=ckpt_dir, filename=ec_load_name)
+        Da = load_decoder(None, model_name='Da', ckpt_dir=ckpt_dir, filename=da_load_name)
+        Ec, [Da], plans = prune_encoder_decoders(Ec, [Da], sparsity)
+        pruned = {ec_load_name: Ec, da_load_name: Da}
+        copies = [a_load_name, la_load_name]
+    else:
+        # the skips of Do come from Ec, the ones of Eo are not used
+        Eo = load_encoder(None, h_dim=None, model_name='Eo', ckpt_dir=ckpt_dir, filename=eo_load_name)
+        Do = load_decoder(None, model_name='Do', ckpt_dir=ckpt_dir, filename=do_load_name)
+        plans = {'Eo': bn_gamma_plan(Eo, sparsity), 'Do': bn_gamma_plan(Do, sparsity)}
+        pruned = {eo_load_name: prune_model(Eo, plans['Eo'])[0], do_load_name: prune_model(Do, plans['Do'])[0]}
+        copies = [ec_load_name, a_load_name, la_load_name, da_load_name]
+
+    for filename, model in pruned.items():
+        tf.keras.models.save_model(model, os.path.join(out_dir, filename))
+    for filename in copies:
+        shutil.copy(os.path.join(ckpt_dir, filename), os.path.join(out_dir, filename))
+
+    K.clear_session()
+    return {name: {layer: len(kept) for layer, kept in plan.items()} for name, plan in plans.items()}
+
+
+def fine_tune(out_dir, part, dataset, dataset_dir, bs, seq_len, use_seq_len, context_frames, epochs, steps,
+              learning_rate, hc_dim, ha_dim, ho_dim, za_dim, lstm_a_units, lstm_a_layers, action_net_units,
+              ec_load_name, a_load_name, la_load_name, da_load_name, eo_load_name, do_load_name, config=None,
+              **kwargs):
+    """Continues the training of the pruned models in out_dir with the train script of part, overwriting them"""
+    tf.reset_default_graph()
+    frames, actions, states, _, train_iterator = get_data(dataset=dataset, mode='train', batch_size=bs,
+                                                          dataset_dir=dataset_dir, shuffle=True,
+                                                          sequence_length_train=seq_len, sequence_length_test=seq_len)
+    _, _, _, val_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=bs, dataset_dir=dataset_dir,
+                                                shuffle=False, sequence_length_train=seq_len,
+                                                sequence_length_test=seq_len)
+    if part == 'ao':
+        train_adr_ao(frames, actions, states, context_frames=context_frames, hc_dim=hc_dim, ha_dim=ha_dim,
+                     epochs=epochs, steps=steps, learning_rate=learning_rate, continue_training=True, gaussian=True,
+                     z_dim=za_dim, a_units=action_net_units, lstm_units=lstm_a_units, lstm_layers=lstm_a_layers,
+                     config=config, val_steps=val_steps, ckpt_dir=out_dir, ec_filename=ec_load_name,
+                     d_filename=da_load_name, a_filename=a_load_name, l_filename=la_load_name,
+                     ec_load_name=ec_load_name, d_load_name=da_load_name, a_load_name=a_load_name,
+                     l_load_name=la_load_name, train_iterator=train_iterator, val_iterator=val_iterator,
+                     use_seq_len=use_seq_len, eval_flag=False)
+    else:
+        train_adr(frames, actions, states, hc_dim=hc_dim, ha_dim=ha_dim, ho_dim=ho_dim, za_dim=za_dim,
+                  gaussian_a=True, context_frames=context_frames, epochs=epochs, steps=steps, use_seq_len=use_seq_len,
+                  learning_rate=learning_rate, action_net_units=action_net_units, val_iterator=val_iterator,
+                  val_steps=val_steps, lstm_units=lstm_a_units, lstm_layers=lstm_a_layers, ckpt_dir=out_dir,
+                  save_dir=out_dir, config=config, ec_filename=ec_load_name, a_filename=a_load_name,
+                  eo_filename=eo_load_name, do_filename=do_load_name, la_filename=la_load_name,
+                  da_filename=da_load_name, ec_load_name=ec_load_name, a_load_name=a_load_name,
+                  da_load_name=da_load_name, la_load_name=la_load_name, do_load_name=do_load_name,
+                  eo_load_name=eo_load_name, continue_training=True)
+    K.clear_session()
+
+
+def evaluate(ckpt_dir, part, dataset, dataset_dir, bs, seq_len, use_seq_len, context_frames, hc_dim, ha_dim, ho_dim,
+             za_dim, lstm_a_units, lstm_a_layers, action_net_units, ec_load_name, a_load_name, la_load_name,
+             da_load_name, eo_load_name, do_load_name, config=None, **kwargs):
+    """Per horizon MSE and PSNR of the agent reconstruction (ao), or the reconstruction losses of the object
+    part (vp), of the models in ckpt_dir on the validation split"""
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    frames, actions, states, val_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=bs,
+                                                                dataset_dir=dataset_dir, shuffle=False,
+                                                                sequence_length_train=seq_len,
+                                                                sequence_length_test=seq_len)
+    _, _, w, h, c = [int(s) for s in frames.shape]
+    a_dim, s_dim = int(actions.shape[-1]), int(states.shape[-1])
+
+    Ec = load_recurrent_encoder([bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
+                                filename=ec_load_name)
+    A = load_action_net(batch_shape=[bs, use_seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
+                        ckpt_dir=ckpt_dir, filename=a_load_name)
+    La = load_lstm(batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=za_dim, lstm_units=lstm_a_units,
+                   n_layers=lstm_a_layers, ckpt_dir=ckpt_dir, filename=la_load_name, lstm_type='gaussian', name='La')
+    Da = load_decoder(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + za_dim], model_name='Da', ckpt_dir=ckpt_dir,
+                      filename=da_load_name)
+
+    if part == 'ao':
+        model = adr_ao(frames, actions, states, context_frames, Ec=Ec, A=A, D=Da, L=La, use_seq_len=use_seq_len,
+                       learning_rate=0.0, gaussian=True, kl_weight=0.0, lstm_units=lstm_a_units,
+                       lstm_layers=lstm_a_layers, training=False, random_window=False)
+        quality = stream_evaluate(model, val_steps, pred_index=0, target_index=1, iterator=val_iterator,
+                                  metrics=['mse', 'psnr'])
+    else:
+        Eo = load_encoder(batch_shape=[bs, use_seq_len, w, h, c * 2], h_dim=ho_dim, model_name='Eo',
+                          ckpt_dir=ckpt_dir, filename=eo_load_name)
+        Do = load_decoder(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + ho_dim], model_name='Do',
+                          ckpt_dir=ckpt_dir, filename=do_load_name, output_channels=6)
+        model = adr(frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Do=Do, Da=Da, La=La, gaussian_a=True,
+                    use_seq_len=use_seq_len, lstm_units=lstm_a_units, lstm_layers=lstm_a_layers, learning_rate=0.0,
+                    random_window=False, reconstruct_random_frame=False)
+        results = model.evaluate(x=val_iterator, steps=val_steps, verbose=0)
+        quality = dict(zip(model.metrics_names, [float(r) for r in results]))
+
+    K.clear_session()
+    return quality
+
+
+def speed(ckpt_dir, filenames, use_seq_len):
+    """Parameters and predict time of the (pruned) sub models in ckpt_dir, each timed in a fresh process"""
+    result = {'params': 0, 'predict_ms': 0.0}
+    for filename in filenames:
+        r = run_isolated(benchmark_model_file, os.path.join(ckpt_dir, filename), use_seq_len=use_seq_len)
+        result['params'] += r['params']
+        result['predict_ms'] += r['predict']['median_ms']
+    return result
+
+
+if __name__ == '__main__':
+    main()
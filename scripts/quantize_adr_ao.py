@@ -0,0 +1,159 @@
+import os
+import json
+import argparse
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from utils.utils import get_data
+from models.encoder_decoder import load_encoder
+from utils.export import load_predictor_models
+from utils.runtime import runtime_config
+from utils.quantization import quantize_model
+from utils.quantization import TFLiteModel
+from utils.quantization import keras_predict_fn
+from utils.quantization import agent_latent_fn
+from utils.quantization import agent_predict
+from utils.quantization import compare_quantized
+from utils.quantization import EncoderAgreement
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Post-training int8 quantization of the encoder and decoder of the '
+                                                 'ADR-AO agent path (and optionally of the object encoder Eo) with '
+                                                 'TFLite, calibrated on validation sequences, with the per horizon '
+                                                 'PSNR/MSE change against float32')
+    parser.add_argument('--ckpt_dir', type=str, required=True)
+    parser.add_argument('--dataset', type=str, default='bair')
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--output_dir', type=str, default='quantized')
+    parser.add_argument('--bs', type=int, default=32)
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--seq_len', type=int, default=12)
+    parser.add_argument('--n_calibration', type=int, default=256, help='validation sequences used for calibration')
+    parser.add_argument('--eval_batches', type=int, default=None,
+                        help='validation batches compared after the calibration ones, default all of them')
+    parser.add_argument('--quantize_ec', action='store_true',
+                        help='also quantize the recurrent encoder, with the experimental converter')
+    parser.add_argument('--allow_float_ops', action='store_true', help='keep ops without an int8 kernel in float')
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--no_gaussian_a', action='store_true')
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    parser.add_argument('--eo_load_name', type=str, default=None,
+                        help='also quantize the object encoder Eo, compared on its latent for each frame paired with '
+                             'the agent only prediction')
+    parser.add_argument('--ho_dim', type=int, default=32)
+    args = parser.parse_args()
+
+    gaussian_a = not args.no_gaussian_a
+    sess = tf.Session(config=runtime_config())
+    K.set_session(sess)
+    K.set_learning_phase(0)
+
+    frames, actions, states, steps, _ = get_data(dataset=args.dataset, mode='val', dataset_dir=args.dataset_dir,
+                                                 batch_size=args.bs, sequence_length_test=args.seq_len,
+                                                 shuffle=False)
+    a_dim, s_dim = int(actions.shape[-1]), int(states.shape[-1])
+
+    models = load_predictor_models(args.ckpt_dir, args.bs, args.context_frames, args.seq_len, hc_dim=args.hc_dim,
+                                   ha_dim=args.ha_dim, za_dim=args.za_dim, a_dim=a_dim, s_dim=s_dim,
+                                   gaussian_a=gaussian_a, lstm_a_units=args.lstm_a_units,
+                                   lstm_a_layers=args.lstm_a_layers, action_net_units=args.action_net_units,
+                                   ec_load_name=args.ec_load_name, a_load_name=args.a_load_name,
+                                   la_load_name=args.la_load_name, da_load_name=args.da_load_name)
+    if args.eo_load_name is not None:
+        w, h, c = [int(d) for d in frames.shape[2:]]
+        models['Eo'] = load_encoder(batch_shape=[args.bs, 1, w, h, c * 2], h_dim=args.ho_dim, model_name='Eo',
+                                    ckpt_dir=args.ckpt_dir, filename=args.eo_load_name, load_model_state=False)
+    latent = agent_latent_fn(models['A'], models['La'], args.bs, args.seq_len, args.hc_dim, a_dim + s_dim,
+                             gaussian_a=gaussian_a, lstm_a_units=args.lstm_a_units, lstm_a_layers=args.lstm_a_layers)
+    float_fns = (keras_predict_fn(models['Ec']), keras_predict_fn(models['Da']))
+
+    def next_batch():
+        x, a, s = sess.run([frames, actions, states])
+        return x[:, :args.seq_len], np.concatenate([a, s], axis=-1)[:, :args.seq_len]
+
+    def object_pairs(x, action_state):
+        # the input of Eo in the rollout: each frame with the agent only prediction, [bs, seq_len, w, h, 2c]
+        x_a, _ = agent_predict(float_fns[0], latent, float_fns[1], x, action_state, args.context_frames)
+        return np.concatenate([x[:, :x_a.shape[1]], x_a], axis=-1)
+
+    # ===== calibration inputs of each model, from the float agent path
+    n_calibration_batches = int(np.ceil(args.n_calibration / float(args.bs)))
+    rng = np.random.RandomState(0)
+    ec_inputs, da_inputs, eo_inputs = [], [], []
+    for _ in range(n_calibration_batches):
+        x, action_state = next_batch()
+        _, (z, skips) = agent_predict(float_fns[0], latent, float_fns[1], x, action_state, args.context_frames)
+        ec_inputs.append([x[:, :args.context_frames]])
+        da_inputs.append([z] + skips)
+        if 'Eo' in models:
+            # one random time step per sequence
+            pairs = object_pairs(x, action_state)
+            eo_inputs.append([pairs[np.arange(len(pairs)), rng.randint(pairs.shape[1], size=len(pairs))][:, None]])
+    ec_inputs = [np.concatenate(x, axis=0)[:args.n_calibration] for x in zip(*ec_inputs)]
+    da_inputs = [np.concatenate(x, axis=0)[:args.n_calibration] for x in zip(*da_inputs)]
+    eo_inputs = [np.concatenate(x, axis=0)[:args.n_calibration] for x in zip(*eo_inputs)]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    strict = not args.allow_float_ops
+    quantized = {'Da': quantize_model(models['Da'], da_inputs, strict=strict, sess=sess)}
+    if args.quantize_ec:
+        quantized['Ec'] = quantize_model(models['Ec'], ec_inputs, strict=strict, new_converter=True, sess=sess)
+    if 'Eo' in models:
+        quantized['Eo'] = quantize_model(models['Eo'], eo_inputs, strict=strict, sess=sess)
+    for name, content in quantized.items():
+        with open(os.path.join(args.output_dir, name + '_int8.tflite'), 'wb') as f:
+            f.write(content)
+
+    quantized_fns = (TFLiteModel(quantized['Ec']).predict if 'Ec' in quantized else float_fns[0],
+                     TFLiteModel(quantized['Da']).predict)
+
+    # ===== float vs int8 on the rest of the split
+    eval_batches = steps - n_calibration_batches if args.eval_batches is None else args.eval_batches
+    eo_agreement = None
+    if 'Eo' in quantized:
+        eo_agreement = EncoderAgreement(keras_predict_fn(models['Eo']), TFLiteModel(quantized['Eo']).predict)
+
+    def eval_batch():
+        x, action_state = next_batch()
+        if eo_agreement is not None:
+            pairs = object_pairs(x, action_state)
+            for t in range(pairs.shape[1]):
+                eo_agreement.update([pairs[:, t:t + 1]])
+        return x, action_state
+
+    report = compare_quantized((eval_batch() for _ in range(eval_batches)), float_fns, quantized_fns, latent,
+                               args.context_frames)
+    if eo_agreement is not None:
+        report['Eo'] = eo_agreement.result()
+    report['quantized_models'] = sorted(quantized.keys())
+    report['model_bytes'] = {k: len(v) for k, v in quantized.items()}
+
+    f32, int8 = report['float'], report['quantized']
+    print('%-6s %10s %10s %10s %10s %10s' % ('step', 'mse f32', 'mse int8', 'psnr f32', 'psnr int8', 'delta'))
+    for t in range(len(f32['mse'])):
+        print('%-6d %10.5f %10.5f %10.2f %10.2f %10.2f' % (t, f32['mse'][t], int8['mse'][t], f32['psnr'][t],
+                                                          int8['psnr'][t], report['psnr_delta'][t]))
+    print('mean PSNR delta %.3f dB | agent path %.2f ms/seq f32, %.2f ms/seq int8'
+          % (report['psnr_delta_mean'], report['float_ms'], report['quantized_ms']))
+    if 'Eo' in report:
+        print('Eo latent relative error %.4f | %.2f ms/frame f32, %.2f ms/frame int8'
+              % (report['Eo']['relative_error'], report['Eo']['float_ms'], report['Eo']['quantized_ms']))
+    print('model size ' + ', '.join('%s %.1f KB' % (k, v / 1024.0) for k, v in sorted(report['model_bytes'].items())))
+    with open(os.path.join(args.output_dir, 'quantization_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from adr import adr_ao
+from models.lstm import load_lstm
+from models.encoder_decoder import image_encoder
+from models.encoder_decoder import load_decoder
+from models.encoder_decoder import load_recurrent_encoder
+from models.action_net import load_action_net
+from models.roi_encoder import RoiObjectEncoder
+from models.roi_encoder import active_regions
+from models.roi_encoder import roi_crop_encoder
+from models.roi_encoder import roi_compute
+from utils.utils import get_data
+from utils.evaluation import stream_evaluate
+from utils.benchmark import flops_per_frame
+from utils.benchmark import summarize_times
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measure how many of the error images between the frames and the '
+                                                 'agent only prediction of a trained ADR-AO have active regions, and '
+                                                 'the object encoder compute saved by encoding crops of those regions '
+                                                 'only (models.roi_encoder) instead of the full images')
+    parser.add_argument('--ckpt_dir', type=str, required=True, help='trained ADR-AO models')
+    parser.add_argument('--dataset', type=str, default='bair')
+    parser.add_argument('--dataset_dir', type=str, required=True)
+    parser.add_argument('--bs', type=int, default=32, help='must be the batch size the models were saved with')
+    parser.add_argument('--seq_len', type=int, default=30)
+    parser.add_argument('--use_seq_len', type=int, default=12)
+    parser.add_argument('--context_frames', type=int, default=2)
+    parser.add_argument('--val_steps', type=int, default=None, help='default the whole validation split')
+    parser.add_argument('--hc_dim', type=int, default=128)
+    parser.add_argument('--ha_dim', type=int, default=16)
+    parser.add_argument('--ho_dim', type=int, default=32)
+    parser.add_argument('--za_dim', type=int, default=10)
+    parser.add_argument('--lstm_a_units', type=int, default=256)
+    parser.add_argument('--lstm_a_layers', type=int, default=1)
+    parser.add_argument('--action_net_units', type=int, default=256)
+    parser.add_argument('--ec_load_name', type=str, default='Ec.h5')
+    parser.add_argument('--a_load_name', type=str, default='A.h5')
+    parser.add_argument('--la_load_name', type=str, default='La.h5')
+    parser.add_argument('--da_load_name', type=str, default='Da.h5')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.05, 0.1, 0.2],
+                        help='pixel thresholds on the summed error of the channels')
+    parser.add_argument('--min_pixels', type=int, default=4)
+    parser.add_argument('--margin', type=int, default=2)
+    parser.add_argument('--crop_size', type=int, default=32)
+    parser.add_argument('--size', type=int, default=64, help='width multiplier of both object encoders')
+    parser.add_argument('--timing_steps', type=int, default=20)
+    parser.add_argument('--output', type=str, default='roi_report.json')
+    args = parser.parse_args()
+
+    config = runtime_config(gpu_devices='1')
+    statistics, batch = error_statistics(config=config, **vars(args))
+
+    report = []
+    for threshold in args.thresholds:
+        r = {'threshold': threshold, **statistics[threshold]}
+        tf.reset_default_graph()
+        dense = image_encoder(batch_shape=[1, 1] + list(batch.shape[2:]), h_dim=args.ho_dim, size=args.size)
+        crop = roi_crop_encoder(batch_shape=[None, 1, args.crop_size, args.crop_size, batch.shape[-1]],
+                                h_dim=args.ho_dim, size=args.size)
+        r.update(roi_compute(crop, dense, r['active_fraction'], flops_per_frame))
+        r.update(time_encoders(batch, threshold, ho_dim=args.ho_dim, crop_size=args.crop_size, size=args.size,
+                               min_pixels=args.min_pixels, margin=args.margin, steps=args.timing_steps,
+                               config=config))
+        report.append(r)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('%-10s %8s %8s %12s %12s %8s %10s %10s' % ('threshold', 'active', 'area', 'dense MFLOP', 'roi MFLOP',
+                                                      'saved', 'dense ms', 'roi ms'))
+    for r in report:
+        print('%-10.3f %8.3f %8.3f %12.1f %12.1f %7.1f%% %10.2f %10.2f' % (
+            r['threshold'], r['active_fraction'], r['roi_area'], r['dense_flops'] / 1e6, r['roi_flops'] / 1e6,
+            r['saved'] * 100, r['dense_ms'], r['roi_ms']))
+    print('Report saved to', os.path.abspath(args.output))
+
+
+def error_statistics(ckpt_dir, dataset, dataset_dir, bs, seq_len, use_seq_len, context_frames, val_steps, hc_dim,
+                     ha_dim, za_dim, lstm_a_units, lstm_a_layers, action_net_units, ec_load_name, a_load_name,
+                     la_load_name, da_load_name, thresholds, min_pixels, margin, config=None, **kwargs):
+    """
+    Active fraction of the frames and mean area of their boxes at each threshold, over the [pos, neg] error images
+    between the validation frames and the agent only prediction of the models in ckpt_dir. Also returns the error
+    images of the last batch, to time the encoders on.
+    """
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    frames, actions, states, split_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=bs,
+                                                                  dataset_dir=dataset_dir, shuffle=False,
+                                                                  sequence_length_train=seq_len,
+                                                                  sequence_length_test=seq_len)
+    _, _, w, h, c = [int(s) for s in frames.shape]
+    a_dim, s_dim = int(actions.shape[-1]), int(states.shape[-1])
+
+    Ec = load_recurrent_encoder([bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
+                                filename=ec_load_name)
+    A = load_action_net(batch_shape=[bs, use_seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
+                        ckpt_dir=ckpt_dir, filename=a_load_name)
+    La = load_lstm(batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=za_dim, lstm_units=lstm_a_units,
+                   n_layers=lstm_a_layers, ckpt_dir=ckpt_dir, filename=la_load_name, lstm_type='gaussian', name='La')
+    Da = load_decoder(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + za_dim], model_name='Da', ckpt_dir=ckpt_dir,
+                      filename=da_load_name)
+    model = adr_ao(frames, actions, states, context_frames, Ec=Ec, A=A, D=Da, L=La, use_seq_len=use_seq_len,
+                   learning_rate=0.0, gaussian=True, kl_weight=0.0, lstm_units=lstm_a_units,
+                   lstm_layers=lstm_a_layers, training=False, random_window=False)
+
+    xo = tf.placeholder('float32', shape=[None, w, h, 2 * c])
+    ops = {}
+    for threshold in thresholds:
+        _, active, area = active_regions(xo, input_mode='error', pixel_threshold=threshold, min_pixels=min_pixels,
+                                         margin=margin)
+        ops[threshold] = (tf.reduce_sum(tf.cast(active, 'float32')), tf.reduce_sum(area))
+
+    totals = {threshold: np.zeros(2) for threshold in thresholds}
+    counts, last = [0], {}
+
+    def accumulate(step, outs):
+        x_rec_a, x = outs[0], outs[1]
+        errors = np.concatenate([np.maximum(x - x_rec_a, 0.0), np.maximum(x_rec_a - x, 0.0)], axis=-1)
+        for threshold, (n_active, area) in ops.items():
+            totals[threshold] += sess.run([n_active, area], feed_dict={xo: errors.reshape([-1, w, h, 2 * c])})
+        counts[0] += errors.shape[0] * errors.shape[1]
+        last['errors'] = errors
+
+    stream_evaluate(model, val_steps or split_steps, pred_index=0, target_index=1, iterator=val_iterator,
+                    batch_callback=accumulate, metrics=['mse'])
+    K.clear_session()
+
+    statistics = {threshold: {'active_fraction': float(totals[threshold][0] / counts[0]),
+                              'roi_area': float(totals[threshold][1] / counts[0]), 'frames': counts[0]}
+                  for threshold in thresholds}
+    return statistics, last['errors']
+
+
+def time_encoders(errors, threshold, ho_dim=32, crop_size=32, size=64, min_pixels=4, margin=2, steps=20, warmup=3,
+                  config=None):
+    """Median time of the dense image_encoder and of the RoiObjectEncoder on the same batch of error images"""
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    bs, seq_len, w, h, c = errors.shape
+    xo = tf.placeholder('float32', shape=[bs, seq_len, w, h, c])
+    dense = image_encoder(batch_shape=[bs, seq_len, w, h, c], h_dim=ho_dim, size=size, name='Eo')
+    roi = RoiObjectEncoder(roi_crop_encoder(batch_shape=[None, 1, crop_size, crop_size, c], h_dim=ho_dim, size=size,
+                                            name='Eo_roi'),
+                           pixel_threshold=threshold, min_pixels=min_pixels, margin=margin)
+    outputs = {'dense_ms': dense(xo)[0], 'roi_ms': roi(xo, input_mode='error')[0]}
+    sess.run(tf.global_variables_initializer())
+
+    result = {}
+    for key, output in outputs.items():
+        times = []
+        for _ in range(warmup + steps):
+            start = time.perf_counter()
+            sess.run(output, feed_dict={xo: errors, K.learning_phase(): 0})
+            times.append(time.perf_counter() - start)
+        result[key] = summarize_times(times, warmup)['median_ms']
+
+    K.clear_session()
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import argparse
+import tensorflow as tf
+from utils.export import Predictor
+from utils.serving import DynamicBatcher
+from utils.serving import make_server
+from utils.runtime import runtime_config
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Serve an exported ADR predictor over HTTP (or a unix socket), '
+                                                 'batching concurrent requests. POST /<signature> with a JSON or npz '
+                                                 '(Content-Type: application/x-npz) body holding context_frames, '
+                                                 'actions and states; GET /stats for queue depth and latencies')
+    parser.add_argument('--export_dir', type=str, required=True, help='written by scripts.export_saved_model')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--unix_socket', type=str, default=None, help='serve on this socket path instead of a port')
+    parser.add_argument('--signature', type=str, default='rollout', choices=['predict_agent', 'rollout'])
+    parser.add_argument('--max_batch_size', type=int, default=None,
+                        help='at most the batch size of the export, which is the default')
+    parser.add_argument('--timeout_ms', type=float, default=5.0,
+                        help='longest wait of the first request of a batch for others to join')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    predictor = Predictor(args.export_dir, config=runtime_config())
+    assert args.signature in predictor.signatures, 'the export has no %s signature' % args.signature
+    max_batch_size = args.max_batch_size or predictor.batch_size
+    assert max_batch_size <= predictor.batch_size, 'the export takes at most %d sequences' % predictor.batch_size
+
+    batcher = DynamicBatcher(getattr(predictor, args.signature), max_batch_size, timeout_ms=args.timeout_ms,
+                             input_shapes=predictor.input_shapes(args.signature))
+    server = make_server(batcher, host=args.host, port=args.port, unix_socket=args.unix_socket,
+                         signature=args.signature, verbose=args.verbose)
+
+    address = args.unix_socket or 'http://%s:%d' % (args.host, args.port)
+    print('Serving %s of %s on %s (batches of up to %d)' % (args.signature, os.path.abspath(args.export_dir),
+                                                            address, max_batch_size))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        predictor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import os
+import argparse
 import tensorflow as tf
 from models.encoder_decoder import image_encoder
 from models.encoder_decoder import image_decoder
@@ -7,14 +8,21 @@ from models.encoder_decoder import load_encoder
 from models.encoder_decoder import load_decoder
 from models.encoder_decoder import load_recurrent_encoder
 from models.resnet18 import resnet18
+from models.roi_encoder import RoiObjectEncoder
+from models.roi_encoder import roi_crop_encoder
+from models.roi_encoder import load_roi_encoder
 from models.action_net import load_action_net, load_recurrent_action_net
 from models.lstm import load_lstm
+from models.precision import build_with_precision
 from utils.clr import CyclicLR
 from utils.utils import get_data, ModelCheckpoint, NeptuneCallback
+from utils.metrics_sink import MetricsSink, MetricsCallback, JsonlBackend
+from utils.training_state import TrainingState
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
 from adr import adr
 import tensorflow.python.keras.backend as K
 
-import neptune
 tf.logging.set_verbosity(tf.logging.ERROR)
 
 best_loss = 9999
@@ -26,19 +34,25 @@ best_val_epoch = 0
 
 def main():
 
+    parser = argparse.ArgumentParser(description='Train the ADR object part on BAIR')
+    parser.add_argument('--slot', type=int, default=None, help='pin to the slot-th of n_slots groups of cores')
+    parser.add_argument('--n_slots', type=int, default=None)
+    args = parser.parse_args()
+
     bs = 32
     seq_len = 30
     shuffle = True
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
 
+    config = runtime_config(gpu_devices='1', slot=args.slot, n_slots=args.n_slots)
+
     frames, actions, states, steps, _ = get_data(dataset='bair', mode='train', batch_size=bs, shuffle=shuffle,
-                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len)
+                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len,
+                                                 private_threadpool_size=data_threads())
 
     _, _, _, val_steps, val_iterator = get_data(dataset='bair', mode='val', batch_size=bs, shuffle=False,
-                                                dataset_dir=dataset_dir, sequence_length_test=seq_len)
-
-    gpu_options = tf.GPUOptions(visible_device_list='1')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+                                                dataset_dir=dataset_dir, sequence_length_test=seq_len,
+                                                private_threadpool_size=data_threads())
 
     hist = train_adr(frames,
                      actions,
@@ -86,7 +100,10 @@ def main():
                      reconstruct_random_frame=False,
                      neptune_log=True,
                      neptune_ckpt=False,
-                     save_model=True)
+                     save_model=True,
+                     save_state=True,
+                     resume=True,
+                     state_period=10)
 
 
 def train_adr(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussian_a=False, context_frames=2, epochs=1,
@@ -97,7 +114,14 @@ def train_adr(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussi
               do_filename='D_o.h5', la_filename='La_o.h5', da_filename='Da_o.h5', ec_load_name='Ec_a.h5',
               a_load_name='A_a.h5', da_load_name='D_a.h5', la_load_name='La.h5', continue_training=False,
               do_load_name='D_o.h5', eo_load_name='Eo.h5', random_window=True, keep_all=False,
-              reconstruct_random_frame=False, save_model=True):
+              reconstruct_random_frame=False, save_model=True, save_state=False, resume=False, state_period=1,
+              local_log=True, roi_crop_size=None, roi_threshold=0.1, precision='float32', loss_scale=None):
+    """
+    - precision, loss_scale: compute precision of the sub models and static loss scale, see models.precision
+    - roi_crop_size: when given, Eo is a RoiObjectEncoder that encodes roi_crop_size crops around the pixels whose
+                     error with the agent only prediction is above roi_threshold, and skips the frames without any.
+                     eo_filename / eo_load_name then hold its crop encoder (see models.roi_encoder)
+    """
 
     if not os.path.isdir(ckpt_dir):
         os.makedirs(ckpt_dir, exist_ok=True)
@@ -114,34 +138,51 @@ def train_adr(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussi
     K.set_session(sess)
 
     # == Instance and load the models
-    Ec = load_recurrent_encoder([bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
-                                filename=ec_load_name, trainable=False, load_model_state=True)
-    Da = load_decoder(batch_shape=[bs, seq_len, hc_dim + ha_dim + za_dim], model_name='Da', ckpt_dir=ckpt_dir,
-                      output_channels=3, filename=da_load_name, output_activation='sigmoid', trainable=False,
-                      load_model_state=True)
-
+    Ec = build_with_precision(load_recurrent_encoder, precision=precision, batch_shape=[bs, context_frames, w, h, c],
+                              h_dim=hc_dim, ckpt_dir=ckpt_dir, filename=ec_load_name, trainable=False,
+                              load_model_state=True)
+    Da = build_with_precision(load_decoder, precision=precision, batch_shape=[bs, seq_len, hc_dim + ha_dim + za_dim],
+                              model_name='Da', ckpt_dir=ckpt_dir, output_channels=3, filename=da_load_name,
+                              output_activation='sigmoid', trainable=False, load_model_state=True)
+
+    roi_shape = [None, 1, roi_crop_size, roi_crop_size, 2 * c]
     if continue_training:
-        Eo = load_encoder(batch_shape=[bs, seq_len, w, h, 2 * c], h_dim=ho_dim, model_name='Eo', ckpt_dir=ckpt_dir,
-                          filename=eo_load_name, trainable=True, load_model_state=True)
-        Do = load_decoder(batch_shape=[bs, seq_len, hc_dim + ha_dim + ho_dim], model_name='Do', ckpt_dir=ckpt_dir,
-                          output_channels=6, filename=do_load_name, output_activation='sigmoid', trainable=True,
-                          load_model_state=True)
+        if roi_crop_size:
+            Eo = build_with_precision(load_roi_encoder, precision=precision, batch_shape=roi_shape, h_dim=ho_dim,
+                                      model_name='Eo', ckpt_dir=ckpt_dir, filename=eo_load_name, trainable=True,
+                                      load_model_state=True)
+        else:
+            Eo = build_with_precision(load_encoder, precision=precision, batch_shape=[bs, seq_len, w, h, 2 * c],
+                                      h_dim=ho_dim, model_name='Eo', ckpt_dir=ckpt_dir, filename=eo_load_name,
+                                      trainable=True, load_model_state=True)
+        Do = build_with_precision(load_decoder, precision=precision,
+                                  batch_shape=[bs, seq_len, hc_dim + ha_dim + ho_dim], model_name='Do',
+                                  ckpt_dir=ckpt_dir, output_channels=6, filename=do_load_name,
+                                  output_activation='sigmoid', trainable=True, load_model_state=True)
     else:
-        Do = image_decoder(batch_shape=[bs, seq_len, hc_dim+ho_dim+ha_dim], output_activation='sigmoid',
-                           output_channels=6, name='D_o', reg_lambda=reg_lambda, output_initializer='glorot_uniform',
-                           output_regularizer=output_regularizer)
-        Eo = image_encoder(batch_shape=[bs, seq_len, w, h, c*2], h_dim=ho_dim, name='Eo', reg_lambda=reg_lambda)
+        Do = build_with_precision(image_decoder, precision=precision, batch_shape=[bs, seq_len, hc_dim+ho_dim+ha_dim],
+                                  output_activation='sigmoid', output_channels=6, name='D_o', reg_lambda=reg_lambda,
+                                  output_initializer='glorot_uniform', output_regularizer=output_regularizer)
+        if roi_crop_size:
+            Eo = build_with_precision(roi_crop_encoder, precision=precision, batch_shape=roi_shape, h_dim=ho_dim,
+                                      name='Eo', reg_lambda=reg_lambda)
+        else:
+            Eo = build_with_precision(image_encoder, precision=precision, batch_shape=[bs, seq_len, w, h, c*2],
+                                      h_dim=ho_dim, name='Eo', reg_lambda=reg_lambda)
         # Eo = resnet18(batch_shape=[bs, seq_len, w, h, 2 * c], h_dim=ho_dim, name='Eo')
 
     if gaussian_a:
-        A = load_action_net(batch_shape=[bs, seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
-                            ckpt_dir=ckpt_dir, filename=a_load_name, trainable=False, load_model_state=True)
-        La = load_lstm(batch_shape=[bs, seq_len, hc_dim + ha_dim], h_dim=za_dim,
-                       lstm_units=lstm_units, n_layers=lstm_layers, ckpt_dir=ckpt_dir, filename=la_load_name,
-                       lstm_type='gaussian', trainable=False, load_model_state=False)  # --> !!!
+        A = build_with_precision(load_action_net, precision=precision, batch_shape=[bs, seq_len, a_dim + s_dim],
+                                 units=action_net_units, h_dim=ha_dim, ckpt_dir=ckpt_dir, filename=a_load_name,
+                                 trainable=False, load_model_state=True)
+        La = build_with_precision(load_lstm, precision=precision, batch_shape=[bs, seq_len, hc_dim + ha_dim],
+                                  h_dim=za_dim, lstm_units=lstm_units, n_layers=lstm_layers, ckpt_dir=ckpt_dir,
+                                  filename=la_load_name, lstm_type='gaussian', trainable=False,
+                                  load_model_state=False)  # --> !!!
     else:
-        A = load_recurrent_action_net([bs, seq_len, a_dim + s_dim], action_net_units, ha_dim, ckpt_dir=ckpt_dir,
-                                      filename=a_load_name, trainable=False, load_model_state=True)
+        A = build_with_precision(load_recurrent_action_net, precision=precision,
+                                 batch_shape=[bs, seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
+                                 ckpt_dir=ckpt_dir, filename=a_load_name, trainable=False, load_model_state=True)
 
     ckpt_models = [Ec, Eo, Da, Do, A]
     filenames = [ec_filename, eo_filename, da_filename, do_filename, a_filename]
@@ -149,12 +190,20 @@ def train_adr(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussi
         ckpt_models.append(La)
         filenames.append(la_filename)
 
+    if roi_crop_size:
+        Eo = RoiObjectEncoder(Eo, pixel_threshold=roi_threshold)
+
     adr_model = adr(frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Da=Da, Do=Do, La=La,
                     use_seq_len=use_seq_len, gaussian_a=gaussian_a, lstm_units=lstm_units, learning_rate=learning_rate,
-                    random_window=random_window, reconstruct_random_frame=reconstruct_random_frame)
+                    random_window=random_window, reconstruct_random_frame=reconstruct_random_frame,
+                    precision=precision, loss_scale=loss_scale)
 
+    metrics_path = os.path.join(ckpt_dir, 'metrics.jsonl') if local_log else None
     if neptune_log or neptune_ckpt:
-        clbks.append(NeptuneCallback(user='m-serra', project_name='adr', log=neptune_log, ckpt=neptune_ckpt))
+        clbks.append(NeptuneCallback(user='m-serra', project_name='adr', log=neptune_log, ckpt=neptune_ckpt,
+                                     local_path=metrics_path))
+    elif local_log:
+        clbks.append(MetricsCallback(MetricsSink(JsonlBackend(metrics_path))))
 
     if save_model:
         clbks.append(ModelCheckpoint(models=ckpt_models, criteria=ckpt_criteria, ckpt_dir=save_dir, filenames=filenames,
@@ -162,9 +211,18 @@ def train_adr(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussi
     if clr_flag:
         clbks.append(CyclicLR(adr_model, base_lr, max_lr, step_size=half_cycle * steps))
 
+    initial_epoch = 0
+    if save_state or resume:
+        # fit is fed from the tensors passed as frames, so there is no iterator state to keep
+        state = TrainingState(adr_model, save_dir, callbacks=clbks, period=state_period)
+        initial_epoch = state.restore() if resume else 0
+        if save_state:
+            clbks.append(state)
+
     adr_model.fit(x=None,
                   batch_size=bs,
                   epochs=epochs,
+                  initial_epoch=initial_epoch,
                   steps_per_epoch=steps,
                   callbacks=clbks,
                   validation_data=val_iterator,
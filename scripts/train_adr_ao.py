@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 import os
-import neptune
+import argparse
 import tensorflow as tf
 from adr import adr_ao
 from adr import get_sub_model
@@ -9,7 +9,13 @@ from utils.utils import get_data
 from utils.utils import ModelCheckpoint
 from utils.utils import SaveGifsCallback
 from utils.utils import NeptuneCallback
+from utils.metrics_sink import MetricsSink
+from utils.metrics_sink import MetricsCallback
+from utils.metrics_sink import JsonlBackend
 from utils.utils import EvaluateCallback
+from utils.training_state import TrainingState
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
 from tensorflow.python.keras.regularizers import l2
 import tensorflow.python.keras.backend as K
 
@@ -24,6 +30,11 @@ best_val_epoch = 0
 
 def main():
 
+    parser = argparse.ArgumentParser(description='Train ADR-AO on BAIR')
+    parser.add_argument('--slot', type=int, default=None, help='pin to the slot-th of n_slots groups of cores')
+    parser.add_argument('--n_slots', type=int, default=None)
+    args = parser.parse_args()
+
     bs = 32
     use_seq_len = 12
     seq_len = 30
@@ -31,17 +42,18 @@ def main():
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
     # dataset_dir = '/media/data/mserra/bair/softmotion30_44k/'
 
+    config = runtime_config(gpu_devices='1', slot=args.slot, n_slots=args.n_slots)
+
     frames, actions, states, steps, train_iterator = get_data(dataset='bair', mode='train', batch_size=bs,
                                                               shuffle=shuffle, dataset_dir=dataset_dir,
                                                               sequence_length_train=seq_len,
-                                                              sequence_length_test=use_seq_len)
+                                                              sequence_length_test=use_seq_len,
+                                                              private_threadpool_size=data_threads())
 
     _, _, _, val_steps, val_iterator = get_data(dataset='bair', mode='val', batch_size=bs, shuffle=False,
                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len,
-                                                sequence_length_test=use_seq_len)
-
-    gpu_options = tf.GPUOptions(visible_device_list='1')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+                                                sequence_length_test=use_seq_len,
+                                                private_threadpool_size=data_threads())
 
     hist = train_adr_ao(frames,
                         actions=actions,
@@ -86,7 +98,11 @@ def main():
                         random_window=True,
                         save_model=True,
                         reconstruct_random_frame=False,
-                        keep_all=True)  # --> !!!!!
+                        keep_all=True,  # --> !!!!!
+                        save_state=True,
+                        resume=True,
+                        state_period=10,
+                        eval_flag=False)  # evaluation runs in scripts/evaluation_worker.py
 
     return hist
 
@@ -98,7 +114,9 @@ def train_adr_ao(frames, actions, states=None, context_frames=2, hc_dim=128, ha_
                  ckpt_criteria='val_rec', ec_filename='Ec_a.h5', d_filename='D_a.h5', a_filename='A_a.h5',
                  l_filename='L_a.h5', ec_load_name='Ec_a.h5', d_load_name='D_a.h5', a_load_name='A_a.h5',
                  l_load_name='L_a.h5', neptune_ckpt=False, neptune_log=False, train_iterator=None, val_iterator=None,
-                 reconstruct_random_frame=False, random_window=True, keep_all=False, use_seq_len=12, save_model=True):
+                 reconstruct_random_frame=False, random_window=True, keep_all=False, use_seq_len=12, save_model=True,
+                 save_state=False, resume=False, state_period=1, eval_flag=True, local_log=True, precision='float32',
+                 loss_scale=None, save_iterator=False):
 
     if not os.path.isdir(ckpt_dir):
         os.makedirs(ckpt_dir, exist_ok=True)
@@ -121,21 +139,23 @@ def train_adr_ao(frames, actions, states=None, context_frames=2, hc_dim=128, ha_
     # Remove the regularization parameters that are not used anymore
     Ec = get_sub_model(name='Ec', batch_shape=[bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
                        filename=ec_load_name, trainable=True, load_model_state=continue_training,
-                       load_flag=continue_training, conv_lambda=reg_lambda, recurrent_lambda=recurrent_lambda)
+                       load_flag=continue_training, conv_lambda=reg_lambda, recurrent_lambda=recurrent_lambda,
+                       precision=precision)
 
     D = get_sub_model(name='Da', batch_shape=[bs, use_seq_len, hc_dim + ha_dim + z_dim], h_dim=None, ckpt_dir=ckpt_dir,
                       filename=d_load_name, trainable=True, load_model_state=continue_training,
-                      load_flag=continue_training, reg_lambda=reg_lambda, output_regularizer=output_regularizer)
+                      load_flag=continue_training, reg_lambda=reg_lambda, output_regularizer=output_regularizer,
+                      precision=precision)
 
     A = get_sub_model(name=a_name, batch_shape=[bs, use_seq_len, a_dim + s_dim], h_dim=ha_dim, ckpt_dir=ckpt_dir,
                       filename=a_load_name, trainable=True, load_model_state=continue_training,
                       load_flag=continue_training, units=a_units, dense_lambda=reg_lambda,
-                      recurrent_lambda=recurrent_lambda)
+                      recurrent_lambda=recurrent_lambda, precision=precision)
 
     L = get_sub_model(name='La', batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=z_dim, ckpt_dir=ckpt_dir,
                       filename=l_load_name, trainable=True, load_model_state=continue_training,
                       load_flag=continue_training, units=lstm_units, n_layers=lstm_layers, lstm_type='gaussian',
-                      reparameterize=True, reg_lambda=recurrent_lambda)
+                      reparameterize=True, reg_lambda=recurrent_lambda, precision=precision)
 
     ckpt_models = [Ec, D, A]
     filenames = [ec_filename, d_filename, a_filename]
@@ -160,7 +180,9 @@ def train_adr_ao(frames, actions, states=None, context_frames=2, hc_dim=128, ha_
                 lstm_layers=lstm_layers,
                 training=True,
                 random_window=random_window,
-                reconstruct_random_frame=reconstruct_random_frame)
+                reconstruct_random_frame=reconstruct_random_frame,
+                precision=precision,
+                loss_scale=loss_scale)
 
     # print(len(ED._collected_trainable_weights))
     # print(len(E._collected_trainable_weights))
@@ -170,18 +192,29 @@ def train_adr_ao(frames, actions, states=None, context_frames=2, hc_dim=128, ha_
     if save_model:
         clbks.append(ModelCheckpoint(models=ckpt_models, criteria=ckpt_criteria, ckpt_dir=ckpt_dir, filenames=filenames,
                                      neptune_ckpt=neptune_ckpt, keep_all=keep_all))
+    metrics_path = os.path.join(ckpt_dir, 'metrics.jsonl') if local_log else None
     if neptune_log or neptune_ckpt:
-        clbks.append(NeptuneCallback(user='m-serra', project_name='video-prediction', log=neptune_log, ckpt=neptune_ckpt))
+        clbks.append(NeptuneCallback(user='m-serra', project_name='video-prediction', log=neptune_log, ckpt=neptune_ckpt,
+                                     local_path=metrics_path))
+    elif local_log:
+        clbks.append(MetricsCallback(MetricsSink(JsonlBackend(metrics_path))))
     if save_gifs_flag:
         clbks.append(SaveGifsCallback(period=25, iterator=val_iterator,
                                       ckpt_dir=os.path.join(os.path.expanduser('~/'), 'adr/gifs'), name='pred2', bs=bs))
     if clr_flag:
         clbks.append(CyclicLR(ED, base_lr, max_lr, step_size=half_cycle * steps))
 
-    eval_flag = True
     if eval_flag:
         clbks.append(EvaluateCallback(model=ED, iterator=val_iterator, steps=val_steps, period=25))
 
+    initial_epoch = 0
+    if save_state or resume:
+        state = TrainingState(ED, ckpt_dir, iterator=train_iterator, callbacks=clbks, period=state_period,
+                              save_iterator=save_iterator)
+        initial_epoch = state.restore() if resume else 0
+        if save_state:
+            clbks.append(state)
+
     # def KLD(_mu, _logvar):
     #     return -0.5 * np.mean(1 + _logvar - np.power(_mu, 2) - np.exp(_logvar), axis=0, keepdims=True)
     #
@@ -195,6 +228,7 @@ def train_adr_ao(frames, actions, states=None, context_frames=2, hc_dim=128, ha_
     ED.fit(x=train_iterator,
            batch_size=bs,
            epochs=epochs,
+           initial_epoch=initial_epoch,
            steps_per_epoch=steps,
            callbacks=clbks,
            validation_data=val_iterator,
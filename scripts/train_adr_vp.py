@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 import os
-import neptune
+import argparse
 import tensorflow as tf
 from models.encoder_decoder import image_encoder
 from models.encoder_decoder import image_decoder
@@ -9,11 +9,18 @@ from models.encoder_decoder import load_recurrent_encoder
 from models.action_net import load_action_net
 from models.action_net import load_recurrent_action_net
 from models.lstm import simple_lstm, load_lstm
+from models.precision import build_with_precision
 from utils.clr import CyclicLR
 from utils.utils import get_data
 from utils.utils import ModelCheckpoint
 from utils.utils import NeptuneCallback
+from utils.metrics_sink import MetricsSink
+from utils.metrics_sink import MetricsCallback
+from utils.metrics_sink import JsonlBackend
 from utils.utils import EvaluateCallback
+from utils.training_state import TrainingState
+from utils.runtime import runtime_config
+from utils.runtime import data_threads
 from adr import adr_vp_teacher_forcing
 import tensorflow.python.keras.backend as K
 
@@ -28,23 +35,29 @@ best_val_epoch = 0
 
 def main():
 
+    parser = argparse.ArgumentParser(description='Train the ADR video prediction part on BAIR')
+    parser.add_argument('--slot', type=int, default=None, help='pin to the slot-th of n_slots groups of cores')
+    parser.add_argument('--n_slots', type=int, default=None)
+    args = parser.parse_args()
+
     bs = 32
     seq_len = 30
     use_seq_len = 12
     shuffle = True
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
 
+    config = runtime_config(gpu_devices='1', slot=args.slot, n_slots=args.n_slots)
+
     frames, actions, states, steps, train_iterator = get_data(dataset='bair', mode='train', batch_size=bs,
                                                               shuffle=shuffle, dataset_dir=dataset_dir,
                                                               sequence_length_train=seq_len,
-                                                              sequence_length_test=seq_len, initializable=False)
+                                                              sequence_length_test=seq_len, initializable=False,
+                                                              private_threadpool_size=data_threads())
 
     _, _, _, val_steps, val_iterator = get_data(dataset='bair', mode='val', batch_size=bs, shuffle=False,
                                                 dataset_dir=dataset_dir, sequence_length_train=seq_len,
-                                                sequence_length_test=seq_len, initializable=False)
-
-    gpu_options = tf.GPUOptions(visible_device_list='1')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+                                                sequence_length_test=seq_len, initializable=False,
+                                                private_threadpool_size=data_threads())
 
     train_adr_vp(frames,
                  actions,
@@ -88,8 +101,12 @@ def main():
                  keep_all=False,
                  neptune_log=True,
                  neptune_ckpt=False,
-                 save_model=False,   # --> !!!!!!!!!!!!!!
-                 train_eo_do=True)
+                 save_model=True,  # the checkpoints are evaluated by scripts/evaluation_worker.py
+                 train_eo_do=True,
+                 save_state=True,
+                 resume=True,
+                 state_period=10,
+                 eval_flag=False)  # evaluation runs in scripts/evaluation_worker.py
 
 
 def train_adr_vp(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gaussian_a=False, context_frames=2,
@@ -99,7 +116,13 @@ def train_adr_vp(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gau
                  save_dir='.', reg_lambda=0.0, ckpt_dir='.', ckpt_criteria='val_rec', config=None,
                  eo_filename='Eo.h5', do_filename='D_o.h5', l_filename='L.h5', ec_load_name='Ec_a.h5',
                  a_load_name='A_a.h5', da_load_name='D_a.h5', la_load_name='La.h5', random_window=True, keep_all=False,
-                 neptune_log=False, neptune_ckpt=False, save_model=True, train_eo_do=False):
+                 neptune_log=False, neptune_ckpt=False, save_model=True, train_eo_do=False, save_state=False,
+                 resume=False, state_period=1, eval_flag=True, local_log=True, precision='float32', loss_scale=None,
+                 save_iterator=False):
+    """
+    - precision, loss_scale: compute precision of the sub models and static loss scale, see models.precision
+    - save_iterator: also save the position (and shuffle buffer) of train_iterator with the training state
+    """
 
     if not os.path.isdir(ckpt_dir):
         os.makedirs(ckpt_dir, exist_ok=True)
@@ -116,35 +139,41 @@ def train_adr_vp(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gau
     K.set_session(sess)
 
     # == Instance and load the models
-    Ec = load_recurrent_encoder([bs, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
-                                filename=ec_load_name, trainable=False, load_model_state=False)
-    Da = load_decoder(batch_shape=[bs, use_seq_len, hc_dim+ha_dim+za_dim], model_name='Da', ckpt_dir=ckpt_dir,
-                      output_channels=3, filename=da_load_name, output_activation='sigmoid', trainable=False,
-                      load_model_state=False)
-
-    Do = image_decoder(batch_shape=[bs, use_seq_len, hc_dim+ho_dim+ha_dim], output_activation='sigmoid',
-                       output_channels=6, name='D_o', reg_lambda=reg_lambda, output_initializer='glorot_uniform',
-                       output_regularizer=output_regularizer)
+    Ec = build_with_precision(load_recurrent_encoder, precision=precision, batch_shape=[bs, context_frames, w, h, c],
+                              h_dim=hc_dim, ckpt_dir=ckpt_dir, filename=ec_load_name, trainable=False,
+                              load_model_state=False)
+    Da = build_with_precision(load_decoder, precision=precision, batch_shape=[bs, use_seq_len, hc_dim+ha_dim+za_dim],
+                              model_name='Da', ckpt_dir=ckpt_dir, output_channels=3, filename=da_load_name,
+                              output_activation='sigmoid', trainable=False, load_model_state=False)
+
+    Do = build_with_precision(image_decoder, precision=precision, batch_shape=[bs, use_seq_len, hc_dim+ho_dim+ha_dim],
+                              output_activation='sigmoid', output_channels=6, name='D_o', reg_lambda=reg_lambda,
+                              output_initializer='glorot_uniform', output_regularizer=output_regularizer)
     # Do = load_decoder(batch_shape=[bs, seq_len, hc_dim + ha_dim + ho_dim], model_name='Do', ckpt_dir=ckpt_dir,
     #                   output_channels=6, filename=do_load_name, output_activation='sigmoid', trainable=train_eo_do,
     #                   load_model_state=False)
 
-    Eo = image_encoder(batch_shape=[bs, use_seq_len, w, h, c*2], h_dim=ho_dim, name='Eo', reg_lambda=reg_lambda)
+    Eo = build_with_precision(image_encoder, precision=precision, batch_shape=[bs, use_seq_len, w, h, c*2],
+                              h_dim=ho_dim, name='Eo', reg_lambda=reg_lambda)
     # Eo = load_encoder(batch_shape=[bs, seq_len, w, h, c * 2], h_dim=ho_dim, model_name='Eo', ckpt_dir=ckpt_dir,
     #                   filename=eo_load_name, trainable=train_eo_do, load_model_state=False)
 
-    L = simple_lstm(batch_shape=[bs, use_seq_len, hc_dim + ha_dim*2 + ho_dim], h_dim=ho_dim, n_layers=lstm_layers,
-                    units=lstm_units)
+    L = build_with_precision(simple_lstm, precision=precision,
+                             batch_shape=[bs, use_seq_len, hc_dim + ha_dim*2 + ho_dim], h_dim=ho_dim,
+                             n_layers=lstm_layers, units=lstm_units)
 
     if gaussian_a:
-        A = load_action_net(batch_shape=[bs, use_seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
-                            ckpt_dir=ckpt_dir, filename=a_load_name, trainable=False, load_model_state=False)
-        La = load_lstm(batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=za_dim, lstm_units=lstm_a_units,
-                       n_layers=lstm_a_layers, ckpt_dir=ckpt_dir, filename=la_load_name, lstm_type='gaussian',
-                       trainable=False, load_model_state=False)
+        A = build_with_precision(load_action_net, precision=precision, batch_shape=[bs, use_seq_len, a_dim + s_dim],
+                                 units=action_net_units, h_dim=ha_dim, ckpt_dir=ckpt_dir, filename=a_load_name,
+                                 trainable=False, load_model_state=False)
+        La = build_with_precision(load_lstm, precision=precision, batch_shape=[bs, use_seq_len, hc_dim + ha_dim],
+                                  h_dim=za_dim, lstm_units=lstm_a_units, n_layers=lstm_a_layers, ckpt_dir=ckpt_dir,
+                                  filename=la_load_name, lstm_type='gaussian', trainable=False,
+                                  load_model_state=False)
     else:
-        A = load_recurrent_action_net([bs, use_seq_len, a_dim + s_dim], action_net_units, ha_dim, ckpt_dir=ckpt_dir,
-                                      filename=a_load_name, trainable=False, load_model_state=True)
+        A = build_with_precision(load_recurrent_action_net, precision=precision,
+                                 batch_shape=[bs, use_seq_len, a_dim + s_dim], units=action_net_units, h_dim=ha_dim,
+                                 ckpt_dir=ckpt_dir, filename=a_load_name, trainable=False, load_model_state=True)
 
     ckpt_models = [L]
     filenames = [l_filename]
@@ -157,22 +186,35 @@ def train_adr_vp(frames, actions, states, hc_dim, ha_dim, ho_dim, za_dim=10, gau
     model = adr_vp_teacher_forcing(frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Do=Do, Da=Da, L=L, La=La,
                                    gaussian_a=gaussian_a, use_seq_len=use_seq_len, lstm_a_units=lstm_a_units,
                                    lstm_a_layers=lstm_a_layers, lstm_units=lstm_units, lstm_layers=lstm_layers,
-                                   learning_rate=learning_rate, random_window=random_window)
+                                   learning_rate=learning_rate, random_window=random_window, precision=precision,
+                                   loss_scale=loss_scale)
 
     if save_model:
         clbks.append(ModelCheckpoint(models=ckpt_models, criteria=ckpt_criteria, ckpt_dir=save_dir, filenames=filenames,
                                      neptune_ckpt=neptune_ckpt, keep_all=keep_all))   # --> remove neptune flag
+    metrics_path = os.path.join(ckpt_dir, 'metrics.jsonl') if local_log else None
     if neptune_log or neptune_ckpt:
-        clbks.append(NeptuneCallback(user='m-serra', project_name='adrvp', log=neptune_log, ckpt=neptune_ckpt))
+        clbks.append(NeptuneCallback(user='m-serra', project_name='adrvp', log=neptune_log, ckpt=neptune_ckpt,
+                                     local_path=metrics_path))
+    elif local_log:
+        clbks.append(MetricsCallback(MetricsSink(JsonlBackend(metrics_path))))
     if clr_flag:
         clbks.append(CyclicLR(model, base_lr, max_lr, step_size=half_cycle*steps))
-    eval_flag = True
     if eval_flag:
         clbks.append(EvaluateCallback(model=model, iterator=val_iterator, steps=val_steps, period=25))
 
+    initial_epoch = 0
+    if save_state or resume:
+        state = TrainingState(model, save_dir, iterator=train_iterator, callbacks=clbks, period=state_period,
+                              save_iterator=save_iterator)
+        initial_epoch = state.restore() if resume else 0
+        if save_state:
+            clbks.append(state)
+
     model.fit(x=train_iterator,
               batch_size=bs,
               epochs=epochs,
+              initial_epoch=initial_epoch,
               steps_per_epoch=steps,
               callbacks=clbks,
               validation_data=val_iterator,
@@ -4,6 +4,7 @@ from tensorflow.keras.optimizers import Adam
 from keras.losses import mean_absolute_error
 from adr import action_inference_model
 from utils.utils import get_data
+from utils.runtime import runtime_config
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
 import tensorflow.python.keras.backend as K
 
@@ -19,8 +20,7 @@ def main():
     dataset_dir = '/media/Data/datasets/bair/softmotion30_44k/'
     save_path = os.path.join(os.path.expanduser('~/'), 'adr/trained_models/bair/')
 
-    gpu_options = tf.GPUOptions(visible_device_list='1')
-    config = tf.ConfigProto(gpu_options=gpu_options)
+    config = runtime_config(gpu_devices='1')
 
     frames, _, states, steps, train_iterator = get_data(dataset='bair', mode='train', batch_size=bs,
                                                         shuffle=shuffle, dataset_dir=dataset_dir,
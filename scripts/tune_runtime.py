@@ -0,0 +1,38 @@
+import argparse
+import tensorflow as tf
+from utils.benchmark import VARIANTS
+from utils.runtime import TUNING_FILE
+from utils.runtime import machine_type
+from utils.runtime import tune_runtime
+
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Sweep the TF thread pool sizes against the train step of a graph '
+                                                 'on synthetic data and record the fastest setting for this machine '
+                                                 'type, where runtime_config picks it up')
+    parser.add_argument('--variant', type=str, default='adr_ao', choices=VARIANTS)
+    parser.add_argument('--bs', type=int, default=16)
+    parser.add_argument('--seq_len', type=int, default=30, help='frames per synthetic sequence, the window is the '
+                                                                 'first min(seq_len - 1, 12)')
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--intra', nargs='*', type=int, default=None, help='intra op thread counts to try')
+    parser.add_argument('--inter', nargs='*', type=int, default=[1, 2], help='inter op thread counts to try')
+    parser.add_argument('--tuning_file', type=str, default=TUNING_FILE)
+    args = parser.parse_args()
+
+    candidates = None
+    if args.intra:
+        candidates = [{'intra_op_threads': i, 'inter_op_threads': j} for i in args.intra for j in args.inter]
+
+    best, _ = tune_runtime(args.variant, batch_size=args.bs, seq_len=args.seq_len, steps=args.steps,
+                           warmup=args.warmup, candidates=candidates, tuning_file=args.tuning_file)
+    print('Best for %s: intra %d, inter %d (%.2f ms/step), saved to %s' %
+          (machine_type(), best['intra_op_threads'], best['inter_op_threads'], best['step_ms'], args.tuning_file))
+
+
+if __name__ == '__main__':
+    main()
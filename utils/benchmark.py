@@ -0,0 +1,417 @@
+import time
+import platform
+import functools
+import resource
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from adr import adr_ao
+from adr import adr
+from adr import adr_vp_teacher_forcing
+from adr import adr_vp_feedback_frames
+from models.encoder_decoder import image_encoder
+from models.encoder_decoder import image_decoder
+from models.encoder_decoder import recurrent_image_encoder
+from models.light_encoder_decoder import image_encoder_light
+from models.light_encoder_decoder import image_decoder_light
+from models.light_encoder_decoder import recurrent_image_encoder_light
+from models.action_net import action_net
+from models.action_net import recurrent_action_net
+from models.lstm import lstm_gaussian
+from models.lstm import simple_lstm
+from models.bn_folding import CUSTOM_OBJECTS
+from tensorflow.python.keras.layers import Input
+from tensorflow.python.keras.layers import Conv2D
+from tensorflow.python.keras.layers import Conv2DTranspose
+from tensorflow.python.keras.layers import SeparableConv2D
+from tensorflow.python.keras.layers import Dense
+from tensorflow.python.keras.layers import TimeDistributed
+from tensorflow.python.keras.layers.convolutional_recurrent import ConvRNN2D
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.models import load_model
+from tensorflow.python.keras.optimizers import Adam
+from tensorflow.python.util import nest
+
+VARIANTS = ['adr_ao', 'adr', 'adr_vp_teacher_forcing', 'adr_vp_feedback_frames']
+SUB_MODELS = ['recurrent_image_encoder', 'image_encoder', 'image_decoder', 'action_net', 'recurrent_action_net',
+              'lstm_gaussian', 'simple_lstm', 'recurrent_image_encoder_light', 'image_encoder_light',
+              'image_decoder_light']
+# (recurrent encoder, encoder, decoder) builders of each encoder/decoder family
+FAMILIES = {'dense': (recurrent_image_encoder, image_encoder, image_decoder),
+            'light': (recurrent_image_encoder_light, image_encoder_light, image_decoder_light),
+            'light_lstm': (functools.partial(recurrent_image_encoder_light, cell='lstm'), image_encoder_light,
+                           image_decoder_light)}
+
+
+def synthetic_data(batch_size=32, seq_len=30, a_dim=4, s_dim=3, w=64, h=64, c=3, seed=0):
+    """
+    Drop-in replacement for get_data that serves one random batch forever. Returns the same
+    (frames, actions, states, steps, iterator) tuple so graphs can be built and timed without the dataset.
+    """
+    rng = np.random.RandomState(seed)
+    batch = {'images': rng.uniform(size=[batch_size, seq_len, w, h, c]).astype('float32'),
+             'actions': rng.uniform(-1, 1, size=[batch_size, seq_len, a_dim]).astype('float32'),
+             'states': rng.uniform(-1, 1, size=[batch_size, seq_len, s_dim]).astype('float32')}
+
+    iterator = tf.data.Dataset.from_tensors(batch).repeat().make_one_shot_iterator()
+    input_get_next_op = iterator.get_next()
+
+    return input_get_next_op['images'], input_get_next_op['actions'], input_get_next_op['states'], 1, iterator
+
+
+def build_graph(variant, frames, actions, states, context_frames=2, use_seq_len=12, hc_dim=128, ha_dim=16, ho_dim=32,
+                za_dim=10, a_units=256, lstm_units=256, lstm_layers=2, lstm_a_layers=1, size=64, learning_rate=1e-4,
+                xla=False, family='dense'):
+    """
+    Instances the sub models with the shapes used by the corresponding train_*/evaluate_* script and builds the
+    full graph. Sub models that are loaded frozen in the scripts are frozen here as well, so the train step
+    updates the same set of weights.
+    - family: builders of the encoders and decoders, one of FAMILIES
+    """
+    assert variant in VARIANTS, 'variant must be one of ' + ', '.join(VARIANTS)
+    assert family in FAMILIES, 'family must be one of ' + ', '.join(FAMILIES)
+    recurrent_encoder_fn, encoder_fn, decoder_fn = FAMILIES[family]
+
+    bs, seq_len, w, h, c = [int(s) for s in frames.shape]
+    a_dim = int(actions.shape[-1]) if actions is not None else 0
+    s_dim = int(states.shape[-1]) if states is not None else 0
+    vp_len = 1 if variant == 'adr_vp_feedback_frames' else use_seq_len
+
+    Ec = recurrent_encoder_fn(batch_shape=[bs, context_frames, w, h, c], h_dim=hc_dim, size=size, name='Ec')
+    Da = decoder_fn(batch_shape=[bs, use_seq_len, hc_dim + ha_dim + za_dim], size=size, skips_size=size, name='Da')
+    A = action_net(batch_shape=[bs, use_seq_len, a_dim + s_dim], units=a_units, h_dim=ha_dim, name='A')
+    La = lstm_gaussian(batch_shape=[bs, use_seq_len, hc_dim + ha_dim], h_dim=za_dim, n_layers=lstm_a_layers,
+                       units=lstm_units, reparameterize=True, name='La')
+
+    if variant == 'adr_ao':
+        return adr_ao(frames, actions, states, context_frames, Ec=Ec, A=A, D=Da, L=La, use_seq_len=use_seq_len,
+                      learning_rate=learning_rate, gaussian=True, kl_weight=5e-7, lstm_units=lstm_units,
+                      lstm_layers=lstm_a_layers, training=True, random_window=True, reconstruct_random_frame=False,
+                      xla=xla)
+
+    for m in [Ec, Da, A, La]:
+        m.trainable = False
+
+    Eo = encoder_fn(batch_shape=[bs, vp_len, w, h, c * 2], h_dim=ho_dim, size=size, name='Eo')
+    Do = decoder_fn(batch_shape=[bs, vp_len, hc_dim + ha_dim + ho_dim], output_channels=6, size=size,
+                    skips_size=size, name='D_o')
+
+    if variant == 'adr':
+        return adr(frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Do=Do, Da=Da, La=La, gaussian_a=True,
+                   use_seq_len=use_seq_len, lstm_units=lstm_units, lstm_layers=lstm_a_layers,
+                   learning_rate=learning_rate, random_window=True, reconstruct_random_frame=False, xla=xla)
+
+    L = simple_lstm(batch_shape=[bs, vp_len, hc_dim + ha_dim * 2 + ho_dim], h_dim=ho_dim, n_layers=lstm_layers,
+                    units=lstm_units, name='L')
+
+    builder = adr_vp_teacher_forcing if variant == 'adr_vp_teacher_forcing' else adr_vp_feedback_frames
+    return builder(frames, actions, states, context_frames, Ec=Ec, Eo=Eo, A=A, Do=Do, Da=Da, L=L, La=La,
+                   gaussian_a=True, use_seq_len=use_seq_len, lstm_a_units=lstm_units, lstm_a_layers=lstm_a_layers,
+                   lstm_units=lstm_units, lstm_layers=lstm_layers, learning_rate=learning_rate, random_window=False,
+                   xla=xla)
+
+
+class StepTimer(tf.keras.callbacks.Callback):
+
+    def __init__(self):
+        super(StepTimer, self).__init__()
+        self.train_times = []
+        self.predict_times = []
+        self._start = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.train_times.append(time.perf_counter() - self._start)
+
+    def on_predict_batch_begin(self, batch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_predict_batch_end(self, batch, logs=None):
+        self.predict_times.append(time.perf_counter() - self._start)
+
+
+def summarize_times(times, warmup=0):
+    times = np.asarray(times[warmup:]) * 1000.0
+    return {'mean_ms': float(np.mean(times)), 'median_ms': float(np.median(times)), 'min_ms': float(np.min(times)),
+            'max_ms': float(np.max(times)), 'steps': int(len(times))}
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def time_model(model, iterator, steps=20, warmup=3, train=True, predict=True):
+    timer = StepTimer()
+    result = {'rss_build_mb': peak_rss_mb()}
+
+    if train:
+        model.fit(x=iterator, epochs=1, steps_per_epoch=warmup + steps, callbacks=[timer], verbose=0)
+        result['train'] = summarize_times(timer.train_times, warmup)
+        result['train_peak_rss_mb'] = peak_rss_mb()
+    if predict:
+        model.predict(x=iterator, steps=warmup + steps, callbacks=[timer])
+        result['predict'] = summarize_times(timer.predict_times, warmup)
+        result['predict_peak_rss_mb'] = peak_rss_mb()
+
+    return result
+
+
+def benchmark_graph(variant, batch_size=32, seq_len=30, steps=20, warmup=3, train=True, predict=True, config=None,
+                    **kwargs):
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    frames, actions, states, _, iterator = synthetic_data(batch_size=batch_size, seq_len=seq_len)
+    model = build_graph(variant, frames, actions, states, **kwargs)
+
+    result = time_model(model, iterator, steps=steps, warmup=warmup, train=train, predict=predict)
+    result.update({'kind': 'graph', 'name': variant, 'variant': variant, 'batch_size': batch_size,
+                   'seq_len': seq_len})
+    result.update(kwargs)
+
+    K.clear_session()
+    return result
+
+
+def run_isolated(fn, *args, **kwargs):
+    """
+    Runs fn in a fresh spawned process, so that peak RSS and TF global state are not shared between measurements
+    """
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(fn, args, kwargs)
+
+
+def build_sub_model(name, batch_size=32, use_seq_len=12, size=64, h_dim=128, w=64, h=64, c=3, a_dim=7, units=256,
+                    lstm_layers=2):
+    """Instances one sub model with the same arguments as the graphs use it"""
+    assert name in SUB_MODELS, 'name must be one of ' + ', '.join(SUB_MODELS)
+    seq_shape = [batch_size, use_seq_len]
+
+    if name == 'recurrent_image_encoder':
+        return recurrent_image_encoder(batch_shape=seq_shape + [w, h, c], h_dim=h_dim, size=size, name='Ec')
+    if name == 'image_encoder':
+        return image_encoder(batch_shape=seq_shape + [w, h, c * 2], h_dim=h_dim, size=size, name='Eo')
+    if name == 'image_decoder':
+        return image_decoder(batch_shape=seq_shape + [h_dim], size=size, skips_size=size, name='Da')
+    if name == 'recurrent_image_encoder_light':
+        return recurrent_image_encoder_light(batch_shape=seq_shape + [w, h, c], h_dim=h_dim, size=size, name='Ec')
+    if name == 'image_encoder_light':
+        return image_encoder_light(batch_shape=seq_shape + [w, h, c * 2], h_dim=h_dim, size=size, name='Eo')
+    if name == 'image_decoder_light':
+        return image_decoder_light(batch_shape=seq_shape + [h_dim], size=size, skips_size=size, name='Da')
+    if name == 'action_net':
+        return action_net(batch_shape=seq_shape + [a_dim], units=units, h_dim=h_dim, name='A')
+    if name == 'recurrent_action_net':
+        return recurrent_action_net(batch_shape=seq_shape + [a_dim], units=units, h_dim=h_dim, name='rA')
+    if name == 'lstm_gaussian':
+        return lstm_gaussian(batch_shape=seq_shape + [h_dim], h_dim=10, n_layers=lstm_layers, units=units,
+                             reparameterize=True, name='La')
+    return simple_lstm(batch_shape=seq_shape + [h_dim], h_dim=h_dim, n_layers=lstm_layers, units=units, name='L')
+
+
+def flops_per_frame(model):
+    """
+    Multiply-add FLOPs (2 per multiply-add) of the convolutions, recurrent convolutions and dense layers of model
+    (and of the models nested in it) for one frame of one sample, from the kernel shapes and the spatial size of
+    the outputs the layers were built with. Batch norms, activations and the other elementwise ops are not counted.
+    """
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, Model):
+            flops += flops_per_frame(layer)
+            continue
+        inner = layer.layer if isinstance(layer, TimeDistributed) else layer
+        out_shape, in_shape = layer.get_output_shape_at(0), layer.get_input_shape_at(0)
+
+        if isinstance(inner, SeparableConv2D):
+            kh, kw, cin, mult = K.int_shape(inner.depthwise_kernel)
+            cout = K.int_shape(inner.pointwise_kernel)[-1]
+            flops += 2 * out_shape[-3] * out_shape[-2] * (kh * kw * cin * mult + cin * mult * cout)
+        elif isinstance(inner, Conv2DTranspose):
+            # every input pixel is scattered through the whole kernel
+            kh, kw, cout, cin = K.int_shape(inner.kernel)
+            flops += 2 * in_shape[-3] * in_shape[-2] * kh * kw * cin * cout
+        elif isinstance(inner, Conv2D):
+            kh, kw, cin, cout = K.int_shape(inner.kernel)
+            flops += 2 * out_shape[-3] * out_shape[-2] * kh * kw * cin * cout
+        elif isinstance(inner, ConvRNN2D):
+            out_shape = out_shape[0] if isinstance(out_shape, list) else out_shape
+            kernels = [inner.cell.kernel, inner.cell.recurrent_kernel]
+            flops += 2 * out_shape[-3] * out_shape[-2] * int(sum(np.prod(K.int_shape(k)) for k in kernels))
+        elif isinstance(inner, Dense):
+            flops += 2 * int(np.prod(K.int_shape(inner.kernel)))
+    return int(flops)
+
+
+def trainable_wrapper(sub_model, use_seq_len=12, seed=0):
+    """
+    Wraps a sub model in a compiled model whose loss is the mean square of all its outputs, so that fit runs a full
+    forward and backward pass through it. Returns the model and an iterator that serves one random batch forever,
+    with one entry per sub model input. Unknown time dimensions are set to use_seq_len.
+    """
+    rng = np.random.RandomState(seed)
+    ins, batch = [], {}
+    for i, x in enumerate(sub_model.inputs):
+        shape = [use_seq_len if d is None else d for d in K.int_shape(x)]
+        ins.append(Input(batch_shape=shape, name='in_%d' % i))
+        batch['in_%d' % i] = rng.uniform(size=shape).astype('float32')
+
+    outs = nest.flatten(sub_model(ins))
+    model = Model(inputs=ins, outputs=outs)
+    model.add_loss(sum(K.mean(K.square(o)) for o in outs))
+    model.compile(optimizer=Adam(lr=1e-4))
+
+    iterator = tf.data.Dataset.from_tensors(batch).repeat().make_one_shot_iterator()
+    return model, iterator
+
+
+def benchmark_sub_model(name, batch_size=32, use_seq_len=12, size=64, h_dim=128, steps=20, warmup=3, train=True,
+                        predict=True, config=None):
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    sub_model = build_sub_model(name, batch_size=batch_size, use_seq_len=use_seq_len, size=size, h_dim=h_dim)
+    model, iterator = trainable_wrapper(sub_model, use_seq_len=use_seq_len)
+
+    result = time_model(model, iterator, steps=steps, warmup=warmup, train=train, predict=predict)
+    result.update({'kind': 'sub_model', 'name': name, 'batch_size': batch_size, 'use_seq_len': use_seq_len,
+                   'size': size, 'h_dim': h_dim, 'params': int(sub_model.count_params())})
+
+    K.clear_session()
+    return result
+
+
+def benchmark_model_file(path, use_seq_len=12, steps=20, warmup=3, train=False, predict=True, config=None):
+    """Same as benchmark_sub_model for a sub model saved as a full model, e.g. a pruned one whose layers do not
+    follow the size multipliers of build_sub_model"""
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    sub_model = load_model(path, custom_objects=CUSTOM_OBJECTS)
+    model, iterator = trainable_wrapper(sub_model, use_seq_len=use_seq_len)
+
+    result = time_model(model, iterator, steps=steps, warmup=warmup, train=train, predict=predict)
+    result.update({'kind': 'model_file', 'name': sub_model.name, 'path': path, 'use_seq_len': use_seq_len,
+                   'params': int(sub_model.count_params())})
+
+    K.clear_session()
+    return result
+
+
+def benchmark_family(family, size=64, dataset='bair', dataset_dir=None, batch_size=32, seq_len=30, use_seq_len=12,
+                     hc_dim=128, steps=500, val_steps=50, warmup=3, learning_rate=1e-3, config=None):
+    """
+    Trains adr_ao with the encoder/decoder family for steps and returns the train and predict step times with the
+    reconstruction loss reached on the validation split. Without a dataset_dir the graph is trained and evaluated
+    on one synthetic batch, which only gives the step times a meaning.
+    """
+    from utils.utils import get_data
+
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+    K.set_session(sess)
+
+    if dataset_dir is None:
+        frames, actions, states, _, iterator = synthetic_data(batch_size=batch_size, seq_len=seq_len)
+        val_iterator = iterator
+    else:
+        frames, actions, states, _, iterator = get_data(dataset=dataset, mode='train', batch_size=batch_size,
+                                                        dataset_dir=dataset_dir, shuffle=True,
+                                                        sequence_length_train=seq_len, sequence_length_test=seq_len)
+        _, _, _, val_split_steps, val_iterator = get_data(dataset=dataset, mode='val', batch_size=batch_size,
+                                                          dataset_dir=dataset_dir, shuffle=False,
+                                                          sequence_length_train=seq_len,
+                                                          sequence_length_test=seq_len)
+        val_steps = min(val_steps, val_split_steps)
+
+    model = build_graph('adr_ao', frames, actions, states, use_seq_len=use_seq_len, hc_dim=hc_dim, size=size,
+                        learning_rate=learning_rate, family=family)
+    params = int(sum(model.get_layer(name).count_params() for name in ['Ec', 'Da']))
+
+    result = time_model(model, iterator, steps=steps - warmup, warmup=warmup, train=True, predict=True)
+    losses = model.evaluate(x=val_iterator, steps=val_steps, verbose=0)
+    result.update({'kind': 'family', 'name': family, 'batch_size': batch_size, 'use_seq_len': use_seq_len,
+                   'size': size, 'hc_dim': hc_dim, 'params': params, 'synthetic': dataset_dir is None,
+                   'val': dict(zip(model.metrics_names, [float(l) for l in losses]))})
+
+    K.clear_session()
+    return result
+
+
+def benchmark_reader(dataset, dataset_dir, batch_size=32, seq_len=30, steps=50, warmup=5, mode='train',
+                     config=None):
+    """
+    Measures how many records per second the tf.data pipeline of a data reader delivers to the host, without any
+    model. The reader is used directly rather than through get_data, so any dataset_dir laid out like the original
+    one works (e.g. a small synthetic copy).
+    """
+    from data_readers.bair_data_reader import BairDataReader
+    from data_readers.google_push_data_reader import GooglePushDataReader
+
+    tf.reset_default_graph()
+    sess = tf.Session(config=config)
+
+    if dataset == 'bair':
+        d = BairDataReader(dataset_dir=dataset_dir, batch_size=batch_size, use_state=1, shuffle=True, batch_repeat=1,
+                           sequence_length_train=seq_len, sequence_length_test=seq_len)
+    else:
+        d = GooglePushDataReader(dataset_dir=dataset_dir, batch_size=batch_size, shuffle=True, batch_repeat=1,
+                                 sequence_length_train=seq_len, sequence_length_test=seq_len,
+                                 train_dir_name='push_train', test_dir_name='push_train')
+
+    next_op = d.build_tf_iterator(mode=mode).get_next()
+    times = []
+    for _ in range(warmup + steps):
+        start = time.perf_counter()
+        sess.run(next_op)
+        times.append(time.perf_counter() - start)
+    sess.close()
+
+    result = {'kind': 'reader', 'name': dataset, 'batch_size': batch_size, 'seq_len': seq_len,
+              'batch': summarize_times(times, warmup),
+              'records_per_sec': float(batch_size * steps / np.sum(times[warmup:])),
+              'peak_rss_mb': peak_rss_mb()}
+    return result
+
+
+def machine_info():
+    return {'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': multiprocessing.cpu_count(), 'tensorflow': tf.__version__,
+            'gpu': tf.test.is_gpu_available(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def result_key(r):
+    return (r.get('kind'), r.get('name'), r.get('batch_size'), r.get('use_seq_len', r.get('seq_len')), r.get('size'),
+            r.get('h_dim', r.get('hc_dim')))
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compares two lists of benchmark results matched by result_key. A step time above (1 + tolerance) times the
+    baseline, or a reader throughput below (1 - tolerance) times the baseline, is a regression.
+    Returns a list of (key, metric, baseline value, current value, relative change, regression).
+    """
+    base = {result_key(r): r for r in baseline}
+    rows = []
+    for r in results:
+        b = base.get(result_key(r))
+        if b is None:
+            continue
+        for metric in ['train', 'predict', 'batch']:
+            if metric in r and metric in b:
+                old, new = b[metric]['median_ms'], r[metric]['median_ms']
+                change = new / old - 1.0
+                rows.append((result_key(r), metric + '_median_ms', old, new, change, change > tolerance))
+        if 'records_per_sec' in r and 'records_per_sec' in b:
+            old, new = b['records_per_sec'], r['records_per_sec']
+            change = new / old - 1.0
+            rows.append((result_key(r), 'records_per_sec', old, new, change, change < -tolerance))
+    return rows
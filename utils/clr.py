@@ -1,6 +1,6 @@
-from keras.callbacks import *
+from collections import deque
 import tensorflow as tf
-from termcolor import colored
+from tensorflow.python.keras.callbacks import Callback
 import tensorflow.python.keras.backend as K
 
 
@@ -20,6 +20,13 @@ class CyclicLR(Callback):
         cycle iteration.
     For more detail, please see paper.
 
+    The learning rate is computed inside the graph from the optimizer's
+    iterations counter, so no session round-trips are needed per batch and
+    a restored global step restores the position in the cycle. If the
+    model's train function was already built (e.g. a model reused after a
+    first fit), it is discarded so that the next fit rebuilds it with the
+    scheduled learning rate.
+
     # Example
         ```python
             clr = CyclicLR(base_lr=0.001, max_lr=0.006,
@@ -29,7 +36,7 @@ class CyclicLR(Callback):
 
     Class also supports custom scaling functions:
         ```python
-            clr_fn = lambda x: 0.5*(1+np.sin(x*np.pi/2.))
+            clr_fn = lambda x: 0.5*(1+tf.sin(x*np.pi/2.))
             clr = CyclicLR(base_lr=0.001, max_lr=0.006,
                                 step_size=2000., scale_fn=clr_fn,
                                 scale_mode='cycle')
@@ -56,15 +63,21 @@ class CyclicLR(Callback):
         scale_fn: Custom scaling policy defined by a single
             argument lambda function, where
             0 <= scale_fn(x) <= 1 for all x >= 0.
-            mode paramater is ignored
+            mode paramater is ignored. x is a float tensor,
+            so the function must use TF ops (e.g. tf.sin instead
+            of np.sin).
         scale_mode: {'cycle', 'iterations'}.
             Defines whether scale_fn is evaluated on
             cycle number or cycle iterations (training
             iterations since start of cycle). Default is 'cycle'.
+        history_period: the learning rate and batch logs are
+            recorded in self.history every history_period batches.
+        history_size: maximum number of records kept per key in
+            self.history, older records are discarded.
     """
 
     def __init__(self, model, base_lr=0.001, max_lr=0.006, step_size=2000., mode='triangular',
-                 gamma=1., scale_fn=None, scale_mode='cycle'):
+                 gamma=1., scale_fn=None, scale_mode='cycle', history_period=100, history_size=1000):
         super(CyclicLR, self).__init__()
 
         self.base_lr = base_lr
@@ -73,6 +86,8 @@ class CyclicLR(Callback):
         self.mode = mode
         self.gamma = gamma
         self.model = model
+        self.history_period = history_period
+        self.history_size = history_size
         if scale_fn == None:
             if self.mode == 'triangular':
                 self.scale_fn = lambda x: 1.
@@ -89,11 +104,20 @@ class CyclicLR(Callback):
         else:
             self.scale_fn = scale_fn
             self.scale_mode = scale_mode
-        self.clr_iterations = 0.
-        self.trn_iterations = 0.
+        self.n_batches = 0
         self.history = {}
 
-        self._reset()
+        # boundaries are variables so that _reset can change them without rebuilding the graph
+        self.base_lr_var = K.variable(base_lr, name='clr_base_lr')
+        self.max_lr_var = K.variable(max_lr, name='clr_max_lr')
+        self.step_size_var = K.variable(step_size, name='clr_step_size')
+        self.clr_offset = K.variable(0., name='clr_offset')  # global step at which the current cycle started
+        self.clr_iterations = K.cast(self.model.optimizer.iterations, 'float32') - self.clr_offset
+        self.lr = self.clr()
+        self.model.optimizer.lr = self.lr
+        if getattr(self.model, 'train_function', None) is not None:
+            # built with the previous learning rate
+            self.model.train_function = None
 
     def _reset(self, new_base_lr=None, new_max_lr=None, new_step_size=None):
         """Resets cycle iterations.
@@ -101,39 +125,45 @@ class CyclicLR(Callback):
         """
         if new_base_lr != None:
             self.base_lr = new_base_lr
+            K.set_value(self.base_lr_var, new_base_lr)
         if new_max_lr != None:
             self.max_lr = new_max_lr
+            K.set_value(self.max_lr_var, new_max_lr)
         if new_step_size != None:
             self.step_size = new_step_size
-        self.clr_iterations = 0.
+            K.set_value(self.step_size_var, new_step_size)
+        K.set_value(self.clr_offset, K.get_value(self.model.optimizer.iterations))
 
     def clr(self):
-        cycle = np.floor(1 + self.clr_iterations / (2 * self.step_size))
-        x = np.abs(self.clr_iterations / self.step_size - 2 * cycle + 1)
+        cycle = tf.floor(1 + self.clr_iterations / (2 * self.step_size_var))
+        x = K.abs(self.clr_iterations / self.step_size_var - 2 * cycle + 1)
         if self.scale_mode == 'cycle':
-            return self.base_lr + (self.max_lr - self.base_lr) * np.maximum(0, (1 - x)) * self.scale_fn(cycle)
+            scale = self.scale_fn(cycle)
         else:
-            return self.base_lr + (self.max_lr - self.base_lr) * np.maximum(0, (1 - x)) * self.scale_fn(
-                self.clr_iterations)
-
-    def on_train_begin(self, logs={}):
-        logs = logs or {}
-
-        if self.clr_iterations == 0:
-            K.set_value(self.model.optimizer.lr, K.get_value(self.base_lr))
-        else:
-            K.set_value(self.model.optimizer.lr, K.get_value(self.clr()))
+            scale = self.scale_fn(self.clr_iterations)
+        return self.base_lr_var + (self.max_lr_var - self.base_lr_var) * K.maximum(0., (1 - x)) * scale
 
     def on_batch_end(self, epoch, logs=None):
 
         logs = logs or {}
-        self.trn_iterations += 1
-        self.clr_iterations += 1
+        self.n_batches += 1
+        if self.history_period is None or self.n_batches % self.history_period != 0:
+            return
 
-        self.history.setdefault('lr', []).append(K.get_value(self.model.optimizer.lr))
-        self.history.setdefault('iterations', []).append(self.trn_iterations)
+        # a single session run every history_period batches
+        lr, iterations = K.batch_get_value([self.lr, self.model.optimizer.iterations])
+        self.history.setdefault('lr', deque(maxlen=self.history_size)).append(lr)
+        self.history.setdefault('iterations', deque(maxlen=self.history_size)).append(iterations)
 
         for k, v in logs.items():
-            self.history.setdefault(k, []).append(v)
-        lr = K.get_value(self.clr())
-        K.set_value(self.model.optimizer.lr, lr)
\ No newline at end of file
+            self.history.setdefault(k, deque(maxlen=self.history_size)).append(v)
+
+    def get_state(self):
+        # the position in the cycle follows from the global step, which is saved with the optimizer
+        return {'clr_offset': float(K.get_value(self.clr_offset)), 'base_lr': float(self.base_lr),
+                'max_lr': float(self.max_lr), 'step_size': float(self.step_size)}
+
+    def set_state(self, state):
+        self.base_lr, self.max_lr, self.step_size = state['base_lr'], state['max_lr'], state['step_size']
+        K.batch_set_value([(self.base_lr_var, self.base_lr), (self.max_lr_var, self.max_lr),
+                           (self.step_size_var, self.step_size), (self.clr_offset, state['clr_offset'])])
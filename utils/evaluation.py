@@ -0,0 +1,119 @@
+import numpy as np
+import tensorflow.python.keras.backend as K
+
+METRICS = ['mse', 'psnr', 'ssim']
+
+
+def mse_per_step(pred, target):
+    """pred, target: [batch_size, seq_len, h, w, c]. Returns [batch_size, seq_len]"""
+    return np.mean(np.square(pred - target), axis=(2, 3, 4))
+
+
+def psnr_per_step(pred, target, max_val=1.0):
+    mse = np.maximum(mse_per_step(pred, target), 1e-10)
+    return 10.0 * np.log10(max_val ** 2 / mse)
+
+
+def _gaussian_kernel(size=11, sigma=1.5):
+    x = np.arange(size, dtype='float32') - (size - 1) / 2.0
+    k = np.exp(-x ** 2 / (2 * sigma ** 2))
+    return k / np.sum(k)
+
+
+def _filter(x, kernel):
+    """Separable 'valid' filtering over the h and w axes of a [batch_size, seq_len, h, w, c] array"""
+    n = len(kernel)
+    h, w = x.shape[2], x.shape[3]
+    y = sum(kernel[i] * x[:, :, i:h - n + 1 + i] for i in range(n))
+    return sum(kernel[i] * y[:, :, :, i:w - n + 1 + i] for i in range(n))
+
+
+def ssim_per_step(pred, target, max_val=1.0, filter_size=11, sigma=1.5, k1=0.01, k2=0.03):
+    """Gaussian window SSIM (Wang et al. 2004, same constants as tf.image.ssim), averaged over pixels and channels"""
+    kernel = _gaussian_kernel(filter_size, sigma)
+    c1, c2 = (k1 * max_val) ** 2, (k2 * max_val) ** 2
+
+    mu_p, mu_t = _filter(pred, kernel), _filter(target, kernel)
+    var_p = _filter(pred * pred, kernel) - mu_p ** 2
+    var_t = _filter(target * target, kernel) - mu_t ** 2
+    cov = _filter(pred * target, kernel) - mu_p * mu_t
+
+    ssim_map = ((2 * mu_p * mu_t + c1) * (2 * cov + c2)) / ((mu_p ** 2 + mu_t ** 2 + c1) * (var_p + var_t + c2))
+    return np.mean(ssim_map, axis=(2, 3, 4))
+
+
+METRIC_FNS = {'mse': mse_per_step, 'psnr': psnr_per_step, 'ssim': ssim_per_step}
+
+
+class StreamingMetrics(object):
+
+    def __init__(self, metrics=METRICS):
+        """
+        Accumulates per time step sums of each metric, so that the memory used does not depend on the number of
+        evaluated sequences.
+        """
+        self.metrics = metrics
+        self.sums = {m: None for m in metrics}
+        self.count = 0
+
+    def update(self, pred, target):
+        pred = np.clip(pred, 0.0, 1.0).astype('float32')
+        target = target.astype('float32')
+        for m in self.metrics:
+            values = METRIC_FNS[m](pred, target)
+            self.sums[m] = values.sum(axis=0) if self.sums[m] is None else self.sums[m] + values.sum(axis=0)
+        self.count += pred.shape[0]
+
+    def result(self):
+        """
+        Returns {metric: per horizon curve (list, one value per predicted time step)} and {metric + '_mean': value}
+        """
+        result = {}
+        for m in self.metrics:
+            curve = self.sums[m] / max(self.count, 1)
+            result[m] = [float(v) for v in curve]
+            result[m + '_mean'] = float(np.mean(curve))
+        result['n_sequences'] = self.count
+        return result
+
+
+def _predict_batch(model, data=None):
+    if data is None:
+        return model.predict(x=None, steps=1)
+    # fetch one batch and feed it as numpy, so no new get_next op is added to the graph for each batch
+    return model.predict_on_batch(K.get_session().run(data))
+
+
+def stream_evaluate(model, steps, pred_index, target_index, iterator=None, spill_path=None, batch_callback=None,
+                    metrics=METRICS):
+    """
+    Runs the model one batch at a time and accumulates per time step metrics between outputs[pred_index] and
+    outputs[target_index], holding only one batch of predictions in memory.
+
+    - iterator: the tf.data iterator feeding the model, or None if the model inputs are fed by the graph
+    - spill_path: (str) optionally save all the predictions to this .npy file, through a memory map
+    - batch_callback: function called as batch_callback(step, outputs) after each batch, e.g. to save gifs
+    """
+    accumulator = StreamingMetrics(metrics)
+    data = iterator.get_next() if iterator is not None else None
+    spill = None
+
+    for i in range(steps):
+        outs = _predict_batch(model, data)
+        pred, target = outs[pred_index], outs[target_index]
+        accumulator.update(pred, target)
+
+        if spill_path is not None:
+            if spill is None:
+                spill = np.lib.format.open_memmap(spill_path, mode='w+', dtype='float32',
+                                                  shape=(steps * pred.shape[0],) + pred.shape[1:])
+            spill[i * pred.shape[0]:(i + 1) * pred.shape[0]] = pred
+
+        if batch_callback is not None:
+            batch_callback(i, outs)
+
+    if spill is not None:
+        spill.flush()
+        del spill
+
+    return accumulator.result()
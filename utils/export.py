@@ -0,0 +1,201 @@
+import os
+import json
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras.layers import RepeatVector
+from tensorflow.python.saved_model import tag_constants
+from tensorflow.python.saved_model.signature_def_utils import predict_signature_def
+from models.lstm import load_lstm
+from models.lstm import lstm_initial_state_zeros
+from models.encoder_decoder import load_encoder
+from models.encoder_decoder import load_decoder
+from models.encoder_decoder import load_recurrent_encoder
+from models.encoder_decoder import repeat_skips
+from models.encoder_decoder import slice_skips
+from models.action_net import load_action_net
+from models.bn_folding import fold_batchnorm
+from adr import feedback_frames_rollout
+
+CONFIG_FILE = 'adr_config.json'
+
+
+def to_float_frames(frames):
+    return tf.cast(frames, tf.float32) / 255.0
+
+
+def to_uint8_frames(frames):
+    return tf.cast(tf.round(tf.clip_by_value(frames, 0.0, 1.0) * 255.0), tf.uint8)
+
+
+def load_predictor_models(ckpt_dir, batch_size, context_frames, seq_len, hc_dim=128, ha_dim=16, ho_dim=32, za_dim=10,
+                          a_dim=4, s_dim=3, gaussian_a=True, lstm_units=256, lstm_a_units=256, lstm_layers=2,
+                          lstm_a_layers=1, action_net_units=256, ec_load_name='Ec.h5', a_load_name='A.h5',
+                          la_load_name='La.h5', da_load_name='Da.h5', eo_load_name=None, l_load_name=None,
+                          do_load_name=None, w=64, h=64, c=3):
+    """
+    Instances the sub models with the export batch size and loads their weights. Eo, L and Do are only loaded if
+    their filenames are given (they are not needed by the ADR-AO signatures).
+    """
+    za_dim = za_dim if gaussian_a else 0
+    models = {}
+
+    models['Ec'] = load_recurrent_encoder([batch_size, context_frames, w, h, c], h_dim=hc_dim, ckpt_dir=ckpt_dir,
+                                          filename=ec_load_name, name='Ec', load_model_state=False)
+    models['A'] = load_action_net(batch_shape=[batch_size, seq_len, a_dim + s_dim], units=action_net_units,
+                                  h_dim=ha_dim, ckpt_dir=ckpt_dir, filename=a_load_name, name='A',
+                                  load_model_state=False)
+    models['Da'] = load_decoder(batch_shape=[batch_size, seq_len, hc_dim + ha_dim + za_dim], model_name='Da',
+                                ckpt_dir=ckpt_dir, filename=da_load_name, output_channels=3, load_model_state=False)
+    models['La'] = None
+    if gaussian_a:
+        models['La'] = load_lstm(batch_shape=[batch_size, seq_len, hc_dim + ha_dim], h_dim=za_dim,
+                                 lstm_units=lstm_a_units, n_layers=lstm_a_layers, ckpt_dir=ckpt_dir,
+                                 filename=la_load_name, lstm_type='gaussian', name='La', load_model_state=False)
+
+    if eo_load_name is not None:
+        models['Eo'] = load_encoder(batch_shape=[batch_size, 1, w, h, c * 2], h_dim=ho_dim, model_name='Eo',
+                                    ckpt_dir=ckpt_dir, filename=eo_load_name, load_model_state=False)
+        models['L'] = load_lstm(batch_shape=[batch_size, 1, hc_dim + ha_dim * 2 + ho_dim], h_dim=ho_dim,
+                                n_layers=lstm_layers, lstm_units=lstm_units, ckpt_dir=ckpt_dir,
+                                filename=l_load_name, lstm_type='simple', name='L', load_model_state=False)
+        models['Do'] = load_decoder(batch_shape=[batch_size, 1, hc_dim + ha_dim + ho_dim], model_name='Do',
+                                    ckpt_dir=ckpt_dir, filename=do_load_name, output_channels=6,
+                                    load_model_state=False)
+    return models
+
+
+def build_inference_graph(models, batch_size, context_frames, seq_len, a_dim=4, s_dim=3, gaussian_a=True,
+                          lstm_units=256, lstm_a_units=256, lstm_layers=2, lstm_a_layers=1, w=64, h=64, c=3):
+    """
+    Inputs: context_frames (uint8 [bs, context_frames, w, h, c]), actions and states (float [bs, seq_len, dim]).
+    Returns ({name: input tensor}, {signature: {name: output tensor}}). The agent path takes La's mean instead of a
+    sample, as in evaluation. Must be called with the learning phase set to 0, so BatchNormalization uses its moving
+    statistics.
+    """
+    context = tf.placeholder(tf.uint8, [batch_size, context_frames, w, h, c], name='context_frames')
+    actions = tf.placeholder(tf.float32, [batch_size, seq_len, a_dim], name='actions')
+    states = tf.placeholder(tf.float32, [batch_size, seq_len, s_dim], name='states')
+    inputs = {'context_frames': context, 'actions': actions, 'states': states}
+    xc = to_float_frames(context)
+    action_state = tf.concat([actions, states], axis=-1)
+
+    # ===== encode_context
+    hc, skips = models['Ec'](xc)
+    hc = hc[:, context_frames - 1]
+    skips = slice_skips(skips, start=context_frames - 1, length=1)
+    outputs = {'encode_context': {'hc': hc}}
+    outputs['encode_context'].update({'skip_%d' % i: tf.squeeze(s, axis=1) for i, s in enumerate(skips)})
+
+    # ===== predict_agent, same as the agent path of adr_vp_feedback_frames
+    ha = models['A'](action_state)
+    hc_ha = K.concatenate([RepeatVector(seq_len)(hc), ha], axis=-1)
+    if gaussian_a:
+        initial_state_a = lstm_initial_state_zeros(units=lstm_a_units, n_layers=lstm_a_layers, batch_size=batch_size)
+        _, za, _, _ = models['La']([hc_ha, initial_state_a])
+        hc_ha = K.concatenate([hc_ha, za], axis=-1)
+    x_rec_a = models['Da']([hc_ha, repeat_skips(skips, seq_len)])
+    outputs['predict_agent'] = {'frames': to_uint8_frames(x_rec_a), 'frames_float': x_rec_a}
+
+    # ===== rollout, the feedback loop used in evaluation (adr_vp_feedback_frames) on top of the agent path above.
+    # Only the context frames of its frame input are read, the rest is fed back from its own predictions.
+    if 'Eo' in models:
+        padding = tf.zeros([batch_size, seq_len - context_frames, w, h, c])
+        frames = tf.concat([xc, padding], axis=1)
+        initial_state = lstm_initial_state_zeros(units=lstm_units, n_layers=lstm_layers, batch_size=batch_size)
+        x_pred = feedback_frames_rollout(models['Eo'], models['L'], models['Do'], frames, x_rec_a,
+                                         tf.expand_dims(hc, axis=1), ha, skips, initial_state, context_frames)
+        outputs['rollout'] = {'frames': to_uint8_frames(x_pred), 'frames_float': x_pred,
+                              'agent_frames': outputs['predict_agent']['frames']}
+
+    return inputs, outputs
+
+
+def export_predictor(export_dir, ckpt_dir, batch_size=1, context_frames=2, seq_len=12, config=None, fold_bn=True,
+                     **kwargs):
+    """
+    Writes a SavedModel with the encode_context, predict_agent and (if the Eo, L and Do filenames are given) rollout
+    signatures, plus the hyperparameters in adr_config.json. kwargs are passed to load_predictor_models.
+    With fold_bn the batch norms of the sub models are folded into the preceding kernels (see fold_batchnorm).
+    The graph has a fixed batch size; callers with fewer sequences pad the batch (see Predictor).
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        sess = tf.Session(config=config)
+        K.set_session(sess)
+        K.set_learning_phase(0)
+
+        models = load_predictor_models(ckpt_dir, batch_size, context_frames, seq_len, **kwargs)
+        if fold_bn:
+            models = {k: fold_batchnorm(m) if m is not None else None for k, m in models.items()}
+        graph_kwargs = {k: kwargs[k] for k in ['a_dim', 's_dim', 'gaussian_a', 'lstm_units', 'lstm_a_units',
+                                               'lstm_layers', 'lstm_a_layers'] if k in kwargs}
+        inputs, outputs = build_inference_graph(models, batch_size, context_frames, seq_len, **graph_kwargs)
+
+        signature_inputs = {'encode_context': {'context_frames': inputs['context_frames']},
+                            'predict_agent': inputs, 'rollout': inputs}
+        signature_def_map = {name: predict_signature_def(signature_inputs[name], outputs[name]) for name in outputs}
+
+        builder = tf.saved_model.Builder(export_dir)
+        builder.add_meta_graph_and_variables(sess, [tag_constants.SERVING], signature_def_map=signature_def_map,
+                                             strip_default_attrs=True)
+        builder.save()
+        K.clear_session()
+
+    config = dict(kwargs, batch_size=batch_size, context_frames=context_frames, seq_len=seq_len, fold_bn=fold_bn,
+                  signatures=sorted(signature_def_map.keys()))
+    with open(os.path.join(export_dir, CONFIG_FILE), 'w') as f:
+        json.dump(config, f, indent=2)
+    return export_dir
+
+
+class Predictor(object):
+
+    def __init__(self, export_dir, config=None):
+        """
+        Loads a SavedModel written by export_predictor in its own graph and session. Takes uint8 frames and float
+        actions/states as numpy arrays; batches smaller than the export batch size are padded.
+        """
+        with open(os.path.join(export_dir, CONFIG_FILE), 'r') as f:
+            self.config = json.load(f)
+        self.batch_size = self.config['batch_size']
+        self.graph = tf.Graph()
+        self.sess = tf.Session(graph=self.graph, config=config)
+        meta_graph = tf.saved_model.loader.load(self.sess, [tag_constants.SERVING], export_dir)
+
+        self.signatures = {}
+        for name, signature in meta_graph.signature_def.items():
+            self.signatures[name] = (
+                {k: self.graph.get_tensor_by_name(v.name) for k, v in signature.inputs.items()},
+                {k: self.graph.get_tensor_by_name(v.name) for k, v in signature.outputs.items()})
+
+    def input_shapes(self, signature):
+        """{input name: shape of one sequence} of a signature, None for the dimensions the export leaves open"""
+        feeds, _ = self.signatures[signature]
+        return {k: tuple(t.shape.as_list()[1:]) for k, t in feeds.items()}
+
+    def run(self, signature, **inputs):
+        """Runs a signature on n <= batch_size sequences and returns {output name: array with n rows}"""
+        feeds, fetches = self.signatures[signature]
+        n = len(next(iter(inputs.values())))
+        assert n <= self.batch_size, 'at most %d sequences per call' % self.batch_size
+
+        feed_dict = {}
+        for k, t in feeds.items():
+            x = np.asarray(inputs[k])
+            if n < self.batch_size:
+                x = np.concatenate([x, np.zeros((self.batch_size - n,) + x.shape[1:], dtype=x.dtype)], axis=0)
+            feed_dict[t] = x
+        return {k: v[:n] for k, v in self.sess.run(fetches, feed_dict=feed_dict).items()}
+
+    def encode_context(self, context_frames):
+        return self.run('encode_context', context_frames=context_frames)
+
+    def predict_agent(self, context_frames, actions, states):
+        return self.run('predict_agent', context_frames=context_frames, actions=actions, states=states)
+
+    def rollout(self, context_frames, actions, states):
+        return self.run('rollout', context_frames=context_frames, actions=actions, states=states)
+
+    def close(self):
+        self.sess.close()
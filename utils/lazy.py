@@ -0,0 +1,27 @@
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stands for a module that is only imported on first attribute access, e.g. neptune = LazyModule('neptune').
+    Keeps optional and slow to import dependencies (logging, media, dataset backends) out of the startup of the
+    scripts that do not use them.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def colored(text, color=None, on_color=None, attrs=None):
+    """termcolor.colored, or the plain text if termcolor is not installed"""
+    try:
+        from termcolor import colored as _colored
+    except ImportError:
+        return text
+    return _colored(text, color, on_color, attrs)
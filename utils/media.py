@@ -0,0 +1,97 @@
+import os
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def to_uint8(sequence):
+    """Converts a batch of [0, 1] float frames to uint8 in one vectorized pass"""
+    return (np.clip(sequence, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def make_grid(gt, pred, error_gain=1.0):
+    """
+    Places ground truth, prediction and absolute error side by side, for a whole batch at once.
+    gt, pred: [batch_size, seq_len, h, w, c] float arrays in [0, 1]. Returns [batch_size, seq_len, h, 3*w, c]
+    """
+    error = np.clip(np.abs(gt - pred) * error_gain, 0.0, 1.0)
+    return np.concatenate([gt, pred, error], axis=3)
+
+
+def encode_frames(frames, filename, fmt='gif', fps=10):
+    """Encodes a [seq_len, h, w, c] uint8 array. Runs in the worker processes, so it only imports what it needs."""
+    # the temporary file keeps the extension, imageio picks the writer from it
+    root, ext = os.path.splitext(filename)
+    tmp_filename = root + '.tmp' + ext
+
+    if fmt == 'gif':
+        import moviepy.editor as mpy
+        clip = mpy.ImageSequenceClip(list(frames), fps=fps)
+        clip.write_gif(tmp_filename, logger=None, verbose=False)
+    elif fmt == 'png':
+        from PIL import Image
+        images = [Image.fromarray(f) for f in frames]
+        images[0].save(tmp_filename, format='PNG', save_all=True, append_images=images[1:],
+                       duration=int(1000 / fps), loop=0)
+    else:
+        raise ValueError('Unknown format: ' + fmt)
+
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+class MediaWriter(object):
+
+    def __init__(self, workers=2, max_pending=64, fmt='gif', fps=10):
+        """
+        Encodes sequences of frames to animated GIF or PNG files in a pool of processes, off the training thread.
+
+        - workers: (int) number of encoding processes
+        - max_pending: (int) maximum number of files queued or being encoded. Files submitted beyond that are
+                       dropped (and counted in self.n_dropped) rather than stalling the caller.
+        - fmt: (str) 'gif' or 'png' (animated PNG)
+        """
+        assert fmt in ['gif', 'png'], 'fmt must be either gif or png'
+        self.fmt = fmt
+        self.fps = fps
+        self.max_pending = max_pending
+        # spawned rather than forked, forking a process that runs TF threads can deadlock the children
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.n_written = 0
+        self.n_dropped = 0
+        self.errors = []
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+            else:
+                self.n_written += 1
+
+    def submit(self, frames, filename):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.n_dropped += 1
+                return None
+            self.pending += 1
+        future = self.executor.submit(encode_frames, frames, filename, self.fmt, self.fps)
+        future.add_done_callback(self._done)
+        return future
+
+    def save_batch(self, sequence, name, save_dir, gt=None):
+        """
+        Same naming as save_gifs: one file per batch element, save_dir/name_batch_<b>.<fmt>.
+        If gt is given, each file shows ground truth, prediction and error side by side.
+        """
+        if gt is not None:
+            sequence = make_grid(gt, sequence)
+        frames = to_uint8(sequence)
+        return [self.submit(frames[b], os.path.join(save_dir, name + '_batch_' + str(b) + '.' + self.fmt))
+                for b in range(frames.shape[0])]
+
+    def close(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,191 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras.models import Model
+from utils.benchmark import synthetic_data
+from utils.benchmark import build_graph
+from utils.benchmark import peak_rss_mb
+
+MB = 1024.0 ** 2
+
+
+def _nbytes(shape, dtype='float32', time_steps=1):
+    """Bytes of a tensor of static shape, unknown dimensions (e.g. the time axis of the lstms) set to time_steps"""
+    return int(np.prod([time_steps if d is None else d for d in shape])) * tf.as_dtype(dtype).size
+
+
+def _n_calls(sub_model):
+    # the first node of a functional model links its own inputs and outputs, every call adds one node
+    return max(len(sub_model._inbound_nodes) - 1, 1)
+
+
+def parameter_memory(model, optimizer_slots=2):
+    """
+    Parameter memory of each sub model of a graph, plus the optimizer slots of the trainable weights (2 for Adam).
+    Returns {sub model name: {'params', 'trainable_params', 'params_mb', 'optimizer_mb'}}
+    """
+    report = {}
+    for layer in model.layers:
+        if not isinstance(layer, Model):
+            continue
+        trainable = sum(int(np.prod(K.int_shape(w))) for w in layer.trainable_weights)
+        total = sum(int(np.prod(K.int_shape(w))) for w in layer.weights)
+        report[layer.name] = {'params': total, 'trainable_params': trainable, 'params_mb': total * 4 / MB,
+                              'optimizer_mb': trainable * 4 * optimizer_slots / MB}
+    return report
+
+
+def _layer_activations(layer, time_steps, times=1, prefix=''):
+    rows = []
+    if isinstance(layer, Model):
+        for inner in layer.layers:
+            if inner.__class__.__name__ == 'InputLayer':
+                continue
+            rows += _layer_activations(inner, time_steps, times, prefix + layer.name + '/')
+        return rows
+
+    nbytes = 0
+    for node in layer._inbound_nodes:
+        for t in tf.nest.flatten(node.output_tensors):
+            nbytes += _nbytes(K.int_shape(t), t.dtype, time_steps)
+    rows.append({'layer': prefix + layer.name, 'type': layer.__class__.__name__, 'calls': times,
+                 'activation_mb': nbytes * times / MB})
+    return rows
+
+
+def activation_memory(model, time_steps=12):
+    """
+    Static estimate of the activation memory of one step: the size of the outputs of every layer, counted once per
+    call (sub models called several times, like Ec in adr_ao, are counted once per call). In training all of them
+    are kept for the backward pass, so the sum is an upper bound of what a train step holds; a predict step can free
+    most of them as it goes. Layers are listed by decreasing size.
+    """
+    rows = []
+    for layer in model.layers:
+        if layer.__class__.__name__ == 'InputLayer':
+            continue
+        if isinstance(layer, Model):
+            rows += _layer_activations(layer, time_steps, times=_n_calls(layer))
+        else:
+            rows += _layer_activations(layer, time_steps)
+    return sorted(rows, key=lambda r: -r['activation_mb'])
+
+
+def count_flops(graph=None):
+    """Float operations of all the ops with known shapes in the graph, as counted by the TF profiler"""
+    graph = graph or tf.get_default_graph()
+    opts = tf.profiler.ProfileOptionBuilder.float_operation()
+    opts['output'] = 'none'
+    return int(tf.profiler.profile(graph, options=opts).total_float_ops)
+
+
+def static_report(variant, batch_size=32, seq_len=30, **kwargs):
+    """Builds the graph of variant on synthetic data and reports parameter and activation memory and FLOPs"""
+    tf.reset_default_graph()
+    sess = tf.Session()
+    K.set_session(sess)
+
+    frames, actions, states, _, _ = synthetic_data(batch_size=batch_size, seq_len=seq_len)
+    model = build_graph(variant, frames, actions, states, **kwargs)
+    use_seq_len = kwargs.get('use_seq_len', 12)
+
+    # the graph holds the forward pass (and the loss) until the train function adds the backward pass
+    forward_flops = count_flops()
+    model._make_train_function()
+    train_flops = count_flops()
+
+    params = parameter_memory(model)
+    activations = activation_memory(model, time_steps=use_seq_len)
+    report = {'variant': variant, 'batch_size': batch_size, 'seq_len': seq_len, 'kwargs': kwargs,
+              'params': params,
+              'params_mb': sum(p['params_mb'] for p in params.values()),
+              'optimizer_mb': sum(p['optimizer_mb'] for p in params.values()),
+              'activations': activations,
+              'activation_mb': sum(a['activation_mb'] for a in activations),
+              'predict_flops': forward_flops, 'train_flops': train_flops}
+
+    K.clear_session()
+    return report
+
+
+def measure_step_memory(variant, mode='train', batch_size=32, seq_len=30, **kwargs):
+    """
+    Peak RSS (and peak GPU memory, if there is a GPU) of one train or predict step. Meant to run in its own process
+    (see run_probe), so the peak only includes this graph.
+    """
+    tf.reset_default_graph()
+    sess = tf.Session()
+    K.set_session(sess)
+
+    frames, actions, states, _, iterator = synthetic_data(batch_size=batch_size, seq_len=seq_len)
+    model = build_graph(variant, frames, actions, states, **kwargs)
+    result = {'variant': variant, 'mode': mode, 'batch_size': batch_size, 'rss_build_mb': peak_rss_mb()}
+
+    if mode == 'train':
+        model.fit(x=iterator, epochs=1, steps_per_epoch=1, verbose=0)
+    else:
+        model.predict(x=iterator, steps=1)
+    result['peak_rss_mb'] = peak_rss_mb()
+
+    if tf.test.is_gpu_available():
+        result['peak_gpu_mb'] = sess.run(tf.contrib.memory_stats.MaxBytesInUse()) / MB
+
+    K.clear_session()
+    return result
+
+
+def run_probe(fn, *args, **kwargs):
+    """
+    Runs fn in a fresh spawned process. Returns None if the process runs out of memory (either TF raises
+    ResourceExhaustedError or the process is killed).
+    """
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+        try:
+            return executor.submit(fn, *args, **kwargs).result()
+        except (BrokenProcessPool, tf.errors.ResourceExhaustedError, MemoryError):
+            return None
+
+
+def find_max_batch_size(variant, budget_mb, mode='train', seq_len=30, low=1, high=512, **kwargs):
+    """
+    Largest batch size whose measured peak memory for one step of mode fits in budget_mb (peak GPU memory if there
+    is a GPU, peak RSS otherwise). Doubles the batch size until it does not fit, then bisects. Every probe runs in
+    its own process. Returns (batch size or None if even low does not fit, list of probes).
+    """
+    probes = []
+
+    def fits(bs):
+        r = run_probe(measure_step_memory, variant, mode=mode, batch_size=bs, seq_len=seq_len, **kwargs)
+        used = None if r is None else r.get('peak_gpu_mb', r['peak_rss_mb'])
+        ok = used is not None and used <= budget_mb
+        probes.append({'batch_size': bs, 'peak_mb': used, 'fits': ok})
+        print('batch size %4d: %s' % (bs, 'out of memory' if used is None else '%.1f MB %s' %
+                                      (used, 'fits' if ok else 'over budget')))
+        return ok
+
+    if not fits(low):
+        return None, probes
+
+    # grow until the budget is exceeded
+    good, bad = low, None
+    while bad is None:
+        candidate = min(good * 2, high)
+        if candidate == good:
+            return good, probes
+        if fits(candidate):
+            good = candidate
+        else:
+            bad = candidate
+
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if fits(mid):
+            good = mid
+        else:
+            bad = mid
+
+    return good, probes
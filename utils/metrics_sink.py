@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import threading
+import tensorflow as tf
+from utils.lazy import colored
+
+
+class JsonlBackend(object):
+    """Appends each record as one JSON line to a local file. Works offline."""
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.f = open(path, 'a')
+
+    def write(self, records):
+        self.f.write(''.join(json.dumps(r) + '\n' for r in records))
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class NeptuneBackend(object):
+    """Forwards metric records to neptune and uploads artifact records. neptune is only imported when used."""
+
+    def __init__(self, user, project_name):
+        import neptune
+        self.neptune = neptune
+        self.neptune.init(user + '/' + project_name)
+        self.neptune.create_experiment(name=project_name)
+
+    def write(self, records):
+        for r in records:
+            if r['kind'] == 'artifact':
+                self.neptune.log_artifact(r['path'])
+                continue
+            for k, v in r['metrics'].items():
+                self.neptune.log_metric(r['kind'] + '/' + k if r['kind'] == 'batch' else k, x=r['step'], y=v)
+
+    def close(self):
+        self.neptune.stop()
+
+
+class MetricsSink(object):
+
+    def __init__(self, backends, flush_interval=10.0, flush_size=1000):
+        """
+        Buffers metric records in memory and writes them to the backends from a background thread, so that logging
+        never blocks the caller.
+
+        - backends: list of objects with write(records) and close() methods, e.g. JsonlBackend, NeptuneBackend
+        - flush_interval: (float) seconds between flushes
+        - flush_size: (int) number of buffered records that triggers an early flush
+        """
+        self.backends = backends if isinstance(backends, list) else [backends]
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='metrics_sink', daemon=True)
+        self.thread.start()
+
+    def log(self, metrics, step, kind='epoch', **extra):
+        record = {'kind': kind, 'step': int(step), 'time': time.time(),
+                  'metrics': {k: float(v) for k, v in metrics.items()}}
+        record.update(extra)
+        self._append(record)
+
+    def log_artifact(self, path):
+        self._append({'kind': 'artifact', 'step': -1, 'time': time.time(), 'path': path})
+
+    def _append(self, record):
+        with self.lock:
+            self.buffer.append(record)
+            n = len(self.buffer)
+        if n >= self.flush_size:
+            self.wake.set()
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer = self.buffer, []
+        if not records:
+            return
+        for backend in self.backends:
+            try:
+                backend.write(records)
+            except Exception as e:
+                print(colored('Failed to write %d metric records to %s: %s' %
+                              (len(records), backend.__class__.__name__, e), 'red'))
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+        for backend in self.backends:
+            backend.close()
+
+
+class MetricsCallback(tf.keras.callbacks.Callback):
+
+    def __init__(self, sink, batch_period=1):
+        """
+        Logs the epoch logs and, every batch_period batches, the batch logs and the wall time of the train step
+        """
+        super(MetricsCallback, self).__init__()
+        self.sink = sink
+        self.batch_period = batch_period
+        self.step = 0
+        self.epoch_start = None
+        self.batch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        step_time = time.perf_counter() - self.batch_start
+        self.step += 1
+        if self.batch_period and self.step % self.batch_period == 0:
+            metrics = {k: v for k, v in (logs or {}).items() if k not in ['batch', 'size']}
+            metrics['step_time'] = step_time
+            self.sink.log(metrics, step=self.step, kind='batch')
+
+    def on_epoch_end(self, epoch, logs=None):
+        metrics = dict(logs or {})
+        metrics['epoch_time'] = time.perf_counter() - self.epoch_start
+        self.sink.log(metrics, step=epoch, kind='epoch')
+
+    def on_train_end(self, logs=None):
+        self.sink.close()
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+from models.numpy_runtime import NumpyAgentPredictor
+
+PARAMS = ['strides', 'padding', 'use_bias', 'activation', 'recurrent_activation', 'epsilon', 'alpha', 'units',
+          'filters', 'output_dim']
+
+
+def _layer_entries(model):
+    entries, weights = [], []
+    for layer in model.layers:
+        if layer.__class__.__name__ == 'InputLayer':
+            continue
+        inner = getattr(layer, 'layer', layer)
+        w = layer.get_weights()
+        if not w:
+            continue
+        config = inner.get_config()
+        params = {k: config[k] for k in PARAMS if k in config and not isinstance(config[k], dict)}
+        entries.append({'class': inner.__class__.__name__, 'name': layer.name, 'params': params,
+                        'n_weights': len(w)})
+        weights.append(w)
+    return entries, weights
+
+
+def export_numpy(path, models, context_frames, gaussian_a=True):
+    """
+    Writes the weights of the agent path sub models (Ec, A, La, Da, as returned by load_predictor_models) and the
+    layer parameters the NumPy runtime needs to one .npz, read by models.numpy_runtime.NumpyAgentPredictor.
+    """
+    names = ['Ec', 'A', 'La', 'Da'] if gaussian_a else ['Ec', 'A', 'Da']
+    arrays, meta = {}, {'context_frames': context_frames, 'gaussian_a': gaussian_a, 'models': {}}
+    for name in names:
+        entries, weights = _layer_entries(models[name])
+        meta['models'][name] = entries
+        for i, w in enumerate(weights):
+            for j, array in enumerate(w):
+                arrays['%s/%03d/%d' % (name, i, j)] = array.astype('float32')
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    np.savez_compressed(path, **arrays)
+    return path
+
+
+def check_numpy_parity(models, predictor, frames, actions, states, context_frames, lstm_a_units=256,
+                       lstm_a_layers=1):
+    """
+    Largest absolute difference between the Keras sub models and the NumPy runtime, for each sub model and for the
+    whole agent path, on one batch (frames in [0, 1], [batch_size, seq_len, h, w, c]). The Keras models must be
+    loaded with the learning phase set to 0.
+    """
+    from models.lstm import lstm_initial_state_zeros_np
+
+    if not isinstance(predictor, NumpyAgentPredictor):
+        predictor = NumpyAgentPredictor(predictor)
+    bs, seq_len = frames.shape[:2]
+    action_state = np.concatenate([actions, states], axis=-1).astype('float32')
+
+    def diff(a, b):
+        return float(np.max(np.abs(np.asarray(a) - np.asarray(b))))
+
+    errors = {}
+    x_ctx = frames[:, :context_frames].astype('float32')
+    keras_ec = models['Ec'].predict(x_ctx, batch_size=bs)
+    np_hc, np_skips = predictor.Ec(x_ctx)
+    errors['Ec'] = max(diff(k, n) for k, n in zip(keras_ec, [np_hc] + np_skips))
+
+    # each sub model on the inputs the Keras path gives it
+    keras_ha = models['A'].predict(action_state, batch_size=bs)
+    errors['A'] = diff(keras_ha, predictor.A(action_state))
+    hc = keras_ec[0][:, context_frames - 1]
+    hc_ha = np.concatenate([np.repeat(hc[:, None], seq_len, axis=1), keras_ha], axis=-1)
+    if predictor.La is not None:
+        initial_state = lstm_initial_state_zeros_np(lstm_a_units, lstm_a_layers, bs)
+        keras_mu = models['La'].predict([hc_ha] + [s for layer in initial_state for s in layer], batch_size=bs)[1]
+        errors['La'] = diff(keras_mu, predictor.La(hc_ha))
+        hc_ha = np.concatenate([hc_ha, keras_mu], axis=-1)
+
+    skips = [np.repeat(s[:, context_frames - 1:context_frames], seq_len, axis=1) for s in keras_ec[1:]]
+    keras_x = models['Da'].predict([hc_ha] + skips, batch_size=bs)
+    errors['Da'] = diff(keras_x, predictor.Da(hc_ha, skips))
+
+    # and the whole path, where the differences of each part add up
+    errors['agent'] = diff(keras_x, predictor.predict_agent(x_ctx, actions, states))
+    return errors
+
+
+def check_agent_parity(predictor, export_predictor, context_frames, actions, states):
+    """Largest absolute difference between the agent predictions of the NumPy runtime and of an exported SavedModel
+    (utils.export.Predictor), on the same uint8 context frames"""
+    expected = export_predictor.predict_agent(context_frames, actions, states)['frames_float']
+    return float(np.max(np.abs(predictor.predict_agent(context_frames, actions, states) - expected)))
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+SCOPES = ['Ec', 'A', 'La', 'Da', 'Eo', 'D_o', 'Do', 'L']
+
+
+class ProfilerCallback(tf.keras.callbacks.Callback):
+    """Traces a window of train steps with the TF step stats and reports where the time went:
+    - a Chrome trace per step (open in chrome://tracing or Perfetto)
+    - op time per sub model, by name scope (Ec, A, La, Da, Eo, D_o or Do, L), forward and backward separately
+    - a per step breakdown into input wait (IteratorGetNext), forward, backward and callback time, where
+      callback time is the part of the step spent outside the session run (other callbacks and Keras bookkeeping)
+
+    Tracing is switched on only for the window, by changing the run options of the model's train function, so it
+    can be appended to the callbacks of any train_* script.
+
+    # Example
+        ```python
+            clbks.append(ProfilerCallback(os.path.join(ckpt_dir, 'profile'), start_step=20, n_steps=5))
+        ```
+    # Arguments
+        log_dir: directory where the traces and profile_summary.json are written.
+        start_step: first traced step, counted from the start of training. Leave a few steps of warm up.
+        n_steps: number of traced steps.
+        scopes: names of the sub models to aggregate the op time by.
+    """
+
+    def __init__(self, log_dir, start_step=10, n_steps=5, scopes=SCOPES, verbose=1):
+        super(ProfilerCallback, self).__init__()
+        self.log_dir = log_dir
+        self.start_step = start_step
+        self.n_steps = n_steps
+        self.scopes = set(scopes)
+        self.verbose = verbose
+        self.step = 0
+        self.run_metadata = None
+        self.batch_begin = None
+        self.previous_batch_end = None
+        self.steps = []
+
+        os.makedirs(log_dir, exist_ok=True)
+
+    def _set_tracing(self, on):
+        f = self.model.train_function
+        if on:
+            self.run_metadata = tf.RunMetadata()
+            f.run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            f.run_metadata = self.run_metadata
+        else:
+            f.run_options = None
+            f.run_metadata = None
+        # the run options are part of the session callable, which is rebuilt on the next call
+        f._callable_fn = None
+
+    def _tracing(self):
+        return self.start_step <= self.step < self.start_step + self.n_steps
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.step == self.start_step:
+            self._set_tracing(True)
+        self.batch_begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        batch_end = time.perf_counter()
+
+        if self._tracing():
+            step_stats = self.run_metadata.step_stats
+            with open(os.path.join(self.log_dir, 'trace_step_%d.json' % self.step), 'w') as f:
+                f.write(timeline.Timeline(step_stats).generate_chrome_trace_format())
+
+            stats = aggregate_step_stats(step_stats, self.scopes)
+            # host time around the session run: time since the previous step ended plus what the step spent
+            # outside the run
+            outside = (batch_end - self.batch_begin) - stats['run_ms'] / 1000.0
+            if self.previous_batch_end is not None:
+                outside += self.batch_begin - self.previous_batch_end
+            stats['callback_ms'] = max(outside, 0.0) * 1000.0
+            stats['step'] = self.step
+            self.steps.append(stats)
+
+            if self.step == self.start_step + self.n_steps - 1:
+                self._set_tracing(False)
+                self.report()
+
+        self.previous_batch_end = batch_end
+        self.step += 1
+
+    def on_train_end(self, logs=None):
+        if self._tracing():
+            self._set_tracing(False)
+            self.report()
+
+    def report(self):
+        if not self.steps:
+            return
+        summary = summarize_profile(self.steps)
+        with open(os.path.join(self.log_dir, 'profile_summary.json'), 'w') as f:
+            json.dump({'steps': self.steps, 'summary': summary}, f, indent=2)
+        if self.verbose:
+            print_profile(summary)
+
+
+def _select_devices(dev_stats):
+    """CPU devices and, on GPU, the 'stream:all' timeline of the kernels rather than the op launches"""
+    names = [d.device for d in dev_stats]
+    has_stream_all = any('stream:all' in n for n in names)
+    selected = []
+    for d in dev_stats:
+        if 'CPU' in d.device or (has_stream_all and 'stream:all' in d.device) or \
+                (not has_stream_all and 'GPU' in d.device and 'stream' not in d.device and 'memcpy' not in d.device):
+            selected.append(d)
+    return selected
+
+
+def scope_of(node_name, scopes):
+    """First name scope of node_name that is one of the sub models, ignoring the _<n> suffix of repeated calls"""
+    for part in node_name.split('/'):
+        part = re.sub(r'_\d+$', '', part)
+        if part in scopes:
+            return part
+    return 'other'
+
+
+def aggregate_step_stats(step_stats, scopes=SCOPES):
+    """
+    Sums the op time of one traced step by phase (input, forward, backward) and by sub model. Ops run in parallel,
+    so op times add up to more than the wall time of the run, which is reported separately as run_ms.
+    """
+    phases = {'input_ms': 0.0, 'forward_ms': 0.0, 'backward_ms': 0.0}
+    by_scope = {}
+    start, end = None, None
+
+    for dev in _select_devices(step_stats.dev_stats):
+        for node in dev.node_stats:
+            op_ms = node.all_end_rel_micros / 1000.0
+            node_start = node.all_start_micros
+            node_end = node.all_start_micros + node.all_end_rel_micros
+            start = node_start if start is None else min(start, node_start)
+            end = node_end if end is None else max(end, node_end)
+
+            name = node.node_name.split(':')[0]
+            if 'IteratorGetNext' in name or 'IteratorGetNext' in node.timeline_label:
+                phases['input_ms'] += op_ms
+                continue
+            backward = 'gradients' in name or name.startswith('training/')
+            phases['backward_ms' if backward else 'forward_ms'] += op_ms
+
+            scope = scope_of(name, scopes)
+            entry = by_scope.setdefault(scope, {'forward_ms': 0.0, 'backward_ms': 0.0})
+            entry['backward_ms' if backward else 'forward_ms'] += op_ms
+
+    stats = dict(phases)
+    stats['run_ms'] = (end - start) / 1000.0 if start is not None else 0.0
+    stats['scopes'] = by_scope
+    return stats
+
+
+def summarize_profile(steps):
+    """Median over the traced steps of every phase and every sub model"""
+    summary = {k: float(np.median([s[k] for s in steps]))
+               for k in ['run_ms', 'input_ms', 'forward_ms', 'backward_ms', 'callback_ms']}
+    scopes = sorted(set(k for s in steps for k in s['scopes']))
+    summary['scopes'] = {}
+    for scope in scopes:
+        summary['scopes'][scope] = {k: float(np.median([s['scopes'].get(scope, {}).get(k, 0.0) for s in steps]))
+                                    for k in ['forward_ms', 'backward_ms']}
+    return summary
+
+
+def print_profile(summary):
+    print('Step (median): run %.2f ms | input wait %.2f ms | forward %.2f ms | backward %.2f ms | callbacks %.2f ms'
+          % (summary['run_ms'], summary['input_ms'], summary['forward_ms'], summary['backward_ms'],
+             summary['callback_ms']))
+    total = sum(v['forward_ms'] + v['backward_ms'] for v in summary['scopes'].values()) or 1.0
+    print('%-8s %12s %12s %8s' % ('scope', 'forward ms', 'backward ms', 'share'))
+    for scope, v in sorted(summary['scopes'].items(), key=lambda kv: -(kv[1]['forward_ms'] + kv[1]['backward_ms'])):
+        print('%-8s %12.2f %12.2f %7.1f%%' % (scope, v['forward_ms'], v['backward_ms'],
+                                              100.0 * (v['forward_ms'] + v['backward_ms']) / total))
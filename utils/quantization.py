@@ -0,0 +1,193 @@
+import copy
+import time
+import numpy as np
+import tensorflow as tf
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras.models import Model
+from tensorflow.python.keras.layers import RepeatVector
+from models.bn_folding import CUSTOM_OBJECTS
+from models.bn_folding import fold_batchnorm
+from models.lstm import lstm_initial_state_zeros
+from utils.evaluation import StreamingMetrics
+
+RECURRENT = ['ConvLSTM2D', 'LSTM', 'GRU', 'SimpleRNN', 'RNN']
+
+
+def _flatten(outputs):
+    return outputs if isinstance(outputs, list) else [outputs]
+
+
+def inference_copy(model, custom_objects=None):
+    """
+    Copy of model with an unknown batch size, with batch norm folded. With a known batch size TimeDistributed runs
+    its layer in a K.rnn loop, which the TFLite converter does not support; with an unknown one it reshapes the time
+    axis into the batch axis.
+    """
+    model = fold_batchnorm(model)
+    config = copy.deepcopy(model.get_config())
+    for layer in config['layers']:
+        if layer['class_name'] == 'InputLayer':
+            layer['config']['batch_input_shape'] = [None] + list(layer['config']['batch_input_shape'][1:])
+    objects = dict(CUSTOM_OBJECTS, **(custom_objects or {}))
+    inference_model = Model.from_config(config, custom_objects=objects)
+    for layer in inference_model.layers:
+        layer.set_weights(model.get_layer(layer.name).get_weights())
+    return inference_model
+
+
+def quantize_model(model, calibration_inputs, strict=True, new_converter=False, sess=None):
+    """
+    Post-training int8 quantization of a sub model (image_encoder, image_decoder and, with new_converter, the
+    recurrent_image_encoder) with TFLite. Weights and activations are int8, the activation ranges are calibrated on
+    calibration_inputs: a list with one array per (flattened) model input, the first axis indexing the samples.
+    Inputs and outputs stay float32. The model runs one sample per call.
+    - strict: (boolean) every op must have an int8 kernel, otherwise ops without one are left in float
+    - new_converter: (boolean) use the experimental MLIR converter, needed for the while loop of ConvLSTM2D (the
+                     legacy converter has no control flow and ConvRNN2D cannot be unrolled)
+    Returns the .tflite flatbuffer.
+    """
+    if not new_converter:
+        recurrent = [l.name for l in model.layers if getattr(l, 'layer', l).__class__.__name__ in RECURRENT]
+        assert not recurrent, '%s has recurrent layers %s, use new_converter=True' % (model.name, recurrent)
+
+    sess = sess or K.get_session()
+    inference_model = inference_copy(model)
+    converter = tf.lite.TFLiteConverter.from_session(sess, inference_model.inputs,
+                                                     _flatten(inference_model.outputs))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if strict:
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    if new_converter:
+        converter.experimental_new_converter = True
+
+    n = len(calibration_inputs[0])
+
+    def representative_dataset():
+        for i in range(n):
+            yield [x[i:i + 1].astype('float32') for x in calibration_inputs]
+
+    converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+class TFLiteModel(object):
+
+    def __init__(self, model_content):
+        """Runs a converted sub model on numpy batches, one sample per interpreter call"""
+        self.interpreter = tf.lite.Interpreter(model_content=model_content)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+
+    def predict(self, inputs):
+        """inputs: list of arrays, one per model input. Returns the list of outputs, in the order of the model's"""
+        outputs = [[] for _ in self.output_details]
+        for i in range(len(inputs[0])):
+            for detail, x in zip(self.input_details, inputs):
+                self.interpreter.set_tensor(detail['index'], x[i:i + 1].astype(detail['dtype']))
+            self.interpreter.invoke()
+            for out, detail in zip(outputs, self.output_details):
+                out.append(self.interpreter.get_tensor(detail['index']))
+        return [np.concatenate(out, axis=0) for out in outputs]
+
+
+def keras_predict_fn(model):
+    return lambda inputs: _flatten(model.predict(inputs, batch_size=len(inputs[0])))
+
+
+def agent_latent_fn(A, La, batch_size, seq_len, hc_dim, action_state_dim, gaussian_a=True, lstm_a_units=256,
+                    lstm_a_layers=1):
+    """
+    K.function from (hc of the last context frame, actions and states) to the input of Da, the part of the agent path
+    between the encoder and the decoder, with La's mean as za
+    """
+    hc = tf.placeholder(tf.float32, [batch_size, hc_dim])
+    action_state = tf.placeholder(tf.float32, [batch_size, seq_len, action_state_dim])
+    hc_ha = K.concatenate([RepeatVector(seq_len)(hc), A(action_state)], axis=-1)
+    if gaussian_a:
+        initial_state_a = lstm_initial_state_zeros(units=lstm_a_units, n_layers=lstm_a_layers, batch_size=batch_size)
+        _, za, _, _ = La([hc_ha, initial_state_a])
+        hc_ha = K.concatenate([hc_ha, za], axis=-1)
+    return K.function([hc, action_state], [hc_ha])
+
+
+def agent_predict(encode, latent, decode, frames, action_state, context_frames):
+    """
+    Agent only prediction (the x_rec_a of adr_vp_feedback_frames) from numpy functions for each part, so the encoder
+    and the decoder can be either the Keras or the quantized models.
+    """
+    outs = encode([frames[:, :context_frames]])
+    hc = outs[0][:, context_frames - 1]
+    skips = [s[:, context_frames - 1:context_frames] for s in outs[1:]]
+    z = latent([hc, action_state])[0]
+    skips = [np.repeat(s, z.shape[1], axis=1) for s in skips]
+    return decode([z] + skips)[0], (z, skips)
+
+
+def compare_quantized(batches, float_fns, quantized_fns, latent, context_frames):
+    """
+    Per horizon MSE and PSNR of the float and quantized agent predictions against the ground truth, their difference
+    (quantized - float), and the PSNR of the quantized predictions against the float ones.
+    - batches: iterable of (frames, action_state) numpy batches
+    - float_fns, quantized_fns: (encode, decode) pairs of numpy functions
+    """
+    metrics = ['mse', 'psnr']
+    float_metrics, quantized_metrics, agreement = [StreamingMetrics(metrics) for _ in range(3)]
+    times = {'float_ms': 0.0, 'quantized_ms': 0.0}
+    n = 0
+
+    for frames, action_state in batches:
+        t = time.perf_counter()
+        x_float, _ = agent_predict(float_fns[0], latent, float_fns[1], frames, action_state, context_frames)
+        times['float_ms'] += (time.perf_counter() - t) * 1000.0
+        t = time.perf_counter()
+        x_quantized, _ = agent_predict(quantized_fns[0], latent, quantized_fns[1], frames, action_state,
+                                       context_frames)
+        times['quantized_ms'] += (time.perf_counter() - t) * 1000.0
+
+        target = frames[:, :x_float.shape[1]]
+        float_metrics.update(x_float, target)
+        quantized_metrics.update(x_quantized, target)
+        agreement.update(x_quantized, np.clip(x_float, 0.0, 1.0))
+        n += len(frames)
+
+    f, q = float_metrics.result(), quantized_metrics.result()
+    report = {'float': f, 'quantized': q, 'quantized_vs_float': agreement.result(), 'n_sequences': n}
+    for m in metrics:
+        report[m + '_delta'] = [qv - fv for qv, fv in zip(q[m], f[m])]
+        report[m + '_delta_mean'] = q[m + '_mean'] - f[m + '_mean']
+    # per sequence time of the whole agent path (the latent part is shared and runs in float in both)
+    report.update({k: v / max(n, 1) for k, v in times.items()})
+    return report
+
+
+class EncoderAgreement(object):
+
+    def __init__(self, float_fn, quantized_fn):
+        """
+        Accumulates the error of the latent (first output) of a quantized encoder against the float one, and the
+        per sample time of both, for the encoders whose output is not decoded to frames in the agent path (Eo)
+        """
+        self.float_fn = float_fn
+        self.quantized_fn = quantized_fn
+        self.sq_error, self.sq_norm, self.size, self.n = 0.0, 0.0, 0, 0
+        self.times = {'float_ms': 0.0, 'quantized_ms': 0.0}
+
+    def update(self, inputs):
+        t = time.perf_counter()
+        h_float = self.float_fn(inputs)[0]
+        self.times['float_ms'] += (time.perf_counter() - t) * 1000.0
+        t = time.perf_counter()
+        h_quantized = self.quantized_fn(inputs)[0]
+        self.times['quantized_ms'] += (time.perf_counter() - t) * 1000.0
+
+        self.sq_error += float(np.sum(np.square(h_quantized - h_float)))
+        self.sq_norm += float(np.sum(np.square(h_float)))
+        self.size += h_float.size
+        self.n += len(inputs[0])
+
+    def result(self):
+        result = {'mse': self.sq_error / max(self.size, 1),
+                  'relative_error': float(np.sqrt(self.sq_error / max(self.sq_norm, 1e-12))), 'n_samples': self.n}
+        result.update({k: v / max(self.n, 1) for k, v in self.times.items()})
+        return result
@@ -0,0 +1,171 @@
+import os
+import json
+import platform
+import multiprocessing
+import tensorflow as tf
+
+TUNING_FILE = os.path.join(os.path.expanduser('~/'), '.adr', 'runtime_tuning.json')
+# tf.data private thread pool size decided by the last runtime_config call, see data_threads
+_data_threads = None
+
+
+def machine_type():
+    """Identifies the kind of machine (CPU model and core count), so tuned settings can be shared across a fleet"""
+    model = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return '%s | %d cpus' % (model, multiprocessing.cpu_count())
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def slot_cores(slot, n_slots, cores=None):
+    """Splits the cores in n_slots contiguous groups and returns the group of slot, for n_slots jobs sharing a node"""
+    cores = cores if cores is not None else available_cores()
+    per_slot = max(len(cores) // n_slots, 1)
+    return cores[slot * per_slot:(slot + 1) * per_slot] or cores[-per_slot:]
+
+
+def pin_cores(cores):
+    """Restricts this process, and every thread it starts afterwards (TF thread pools included), to cores"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    else:
+        print('Core pinning is not supported on this platform')
+
+
+def set_onednn_env(threads, block_time=1):
+    """
+    oneDNN / OpenMP settings, only used by oneDNN (MKL) builds of TF. They are read when the OpenMP runtime starts,
+    so this has to run before the first session. Values already set in the environment are kept.
+    """
+    os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+    os.environ.setdefault('KMP_BLOCKTIME', str(block_time))
+    os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+
+
+def load_tuned(path=TUNING_FILE):
+    """Best settings recorded by tune_runtime for this machine type, or None"""
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f).get(machine_type())
+
+
+def save_tuned(settings, path=TUNING_FILE):
+    records = {}
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            records = json.load(f)
+    records[machine_type()] = settings
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(records, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def data_threads():
+    """
+    Size of the tf.data private thread pool of the input pipelines, as decided by runtime_config, to pass to
+    get_data(private_threadpool_size=...). None (the shared TF pools) if runtime_config was not called.
+    """
+    return _data_threads
+
+
+def runtime_config(intra_op_threads=None, inter_op_threads=None, cores=None, slot=None, n_slots=None,
+                   onednn=True, gpu_devices=None, allow_growth=False, tuned=True, tuning_file=TUNING_FILE,
+                   pipeline_threads=None):
+    """
+    Applies the process level settings (core pinning, oneDNN/OpenMP environment) and returns the tf.ConfigProto to
+    create the session with. Call it before the first session is created.
+
+    - intra_op_threads, inter_op_threads: (int) TF thread pool sizes. When not given, the settings recorded by
+                                          tune_runtime for this machine type are used (if tuned is True), otherwise
+                                          one intra op thread per usable core and 2 inter op threads
+    - cores: (list) cores to pin this process to
+    - slot, n_slots: (int) alternatively, pin to the slot-th of n_slots equal groups of cores, for jobs sharing a node
+    - onednn: (boolean) set the oneDNN/OpenMP environment variables
+    - gpu_devices: (str) visible_device_list of the GPU options, e.g. '1'. Ignored on machines without a GPU
+    - pipeline_threads: (int) size of the tf.data private thread pool of the input pipelines, recorded for
+                        data_threads(). By default the tuned value if recorded, otherwise a quarter of the usable
+                        cores (at least 2)
+    """
+    global _data_threads
+    assert (slot is None) == (n_slots is None), 'slot and n_slots must be given together'
+    assert slot is None or 0 <= slot < n_slots, 'slot must be in [0, n_slots)'
+    if cores is None and slot is not None:
+        cores = slot_cores(slot, n_slots)
+    if cores is not None:
+        pin_cores(cores)
+    n_cores = len(available_cores())
+
+    settings = load_tuned(tuning_file) if tuned else None
+    if intra_op_threads is None:
+        intra_op_threads = min(settings['intra_op_threads'], n_cores) if settings else n_cores
+    if inter_op_threads is None:
+        inter_op_threads = settings['inter_op_threads'] if settings else 2
+    if pipeline_threads is None:
+        pipeline_threads = settings.get('pipeline_threads') if settings else None
+    _data_threads = pipeline_threads or max(n_cores // 4, 2)
+
+    if onednn:
+        set_onednn_env(intra_op_threads)
+
+    gpu_options = tf.GPUOptions(allow_growth=allow_growth)
+    if gpu_devices is not None:
+        gpu_options.visible_device_list = gpu_devices
+
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                          inter_op_parallelism_threads=inter_op_threads,
+                          gpu_options=gpu_options)
+
+
+def _benchmark_settings(settings, variant, batch_size, seq_len, steps, warmup):
+    # runs in a fresh process, so the environment and the affinity apply from the start
+    from utils.benchmark import benchmark_graph
+    config = runtime_config(intra_op_threads=settings['intra_op_threads'],
+                            inter_op_threads=settings['inter_op_threads'], tuned=False)
+    # adr needs frames beyond the window, seq_len > use_seq_len
+    return benchmark_graph(variant, batch_size=batch_size, seq_len=seq_len, steps=steps, warmup=warmup,
+                           train=True, predict=False, config=config, use_seq_len=min(seq_len - 1, 12))
+
+
+def tune_runtime(variant='adr_ao', batch_size=16, seq_len=30, steps=10, warmup=3, candidates=None,
+                 tuning_file=TUNING_FILE, save=True):
+    """
+    Times the train step of variant on synthetic data for each thread setting in candidates (by default a few
+    intra op counts up to the number of cores, with 1 or 2 inter op threads), and records the fastest for this
+    machine type in tuning_file, where runtime_config picks it up.
+    Returns (best settings, list of (settings, median step ms)).
+    """
+    from utils.benchmark import run_isolated
+
+    n_cores = len(available_cores())
+    if candidates is None:
+        intra = sorted(set([n_cores, max(n_cores // 2, 1), max(n_cores // 4, 1)]), reverse=True)
+        candidates = [{'intra_op_threads': i, 'inter_op_threads': j} for i in intra for j in [1, 2]]
+
+    results = []
+    for settings in candidates:
+        r = run_isolated(_benchmark_settings, settings, variant, batch_size, seq_len, steps, warmup)
+        results.append((settings, r['train']['median_ms']))
+        print('intra %3d  inter %2d  %10.2f ms/step' % (settings['intra_op_threads'], settings['inter_op_threads'],
+                                                         r['train']['median_ms']))
+
+    best, best_ms = min(results, key=lambda r: r[1])
+    best = dict(best, step_ms=best_ms, variant=variant, batch_size=batch_size)
+    if save:
+        save_tuned(best, tuning_file)
+    return best, results
@@ -0,0 +1,246 @@
+import io
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import collections
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import numpy as np
+
+INPUTS = ['context_frames', 'actions', 'states']
+DTYPES = {'context_frames': np.uint8, 'actions': np.float32, 'states': np.float32}
+
+
+class _Request(object):
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.n = len(inputs[INPUTS[0]])
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.outputs = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    """Coalesces concurrent requests into batches for a fixed batch size predictor.
+
+    A worker thread takes the oldest request and keeps adding queued requests until the batch holds max_batch_size
+    sequences or timeout_ms have passed since that first request, then runs predict_fn once on the concatenated
+    inputs and hands every request its own rows of the outputs.
+
+    # Example
+        ```python
+            predictor = Predictor(export_dir)
+            batcher = DynamicBatcher(predictor.rollout, max_batch_size=predictor.batch_size, timeout_ms=5)
+            outputs = batcher.submit(context_frames=x, actions=a, states=s)
+        ```
+    # Arguments
+        predict_fn: takes the INPUTS as keyword arrays with at most max_batch_size rows and returns
+                    {name: array with as many rows}, e.g. Predictor.rollout.
+        max_batch_size: largest number of sequences per call of predict_fn, the batch size of the exported graph.
+        timeout_ms: longest time the first request of a batch waits for others.
+        history: number of latest requests kept for the latency percentiles.
+        input_shapes: {name: shape of one sequence, None for any size}, e.g. Predictor.input_shapes(signature).
+                      Requests that do not match are rejected with a ValueError before they join a batch, so they
+                      cannot fail the requests batched with them.
+    """
+
+    def __init__(self, predict_fn, max_batch_size, timeout_ms=5.0, history=1000, input_shapes=None):
+        self.predict_fn = predict_fn
+        self.input_shapes = input_shapes
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout_ms / 1000.0
+        self.queue = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.n_requests = 0
+        self.n_batches = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='DynamicBatcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, **inputs):
+        """Blocks until the outputs of this request are ready, inputs hold one or more sequences"""
+        self._validate(inputs)
+        request = _Request(inputs)
+        assert 0 < request.n <= self.max_batch_size, 'between 1 and %d sequences per request' % self.max_batch_size
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def _validate(self, inputs):
+        n = len(inputs[INPUTS[0]])
+        for k, x in inputs.items():
+            if len(x) != n:
+                raise ValueError('%s has %d sequences, %s has %d' % (k, len(x), INPUTS[0], n))
+        if self.input_shapes is None:
+            return
+        for k, shape in self.input_shapes.items():
+            if k not in inputs:
+                raise ValueError('missing input ' + k)
+            x_shape = np.shape(inputs[k])[1:]
+            if len(x_shape) != len(shape) or any(d is not None and d != x_d for d, x_d in zip(shape, x_shape)):
+                expected = tuple('?' if d is None else d for d in shape)
+                raise ValueError('%s must have sequences of shape %s, not %s' % (k, expected, x_shape))
+
+    def _next_batch(self):
+        first = self._pending or self.queue.get()
+        self._pending = None
+        if first is None:
+            return None, 0
+        batch, size = [first], first.n
+        deadline = first.arrival + self.timeout
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # closing, finish this batch first
+                self.queue.put(None)
+                break
+            if size + request.n > self.max_batch_size:
+                # does not fit, starts the next batch
+                self._pending = request
+                break
+            batch.append(request)
+            size += request.n
+        return batch, size
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch, size = self._next_batch()
+            if batch is None:
+                break
+            try:
+                inputs = {k: np.concatenate([r.inputs[k] for r in batch], axis=0) for k in INPUTS}
+                outputs = self.predict_fn(**inputs)
+                start = 0
+                for r in batch:
+                    r.outputs = {k: v[start:start + r.n] for k, v in outputs.items()}
+                    start += r.n
+            except Exception as e:
+                for r in batch:
+                    r.error = e
+
+            end = time.perf_counter()
+            with self._lock:
+                self.n_batches += 1
+                self.n_requests += len(batch)
+                self.batch_sizes.append(size)
+                for r in batch:
+                    self.latencies.append((end - r.arrival) * 1000.0)
+            for r in batch:
+                r.done.set()
+
+    def stats(self):
+        """Queue depth, request and batch counts and latency percentiles (ms) over the latest requests"""
+        with self._lock:
+            latencies = list(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            stats = {'queue_depth': self.queue.qsize() + (self._pending is not None), 'requests': self.n_requests,
+                     'batches': self.n_batches, 'max_batch_size': self.max_batch_size,
+                     'mean_batch_size': float(np.mean(batch_sizes)) if batch_sizes else 0.0}
+        for p in [50, 90, 99]:
+            stats['latency_p%d_ms' % p] = float(np.percentile(latencies, p)) if latencies else None
+        return stats
+
+    def close(self):
+        self._stop.set()
+        self.queue.put(None)
+        self._worker.join()
+
+
+def decode_request(body, content_type):
+    """JSON {name: nested lists} or an npz archive, a single sequence (no batch axis) is accepted as well"""
+    if content_type == 'application/x-npz':
+        arrays = np.load(io.BytesIO(body))
+    else:
+        arrays = json.loads(body.decode('utf-8'))
+    inputs = {}
+    for k in INPUTS:
+        x = np.asarray(arrays[k], dtype=DTYPES[k])
+        inputs[k] = x[None] if x.ndim == (4 if k == 'context_frames' else 2) else x
+    return inputs
+
+
+def encode_response(outputs, content_type):
+    if content_type == 'application/x-npz':
+        buffer = io.BytesIO()
+        np.savez(buffer, **outputs)
+        return buffer.getvalue()
+    return json.dumps({k: v.tolist() for k, v in outputs.items()}).encode('utf-8')
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """POST /<signature> runs a request through the batcher, GET /stats returns DynamicBatcher.stats"""
+
+    def _reply(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/stats':
+            return self._reply(404, b'{"error": "not found"}')
+        self._reply(200, json.dumps(self.server.batcher.stats()).encode('utf-8'))
+
+    def do_POST(self):
+        if self.path.strip('/') != self.server.signature:
+            return self._reply(404, b'{"error": "not found"}')
+        content_type = self.headers.get('Content-Type', 'application/json')
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            outputs = self.server.batcher.submit(**decode_request(body, content_type))
+        except (KeyError, ValueError, AssertionError) as e:
+            return self._reply(400, json.dumps({'error': str(e)}).encode('utf-8'))
+        except Exception as e:
+            return self._reply(500, json.dumps({'error': str(e)}).encode('utf-8'))
+        self._reply(200, encode_response(outputs, content_type), content_type)
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(PredictionHandler, self).log_message(format, *args)
+
+
+class PredictionServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, batcher, signature='rollout', verbose=False):
+        self.batcher = batcher
+        self.signature = signature
+        self.verbose = verbose
+        HTTPServer.__init__(self, address, PredictionHandler)
+
+
+class UnixPredictionServer(PredictionServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def make_server(batcher, host='127.0.0.1', port=8500, unix_socket=None, signature='rollout', verbose=False):
+    """HTTP server on host:port, or on a unix socket if its path is given"""
+    if unix_socket is not None:
+        return UnixPredictionServer(unix_socket, batcher, signature, verbose)
+    return PredictionServer((host, port), batcher, signature, verbose)
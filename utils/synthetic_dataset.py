@@ -0,0 +1,127 @@
+import io
+import os
+import numpy as np
+import tensorflow as tf
+
+# Shapes of the original datasets, as expected by BairDataReader and GooglePushDataReader
+DATASETS = {'bair': {'height': 64, 'width': 64, 'a_dim': 4, 's_dim': 3, 'seq_len': 30,
+                     'dirs': {'train': 'train', 'test': 'test'}},
+            'google': {'height': 512, 'width': 640, 'a_dim': 5, 's_dim': 5, 'seq_len': 20,
+                       'dirs': {'train': 'push_train', 'test': 'push_testseen'}}}
+
+
+def moving_object_sequence(rng, seq_len=30, height=64, width=64, a_dim=4, s_dim=3, n_objects=2):
+    """
+    Renders n_objects colored squares moving at constant speed over a smooth background, bouncing off the image
+    borders. The state is the normalized (x, y) position of the first object followed by its displacement, truncated
+    or padded with zeros to s_dim; the action is the displacement to the next position, padded with zeros up to a_dim.
+    Returns images [seq_len, height, width, 3] uint8, actions [seq_len, a_dim] and states [seq_len, s_dim] float32.
+    """
+    side = max(height, width) // 8
+    pos = rng.uniform([0, 0], [width - side, height - side], size=[n_objects, 2])
+    vel = rng.uniform(-1, 1, size=[n_objects, 2]) * side / 3.0
+    colors = rng.randint(64, 256, size=[n_objects, 3])
+
+    yy, xx = np.mgrid[0:height, 0:width]
+    background = (np.stack([xx / width, yy / height, 0.5 * np.ones_like(xx)], axis=-1) * 96).astype(np.uint8)
+
+    positions = np.zeros([seq_len, n_objects, 2], dtype='float32')
+    for t in range(seq_len):
+        positions[t] = pos
+        pos = pos + vel
+        bounce = (pos < 0) | (pos > [width - side, height - side])
+        vel = np.where(bounce, -vel, vel)
+        pos = np.clip(pos, 0, [width - side, height - side])
+
+    images = np.repeat(background[None], seq_len, axis=0)
+    for t in range(seq_len):
+        for o in range(n_objects):
+            x, y = positions[t, o].astype(int)
+            images[t, y:y + side, x:x + side] = colors[o]
+
+    xy = positions[:, 0] / [width, height]
+    delta = np.concatenate([xy[1:] - xy[:-1], np.zeros([1, 2])], axis=0)
+    xy_delta = np.concatenate([xy, delta], axis=1)
+    states = np.zeros([seq_len, s_dim], dtype='float32')
+    states[:, :min(4, s_dim)] = xy_delta[:, :min(4, s_dim)]
+    actions = np.zeros([seq_len, a_dim], dtype='float32')
+    actions[:, :min(2, a_dim)] = delta[:, :min(2, a_dim)]
+
+    return images, actions, states
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _float_feature(values):
+    return tf.train.Feature(float_list=tf.train.FloatList(value=[float(v) for v in values]))
+
+
+def encode_jpeg(image, quality=90):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def bair_example(images, actions, states):
+    """Same feature keys as softmotion30_44k: raw uint8 images, 4 dim actions and 3 dim end effector positions"""
+    feature = {}
+    for i in range(images.shape[0]):
+        feature[str(i) + '/image_aux1/encoded'] = _bytes_feature(images[i].tobytes())
+        feature[str(i) + '/action'] = _float_feature(actions[i])
+        feature[str(i) + '/endeffector_pos'] = _float_feature(states[i])
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def google_push_example(images, actions, states):
+    """Same feature keys as the Google Push dataset: JPEG images, 5 dim commanded and end effector poses"""
+    feature = {}
+    for i in range(images.shape[0]):
+        feature['move/' + str(i) + '/image/encoded'] = _bytes_feature(encode_jpeg(images[i]))
+        feature['move/' + str(i) + '/commanded_pose/vec_pitch_yaw'] = _float_feature(actions[i])
+        feature['move/' + str(i) + '/endeffector/vec_pitch_yaw'] = _float_feature(states[i])
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def write_split(save_dir, dataset='bair', n_sequences=256, per_file=256, first_index=0, seq_len=None, seed=0):
+    """
+    Writes n_sequences synthetic sequences to save_dir in files of per_file sequences, named
+    traj_<first>_to_<last>.tfrecords like the original BAIR files (BairDataReader counts the examples from the names).
+    Returns the list of written files.
+    """
+    spec = DATASETS[dataset]
+    seq_len = seq_len or spec['seq_len']
+    make_example = bair_example if dataset == 'bair' else google_push_example
+    rng = np.random.RandomState(seed)
+    os.makedirs(save_dir, exist_ok=True)
+
+    filenames = []
+    for start in range(first_index, first_index + n_sequences, per_file):
+        end = min(start + per_file, first_index + n_sequences) - 1
+        filename = os.path.join(save_dir, 'traj_%d_to_%d.tfrecords' % (start, end))
+        with tf.python_io.TFRecordWriter(filename) as writer:
+            for _ in range(start, end + 1):
+                images, actions, states = moving_object_sequence(rng, seq_len, spec['height'], spec['width'],
+                                                                 spec['a_dim'], spec['s_dim'])
+                writer.write(make_example(images, actions, states).SerializeToString())
+        filenames.append(filename)
+
+    return filenames
+
+
+def write_dataset(dataset_dir, dataset='bair', n_train=512, n_test=128, per_file=64, seq_len=None, seed=0):
+    """
+    Writes a synthetic dataset with the directory layout expected by get_data / the data readers, i.e. for 'bair'
+    dataset_dir/train and dataset_dir/test, and for 'google' dataset_dir/push_train and dataset_dir/push_testseen.
+    The readers split the train files into train and val (train_val_split), so n_train should span several files.
+    """
+    assert dataset in DATASETS, 'dataset must be one of ' + ', '.join(DATASETS.keys())
+    dirs = DATASETS[dataset]['dirs']
+
+    train = write_split(os.path.join(dataset_dir, dirs['train']), dataset, n_train, per_file, first_index=0,
+                        seq_len=seq_len, seed=seed)
+    test = write_split(os.path.join(dataset_dir, dirs['test']), dataset, n_test, per_file, first_index=n_train,
+                       seq_len=seq_len, seed=seed + 1)
+    return train, test
@@ -0,0 +1,114 @@
+import os
+import json
+import tensorflow as tf
+from utils.lazy import colored
+import tensorflow.python.keras.backend as K
+
+
+class TrainingState(tf.keras.callbacks.Callback):
+    """This callback periodically saves everything needed to resume a run exactly where it stopped:
+    - all model weights (including frozen sub models and BatchNormalization statistics)
+    - optimizer variables (slots and the iterations counter, i.e. the global step)
+    - the position of the input iterator (optional, see save_iterator)
+    - the state of any callback implementing get_state()/set_state(), e.g. ModelCheckpoint best losses and
+      CyclicLR iterations
+    - the epoch to restart from
+
+    # Example
+        ```python
+            state = TrainingState(model, ckpt_dir, iterator=train_iterator, callbacks=clbks, save_iterator=True)
+            initial_epoch = state.restore()
+            model.fit(x=train_iterator, initial_epoch=initial_epoch, callbacks=clbks + [state], ...)
+        ```
+    # Arguments
+        model: the compiled model being trained.
+        ckpt_dir: directory where the state is written. The state lives in its own sub directory.
+        iterator: the tf.data iterator passed to fit, its position is only saved with save_iterator=True. Its
+            state includes shuffle buffers, which for 'bair' can take several hundred MB, so by default a resumed
+            run starts reading from a new shuffle.
+        callbacks: callbacks whose state is saved and restored along with the model.
+        period: save every `period` epochs.
+        batch_period: additionally save every `batch_period` batches (None to disable). When resuming from a
+            state saved mid epoch, that epoch is run again from its start with the restored iterator position.
+        max_to_keep: number of states kept on disk.
+    """
+
+    def __init__(self, model, ckpt_dir, iterator=None, callbacks=None, period=1, batch_period=None,
+                 save_iterator=False, max_to_keep=2, name='training_state'):
+        super(TrainingState, self).__init__()
+        self.model = model
+        self.state_dir = os.path.join(ckpt_dir, name)
+        self.iterator = iterator if save_iterator else None
+        self.callbacks = [c for c in (callbacks or []) if hasattr(c, 'get_state') and hasattr(c, 'set_state')]
+        self.period = period
+        self.batch_period = batch_period
+        self.max_to_keep = max_to_keep
+        self.saver = None
+        self.epoch = 0
+
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _build_saver(self):
+        if self.saver is not None:
+            return
+
+        # the optimizer slots only exist once the train function has been made
+        self.model._make_train_function()
+
+        var_list, seen = [], set()
+        for v in self.model.weights + self.model.optimizer.weights + [self.model.optimizer.lr]:
+            if isinstance(v, tf.Variable) and v.op.name not in seen:
+                seen.add(v.op.name)
+                var_list.append(v)
+
+        if self.iterator is not None:
+            var_list.append(tf.data.experimental.make_saveable_from_iterator(self.iterator))
+
+        self.saver = tf.train.Saver(var_list=var_list, max_to_keep=self.max_to_keep)
+
+    def save(self, epoch):
+        self._build_saver()
+
+        sess = K.get_session()
+        step = int(K.get_value(self.model.optimizer.iterations))
+        ckpt_path = self.saver.save(sess, os.path.join(self.state_dir, 'state'), global_step=step)
+
+        state = {'epoch': epoch, 'step': step, 'checkpoint': os.path.basename(ckpt_path),
+                 'callbacks': {c.__class__.__name__: c.get_state() for c in self.callbacks}}
+
+        # the json is only replaced once the checkpoint it points to is complete
+        tmp_path = os.path.join(self.state_dir, 'state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.state_dir, 'state.json'))
+
+    def restore(self):
+        """Restores the latest saved state, if any, and returns the epoch to pass to fit as initial_epoch"""
+        json_path = os.path.join(self.state_dir, 'state.json')
+        if not os.path.isfile(json_path):
+            return 0
+
+        with open(json_path, 'r') as f:
+            state = json.load(f)
+
+        self._build_saver()
+        self.saver.restore(K.get_session(), os.path.join(self.state_dir, state['checkpoint']))
+
+        for c in self.callbacks:
+            if c.__class__.__name__ in state['callbacks']:
+                c.set_state(state['callbacks'][c.__class__.__name__])
+
+        self.epoch = state['epoch']
+        print(colored('Resumed training state from epoch %d, step %d' % (state['epoch'], state['step']), 'cyan'))
+        return self.epoch
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_batch_end(self, batch, logs=None):
+        if self.batch_period and (batch + 1) % self.batch_period == 0:
+            self.save(self.epoch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.period == 0:
+            self.save(epoch + 1)
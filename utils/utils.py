@@ -1,25 +1,50 @@
 import os
+import json
 import math
-import neptune
-from scipy.stats import norm
+import queue
+import shutil
+import hashlib
+import threading
 import pickle
+import h5py
 import numpy as np
 import tensorflow as tf
-from termcolor import colored
-import moviepy.editor as mpy
-from data_readers.bair_data_reader import BairDataReader
-from data_readers.google_push_data_reader import GooglePushDataReader
-from robonet.datasets import load_metadata
-from robonet.datasets.robonet_dataset import RoboNetDataset
+import tensorflow.python.keras.backend as K
+from tensorflow.python.keras import __version__ as keras_version
+from tensorflow.python.keras.saving import hdf5_format
+from tensorflow.python.util import serialization
+from utils.lazy import LazyModule
+from utils.lazy import colored
+from utils.media import MediaWriter
+from utils.media import to_uint8
+from utils.metrics_sink import MetricsSink
+from utils.metrics_sink import MetricsCallback
+from utils.metrics_sink import JsonlBackend
+from utils.metrics_sink import NeptuneBackend
+
+# only imported when used
+neptune = LazyModule('neptune')
+mpy = LazyModule('moviepy.editor')
+
+BAIR_TRAIN_FILES = ['traj_10174_to_10429.tfrecords', 'traj_1024_to_1279.tfrecords', 'traj_10430_to_10685.tfrecords',
+                    'traj_10686_to_10941.tfrecords', 'traj_10942_to_11197.tfrecords', 'traj_11198_to_11453.tfrecords',
+                    'traj_11454_to_11709.tfrecords', 'traj_11710_to_11965.tfrecords', 'traj_11966_to_12221.tfrecords',
+                    'traj_12222_to_12477.tfrecords', 'traj_12478_to_12733.tfrecords', 'traj_12734_to_12989.tfrecords',
+                    'traj_1280_to_1535.tfrecords', 'traj_12990_to_13245.tfrecords', 'traj_13341_to_13596.tfrecords',
+                    'traj_13597_to_13852.tfrecords', 'traj_13853_to_14108.tfrecords', 'traj_14109_to_14364.tfrecords']
+
+BAIR_VAL_FILES = ['traj_5983_to_6238.tfrecords', 'traj_6239_to_6494.tfrecords', 'traj_6495_to_6750.tfrecords']
 
 
 def get_data(dataset, mode, dataset_dir, batch_size=32, sequence_length_train=12, sequence_length_test=12,
-             shuffle=True, initializable=False):
+             shuffle=True, initializable=False, private_threadpool_size=None):
 
     assert dataset in ['bair', 'google', 'robonet']
     assert mode in ['train', 'val', 'test']
 
+    # the dataset backends are imported here, so that only the one in use has to be installed
     if dataset == 'bair':
+        from data_readers.bair_data_reader import BairDataReader
         d = BairDataReader(dataset_dir=dataset_dir,
                            batch_size=batch_size,
                            use_state=1,
@@ -27,8 +52,10 @@ def get_data(dataset, mode, dataset_dir, batch_size=32, sequence_length_train=12
                            sequence_length_test=sequence_length_test,
                            shuffle=shuffle,
                            batch_repeat=1,
-                           initializable=initializable)
+                           initializable=initializable,
+                           private_threadpool_size=private_threadpool_size)
     elif dataset == 'google':
+        from data_readers.google_push_data_reader import GooglePushDataReader
         d = GooglePushDataReader(dataset_dir=dataset_dir,  # '/media/Data/datasets/google_push/push/',
                                  batch_size=batch_size,
                                  sequence_length_train=sequence_length_train,
@@ -36,8 +63,11 @@ def get_data(dataset, mode, dataset_dir, batch_size=32, sequence_length_train=12
                                  shuffle=shuffle,
                                  train_dir_name='push_train',
                                  test_dir_name='push_train',
-                                 batch_repeat=1)
+                                 batch_repeat=1,
+                                 private_threadpool_size=private_threadpool_size)
     elif dataset == 'robonet':
+        from robonet.datasets import load_metadata
+        from robonet.datasets.robonet_dataset import RoboNetDataset
         train_database = load_metadata(os.path.expanduser('~/'), 'RoboNet/hdf5/train')
         val_database = load_metadata(os.path.expanduser('~/'), 'RoboNet/hdf5/val2')
         train_database = train_database[train_database['robot'] == 'fetch']
@@ -46,28 +76,12 @@ def get_data(dataset, mode, dataset_dir, batch_size=32, sequence_length_train=12
         d_val = RoboNetDataset(batch_size=batch_size, dataset_files_or_metadata=val_database,
                                hparams={'img_size': [64, 64], 'target_adim': 2, 'target_sdim': 3})
 
-    d.train_filenames = ['/media/Data/datasets/bair/softmotion30_44k/train/traj_10174_to_10429.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_1024_to_1279.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_10430_to_10685.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_10686_to_10941.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_10942_to_11197.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_11198_to_11453.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_11454_to_11709.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_11710_to_11965.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_11966_to_12221.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_12222_to_12477.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_12478_to_12733.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_12734_to_12989.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_1280_to_1535.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_12990_to_13245.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_13341_to_13596.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_13597_to_13852.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_13853_to_14108.tfrecords',
-                         '/media/Data/datasets/bair/softmotion30_44k/train/traj_14109_to_14364.tfrecords']
-
-    d.val_filenames = ['/media/Data/datasets/bair/softmotion30_44k/train/traj_5983_to_6238.tfrecords',
-                       '/media/Data/datasets/bair/softmotion30_44k/train/traj_6239_to_6494.tfrecords',
-                       '/media/Data/datasets/bair/softmotion30_44k/train/traj_6495_to_6750.tfrecords']
+    if dataset == 'bair':
+        # fixed train/val split of softmotion30_44k, used when dataset_dir holds the original dataset
+        train_filenames = [os.path.join(dataset_dir, 'train', f) for f in BAIR_TRAIN_FILES]
+        val_filenames = [os.path.join(dataset_dir, 'train', f) for f in BAIR_VAL_FILES]
+        if all(os.path.isfile(f) for f in train_filenames + val_filenames):
+            d.train_filenames, d.val_filenames = train_filenames, val_filenames
 
     if dataset == 'robonet':
         frames = tf.squeeze(d_train['images'])  # images, states, and actions are from paired
@@ -91,7 +105,14 @@ def get_data(dataset, mode, dataset_dir, batch_size=32, sequence_length_train=12
 
 class ModelCheckpoint(tf.keras.callbacks.Callback):
 
-    def __init__(self, models, criteria, ckpt_dir, filenames, neptune_ckpt=False, keep_all=False):
+    def __init__(self, models, criteria, ckpt_dir, filenames, neptune_ckpt=False, keep_all=False, async_save=True,
+                 max_queue=2):
+        """
+        - async_save: (boolean) snapshot the weights in memory and write the files from a background thread instead
+                      of blocking training on tf.keras.models.save_model
+        - max_queue: (int) maximum number of checkpoint events (all the models of one epoch) waiting to be written
+                     when async_save is True
+        """
         super(tf.keras.callbacks.Callback, self).__init__()
         super().__init__()
         self.models = models
@@ -106,6 +127,12 @@ class ModelCheckpoint(tf.keras.callbacks.Callback):
         self.saver = None
         self.neptune_ckpt = neptune_ckpt
         self.keep_all = keep_all
+        self.writer = None
+
+        if async_save:
+            # with keep_all every snapshot has its own file so none of them can be superseded
+            self.writer = CheckpointWriter(max_queue=max_queue, drop_superseded=not keep_all,
+                                           neptune_ckpt=neptune_ckpt)
 
         if type(self.models) is not list:
             self.models = [self.models]
@@ -132,14 +159,21 @@ class ModelCheckpoint(tf.keras.callbacks.Callback):
         loss = criteria_map.get(self.criteria)
 
         if loss < self.best_loss:
+            paths = []
             for m, f in zip(self.models, self.filenames):
                 if self.keep_all:
                     f = f.replace('.h5', '') + '_t' + str(train_loss).replace('0.', '') + \
                         '_v' + str(val_loss).replace('0.', '') + '.h5'
-                tf.keras.models.save_model(m, os.path.join(self.ckpt_dir, f))
-                # m.save_weights(os.path.join(self.ckpt_dir, f))
-                if self.neptune_ckpt:
-                    neptune.log_artifact(os.path.join(self.ckpt_dir, f))
+                paths.append(os.path.join(self.ckpt_dir, f))
+
+            if self.writer is not None:
+                self.writer.put(snapshot_models(self.models), paths)
+            else:
+                for m, path in zip(self.models, paths):
+                    tf.keras.models.save_model(m, path)
+                    # m.save_weights(os.path.join(self.ckpt_dir, f))
+                    if self.neptune_ckpt:
+                        neptune.log_artifact(path)
             self.best_loss = loss
 
         if train_loss < self.best_train_loss:
@@ -159,6 +193,159 @@ class ModelCheckpoint(tf.keras.callbacks.Callback):
             print(colored('Best val loss: %.7f, epoch %d' % (self.best_val_loss, self.best_val_epoch), 'green'))
         return
 
+    def on_train_end(self, logs=None):
+        if self.writer is not None:
+            self.writer.close()
+
+    def get_state(self):
+        return {'best_loss': float(self.best_loss), 'best_train_loss': float(self.best_train_loss),
+                'best_train_epoch': self.best_train_epoch, 'best_val_loss': float(self.best_val_loss),
+                'best_val_epoch': self.best_val_epoch}
+
+    def set_state(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
+def snapshot_models(models):
+    """
+    Copies the config and weights of each model to host memory, with a single session run for all the models.
+    The snapshots can then be written to disk by CheckpointWriter without touching the session.
+    """
+    layers = [[(l.name, l.weights) for l in m.layers] for m in models]
+    weights = [w for m in layers for _, layer_weights in m for w in layer_weights]
+    values = iter(K.batch_get_value(weights))
+
+    snapshots = []
+    for m, model_layers in zip(models, layers):
+        config = json.dumps({'class_name': m.__class__.__name__, 'config': m.get_config()},
+                            default=serialization.get_json_type)
+        snapshot_layers = [(name, [w.name for w in layer_weights], [next(values) for _ in layer_weights])
+                           for name, layer_weights in model_layers]
+        snapshots.append({'name': m.name, 'config': config, 'layers': snapshot_layers})
+    return snapshots
+
+
+def snapshot_digest(snapshot):
+    digest = hashlib.sha1(snapshot['config'].encode('utf8'))
+    for _, _, values in snapshot['layers']:
+        for v in values:
+            digest.update(np.ascontiguousarray(v).data)
+    return digest.hexdigest()
+
+
+def write_snapshot(snapshot, path):
+    """
+    Writes a snapshot in the same HDF5 layout as tf.keras.models.save_model (for models without optimizer), so the
+    file can be read back by the load_* functions either with load_model or load_weights. The file is written to a
+    temporary path and renamed, so readers never see a partially written checkpoint.
+    """
+    tmp_path = path + '.tmp'
+    with h5py.File(tmp_path, mode='w') as f:
+        f.attrs['keras_version'] = str(keras_version).encode('utf8')
+        f.attrs['backend'] = K.backend().encode('utf8')
+        f.attrs['model_config'] = snapshot['config'].encode('utf8')
+
+        g = f.create_group('model_weights')
+        hdf5_format.save_attributes_to_hdf5_group(g, 'layer_names',
+                                                  [name.encode('utf8') for name, _, _ in snapshot['layers']])
+        g.attrs['backend'] = K.backend().encode('utf8')
+        g.attrs['keras_version'] = str(keras_version).encode('utf8')
+
+        for layer_name, weight_names, weight_values in snapshot['layers']:
+            layer_group = g.create_group(layer_name)
+            weight_names = [n.encode('utf8') for n in weight_names]
+            hdf5_format.save_attributes_to_hdf5_group(layer_group, 'weight_names', weight_names)
+            for name, val in zip(weight_names, weight_values):
+                param_dset = layer_group.create_dataset(name, val.shape, dtype=val.dtype)
+                if not val.shape:
+                    param_dset[()] = val
+                else:
+                    param_dset[:] = val
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter(object):
+
+    def __init__(self, max_queue=2, drop_superseded=True, neptune_ckpt=False):
+        """
+        Writes model snapshots from a background thread. Each queue item is one checkpoint event, i.e. the snapshots
+        of all the models saved at the same epoch, so an event is either written whole or dropped whole.
+
+        - max_queue: (int) maximum number of pending events. When the queue is full and drop_superseded is True the
+                     oldest pending event is discarded, since a newer best makes it obsolete; otherwise put blocks
+                     until there is room.
+        - neptune_ckpt: (boolean) upload each written file as a neptune artifact, also from the background thread
+        """
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.drop_superseded = drop_superseded
+        self.neptune_ckpt = neptune_ckpt
+        self.last_written = {}  # model name -> (digest, path)
+        self.n_written = 0
+        self.n_skipped = 0
+        self.n_dropped = 0
+        self.n_incomplete = 0
+        self.thread = threading.Thread(target=self._run, name='checkpoint_writer', daemon=True)
+        self.thread.start()
+
+    def put(self, snapshots, paths):
+        """Queues one checkpoint event, the snapshots of snapshot_models and the path of each"""
+        assert len(snapshots) == len(paths), 'snapshots and paths must have the same length'
+        while True:
+            try:
+                self.queue.put((snapshots, paths), block=not self.drop_superseded)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.n_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            snapshots, paths = self.queue.get()
+            try:
+                for snapshot, path in zip(snapshots, paths):
+                    try:
+                        self._write(snapshot, path)
+                    except Exception as e:
+                        print(colored('Failed to write checkpoint %s: %s' % (path, e), 'red'))
+                missing = [path for path in paths if not os.path.isfile(path)]
+                if missing:
+                    # the checkpoint directory holds an incomplete (or mixed epoch) set of models
+                    self.n_incomplete += 1
+                    print(colored('Incomplete checkpoint, not written: %s' % ', '.join(missing), 'red'))
+            finally:
+                self.queue.task_done()
+
+    def _write(self, snapshot, path):
+        digest = snapshot_digest(snapshot)
+        last_digest, last_path = self.last_written.get(snapshot['name'], (None, None))
+
+        if digest == last_digest and os.path.isfile(last_path):
+            # unchanged model (e.g. frozen): nothing to write, at most link the previous file to the new name
+            self.n_skipped += 1
+            if path == last_path:
+                return
+            try:
+                os.link(last_path, path + '.tmp')
+                os.replace(path + '.tmp', path)
+            except OSError:
+                shutil.copyfile(last_path, path + '.tmp')
+                os.replace(path + '.tmp', path)
+        else:
+            write_snapshot(snapshot, path)
+            self.n_written += 1
+
+        self.last_written[snapshot['name']] = (digest, path)
+        if self.neptune_ckpt:
+            neptune.log_artifact(path)
+
 
 class EvaluateCallback(tf.keras.callbacks.Callback):
 
@@ -177,7 +364,12 @@ class EvaluateCallback(tf.keras.callbacks.Callback):
 
 class SaveGifsCallback(tf.keras.callbacks.Callback):
 
-    def __init__(self, period, iterator, ckpt_dir, name, bs):
+    def __init__(self, period, iterator, ckpt_dir, name, bs, fmt='gif', workers=2, max_pending=64, grid=False):
+        """
+        Encoding is handed to a MediaWriter process pool, so only the predict call runs on the training thread.
+        - fmt: (str) 'gif' or 'png' (animated PNG)
+        - grid: (boolean) save ground truth, prediction and error side by side
+        """
         super(tf.keras.callbacks.Callback, self).__init__()
         super().__init__()
         self.period = period
@@ -185,6 +377,8 @@ class SaveGifsCallback(tf.keras.callbacks.Callback):
         self.name = name
         self.bs = bs
         self.iterator = iterator
+        self.grid = grid
+        self.writer = MediaWriter(workers=workers, max_pending=max_pending, fmt=fmt)
 
     def on_epoch_end(self, epoch, logs=None):
 
@@ -193,22 +387,25 @@ class SaveGifsCallback(tf.keras.callbacks.Callback):
             x, imgs, mu, logvar = self.model.predict(x=self.iterator, steps=1)
             # x, imgs = self.model.predict(x=self.iterator, steps=1)
 
-            save_gifs(sequence=np.clip(x[:self.bs], a_min=0.0, a_max=1.0), name=self.name,
-                      save_dir=self.ckpt_dir)
+            gt = np.clip(imgs[:self.bs], a_min=0.0, a_max=1.0) if self.grid else None
+            self.writer.save_batch(np.clip(x[:self.bs], a_min=0.0, a_max=1.0), name=self.name,
+                                   save_dir=self.ckpt_dir, gt=gt)
 
+    def on_train_end(self, logs=None):
+        self.writer.close()
 
-class NeptuneCallback(tf.keras.callbacks.Callback):
 
-    def __init__(self, user, project_name, log=True, ckpt=True):
-        super(tf.keras.callbacks.Callback, self).__init__()
-        super().__init__()
-        init_path = user + '/' + project_name
-        neptune.init(init_path)
-        neptune.create_experiment(name=project_name)
+class NeptuneCallback(MetricsCallback):
 
-    def on_epoch_end(self, epoch, logs=None):
-        for val, key in zip(logs.values(), logs.keys()):
-            neptune.log_metric(key, val)
+    def __init__(self, user, project_name, log=True, ckpt=True, local_path=None, batch_period=None):
+        """
+        Logs to neptune through a buffered MetricsSink, so the neptune calls happen on a background thread.
+        - local_path: (str) optionally also append the records to this JSONL file
+        """
+        backends = [NeptuneBackend(user, project_name)]
+        if local_path is not None:
+            backends.append(JsonlBackend(local_path))
+        super(NeptuneCallback, self).__init__(MetricsSink(backends), batch_period=batch_period)
 
 
 def npy_to_gif(npy, filename, fps=10):
@@ -216,18 +413,17 @@ def npy_to_gif(npy, filename, fps=10):
     _ = clip.write_gif(filename, logger=None, verbose=False)
 
 
-def save_gifs(sequence, name, save_dir):
-
-    SEQ_LEN = sequence.shape[1]
-    BATCH_SIZE = sequence.shape[0]
-
-    for b in range(BATCH_SIZE):
-        k = []
-        for i in range(SEQ_LEN):
-            k.append(sequence[b, i, :, :, :])
+def save_gifs(sequence, name, save_dir, writer=None):
+    """
+    Saves one gif per batch element. If a MediaWriter is given the files are encoded in its process pool and this
+    returns immediately.
+    """
+    if writer is not None:
+        return writer.save_batch(sequence, name=name, save_dir=save_dir)
 
-        video = np.stack(k, ) * 255
-        npy_to_gif(video, os.path.join(save_dir, name + '_batch_' + str(b) + '.gif'))
+    videos = to_uint8(sequence)
+    for b in range(videos.shape[0]):
+        npy_to_gif(videos[b], os.path.join(save_dir, name + '_batch_' + str(b) + '.gif'))
     return
 
 